@@ -501,6 +501,37 @@ def test_channel_removeowner_private(register_users):
         }
     ]
 
+def test_channel_removeowner_unauthorised(create_valid_users, create_valid_channels):
+    users = create_valid_users
+    channels = create_valid_channels
+    requests.post(config.url + 'channel/invite/v2', json = {
+        'token' : users['user1']['token'],
+        'channel_id' : channels['public']['channel_id'],
+        'u_id' : users['user2']['auth_user_id']
+    })
+    def removeowner(token):
+        return requests.post(config.url + 'channel/removeowner/v1', json = {
+            'token' : token,
+            'channel_id' : channels['public']['channel_id'],
+            'u_id' : users['user1']['auth_user_id']
+        })
+
+    # a session of the owner that has since logged out
+    session = requests.post(config.url + 'auth/login/v2', json = {
+        'email' : 'user1email@email.com',
+        'password' : 'password'
+    }).json()
+    requests.post(config.url + 'auth/logout/v1', json = {'token' : session['token']})
+
+    assert removeowner(session['token']).status_code == ACCESS_ERROR
+    assert removeowner(users['user2']['token']).status_code == ACCESS_ERROR
+
+    owners = requests.get(config.url + 'channel/details/v2', params = {
+        'token' : users['user1']['token'],
+        'channel_id' : channels['public']['channel_id']
+    }).json()['owner_members']
+    assert [owner['u_id'] for owner in owners] == [users['user1']['auth_user_id']]
+
 # --------------------------------------------------------------------------------------- #
 # ----------------------------- Testing Channel leave ----------------------------------- #
 # --------------------------------------------------------------------------------------- #
@@ -594,3 +625,83 @@ def test_channelleave_private(register_users):
         }
     ]
 
+
+def test_channel_messages_cursor(create_valid_users, create_valid_channels):
+    users = create_valid_users
+    channels = create_valid_channels
+    for i in range(5):
+        requests.post(config.url + 'message/send/v2', json = {
+            'token' : users['user1']['token'],
+            'channel_id' : channels['private']['channel_id'],
+            'message' : f'message {i}'
+        })
+    first = requests.get(config.url + 'channel/messages/v2', params={
+        'token' : users['user1']['token'],
+        'channel_id' : channels['private']['channel_id'],
+        'limit' : 3
+    }).json()
+    assert [m['message'] for m in first['messages']] == ['message 4', 'message 3', 'message 2']
+
+    # a newer message doesn't shift the next page
+    requests.post(config.url + 'message/send/v2', json = {
+        'token' : users['user1']['token'],
+        'channel_id' : channels['private']['channel_id'],
+        'message' : 'message 5'
+    })
+    second = requests.get(config.url + 'channel/messages/v2', params={
+        'token' : users['user1']['token'],
+        'channel_id' : channels['private']['channel_id'],
+        'cursor' : first['next_cursor'],
+        'limit' : 3
+    }).json()
+    assert [m['message'] for m in second['messages']] == ['message 1', 'message 0']
+    assert second['next_cursor'] is None
+
+def test_channel_messages_cursor_other_channel(create_valid_users, create_valid_channels):
+    users = create_valid_users
+    channels = create_valid_channels
+    for _ in range(2):
+        requests.post(config.url + 'message/send/v2', json = {
+            'token' : users['user1']['token'],
+            'channel_id' : channels['private']['channel_id'],
+            'message' : 'hello'
+        })
+    page = requests.get(config.url + 'channel/messages/v2', params={
+        'token' : users['user1']['token'],
+        'channel_id' : channels['private']['channel_id'],
+        'limit' : 1
+    }).json()
+    assert requests.get(config.url + 'channel/messages/v2', params={
+        'token' : users['user1']['token'],
+        'channel_id' : channels['public']['channel_id'],
+        'cursor' : page['next_cursor']
+    }).status_code == INPUT_ERROR
+
+def test_channel_messages_since(create_valid_users, create_valid_channels):
+    users = create_valid_users
+    channels = create_valid_channels
+    for i in range(5):
+        requests.post(config.url + 'message/send/v2', json = {
+            'token' : users['user1']['token'],
+            'channel_id' : channels['private']['channel_id'],
+            'message' : f'message {i}'
+        })
+    def since(**params):
+        return requests.get(config.url + 'channel/messages/v2', params={
+            'token' : users['user1']['token'],
+            'channel_id' : channels['private']['channel_id'],
+            **params
+        }).json()
+
+    everything = since(since=0)
+    assert [m['message'] for m in everything['messages']] == [f'message {i}' for i in range(5)]
+    assert everything['next_since'] is None
+    times = [m['time_created'] for m in everything['messages']]
+    assert times == sorted(times)
+
+    assert 'message 4' in [m['message'] for m in since(since=times[-1])['messages']]
+    assert since(since=0, until=times[0])['messages'] == []
+
+    first = since(since=0, limit=2)
+    assert [m['message'] for m in first['messages']] == ['message 0', 'message 1']
+    assert first['next_since'] == times[2]
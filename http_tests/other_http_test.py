@@ -12,6 +12,9 @@ from http_tests.user_http_test import users, invalid_user, ACCESS_ERROR, INPUT_E
 SEARCH = config.url + 'search/v2'
 REMOVE = config.url + 'admin/user/remove/v1'
 CHANGE = config.url + 'admin/userpermission/change/v1'
+STATS = config.url + 'admin/messages/stats/v1'
+CHANGES = config.url + 'changes/get/v1'
+METRICS = config.url + 'notifications/metrics/v1'
 
 
 @pytest.fixture
@@ -382,3 +385,94 @@ def test_dm_invite_notification(user_info, handle_info):
             'dm_id': dm_info['dm_id'], 
             'notification_message': f"{user1_handle} added you to {dm_name}"}
         ]}
+
+def test_notification_pages(user_info, handle_info):
+    channel_info = requests.post(config.url + CHANNEL_CREATE, \
+    json={'token': user_info['user1']['token'], 'name': CHANNEL_NAME, 'is_public': True}).json()
+
+    requests.post(config.url + CHANNEL_INVITE, \
+    json={'token': user_info['user1']['token'], 'channel_id': channel_info['channel_id'],\
+    'u_id': user_info['user2']['auth_user_id']})
+
+    user2_handle = handle_info['user2_handle']
+    for i in range(3):
+        requests.post(config.url + MESSAGE_SEND, json={
+            'token': user_info['user1']['token'],
+            'channel_id': channel_info['channel_id'],
+            'message': f'{i} @{user2_handle}'
+        })
+
+    first_page = requests.get(config.url + NOTIFICATION, \
+    params={'token': user_info['user2']['token'], 'limit': 3}).json()
+    assert [n['notification_message'] for n in first_page['notifications']] == \
+    [f"{handle_info['user1_handle']} tagged you in {CHANNEL_NAME}: " + f'{i} @{user2_handle}'[:20] \
+    for i in [2, 1, 0]]
+
+    second_page = requests.get(config.url + NOTIFICATION, params={
+        'token': user_info['user2']['token'], 
+        'cursor': first_page['next_cursor'], 
+        'limit': 3
+    }).json()
+    assert second_page['notifications'] == expected_invite_notification_result( \
+    channel_info['channel_id'], -1, handle_info['user1_handle'])['notifications']
+    assert second_page['next_cursor'] is None
+
+def test_notification_metrics(invalid_user):
+    metrics = requests.get(METRICS, params={'token': invalid_user['valid']['token']}).json()
+    assert metrics['depth'] >= 0 and metrics['lag'] >= 0
+
+    assert requests.get(METRICS, \
+        params={'token': invalid_user['invalid']['token']}).status_code == ACCESS_ERROR
+
+#test that message counts are given per channel and per user
+def test_admin_message_stats(users):
+    channel = requests.post(config.url + 'channels/create/v2', json = {
+        'token' : users['user1']['token'], 'name' : 'channelname0', 'is_public' : True
+    }).json()
+    requests.post(config.url + 'channel/invite/v2', json = {'token' : users['user1']['token'], \
+        'channel_id' : channel['channel_id'], 'u_id' : users['user2']['auth_user_id']})
+    for token in [users['user1']['token'], users['user1']['token'], users['user2']['token']]:
+        requests.post(config.url + 'message/send/v2', json = {'token' : token, \
+            'channel_id' : channel['channel_id'], 'message' : 'thisisamessage'})
+
+    resp = requests.get(STATS, params={'token' : users['user1']['token']}).json()
+    assert [stats['channel_id'] for stats in resp['channels']] == [channel['channel_id']]
+    assert sum(day['messages'] for day in resp['channels'][0]['days']) == 3
+    assert resp['users'] == [
+        {'u_id' : users['user1']['auth_user_id'], 'messages' : 2},
+        {'u_id' : users['user2']['auth_user_id'], 'messages' : 1},
+    ]
+
+#test that only owners can see the message counts
+def test_admin_message_stats_not_owner(users):
+    assert requests.get(STATS, \
+        params={'token' : users['user2']['token']}).status_code == ACCESS_ERROR
+
+def test_changes_get(users):
+    first = requests.get(CHANGES, params={'token' : users['user1']['token']}).json()
+    assert first['reset']
+
+    channel = requests.post(config.url + 'channels/create/v2', json = {
+        'token' : users['user1']['token'], 'name' : CHANNEL_NAME, 'is_public' : True
+    }).json()
+    requests.post(config.url + MESSAGE_SEND, json = {'token' : users['user1']['token'], \
+        'channel_id' : channel['channel_id'], 'message' : 'thisisamessage'})
+
+    changes = requests.get(CHANGES, \
+        params={'token' : users['user1']['token'], 'version' : first['version']}).json()
+    assert not changes['reset']
+    assert [event['type'] for event in changes['events']] == ['channel', 'message']
+    assert changes['events'][1]['message']['message'] == 'thisisamessage'
+
+    # the other user isn't in the channel so nothing changed for them
+    other = requests.get(CHANGES, \
+        params={'token' : users['user2']['token'], 'version' : first['version']}).json()
+    assert other['events'] == []
+
+    # nothing has changed since
+    assert requests.get(CHANGES, params={'token' : users['user1']['token'], \
+        'version' : changes['version']}).json()['events'] == []
+
+def test_changes_get_invalid_version(users):
+    assert requests.get(CHANGES, params={'token' : users['user1']['token'], \
+        'version' : 'notaversion'}).status_code == INPUT_ERROR
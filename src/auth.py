@@ -7,20 +7,30 @@ Date:
 '''
 
 from src.error import InputError, AccessError
+from src import data_store
+from src.models import User, Session
+from collections import OrderedDict
 import re
-import json
 import jwt
 import hashlib
+import threading
 
 SECRET = 'atotallysecuresecret'
+TOKEN_CACHE_SIZE = 1000
 
-#simplify reading data
+# payloads of recently verified tokens, least recently used first
+verified_tokens = OrderedDict()
+verified_tokens_lock = threading.Lock()
+
+#simplify reading data, served from memory until data.json changes on disk
 def get_data():
-    return json.load(open('data.json', 'r'))
+    return data_store.load()
 
-# overwrite data.json with the given data
-def write_data(data):
-    json.dump(data, open('data.json', 'w'), indent="")
+# persist the given data, changes lists the records that were modified as
+# ('user', u_id), ('channel', channel_id) or ('message', channel_id, message_id)
+# tuples, if no changes are given the whole of data is written out
+def write_data(data, *changes):
+    data_store.save(data, changes)
 
 #return a hash string, used for passwords
 def hash(string):
@@ -47,18 +57,19 @@ def check_u_id(u_id, ignore_removed=False):
     '''
     
     data = get_data()
-    for i, user in enumerate(data['users']):
-        if user['u_id'] == u_id:
-            if user['name_first'] == 'Removed user' and user['name_last'] == 'Removed user' \
-            and not ignore_removed:
-                raise InputError(description='User has been removed')
-            else:
-                return i
-    raise InputError(description='u_id does not exist')
+    i = data_store.user_index(u_id)
+    if i is None:
+        raise InputError(description='u_id does not exist')
+    user = data['users'][i]
+    if user['name_first'] == 'Removed user' and user['name_last'] == 'Removed user' \
+    and not ignore_removed:
+        raise InputError(description='User has been removed')
+    return i
         
 def new_session_id(u_id):
     '''
-        Takens in a user id and returns a new login session id
+        Takens in a user id and returns a new login session id, session ids are
+        never reused so a logged out token can't become valid again
 
     Arguments:
         u_id (integer) - a user's unique identifier
@@ -69,19 +80,7 @@ def new_session_id(u_id):
     Return Value:
         Returns the new session_id integer
     '''
-    
-    data = get_data()
-    new_session_id = 1
-    try:
-        user = data['users'][check_u_id(u_id)]
-        
-        for session in user['sessions_list']:
-            if session['session_id'] == new_session_id:
-                new_session_id += 1
-    except InputError:
-        #if the user is being registered return 1
-        pass
-    return new_session_id
+    return data_store.next_id('session_id')
 
 def check_token(token):
     '''
@@ -96,44 +95,100 @@ def check_token(token):
     Return Value:
         Returns the index of the user that the token checks for in data['users']
     '''
-    
+    return get_principal(token)['user_index']
+
+def decode_token(token):
+    '''
+        Verifies a token's signature and returns what it encodes, the most
+        recently verified tokens are remembered so they aren't verified again
+
+    Arguments:
+        token (string) - a user's jwt session token
+
+    Exceptions:
+        jwt.InvalidTokenError - Occurs when the token wasn't signed by us
+
+    Return Value:
+        Returns a dictionary with the token's u_id and session_id
+    '''
+    with verified_tokens_lock:
+        payload = verified_tokens.get(token)
+        if payload is not None:
+            verified_tokens.move_to_end(token)
+            return payload
+    payload = jwt.decode(token, SECRET, algorithms=['HS256'])
+    with verified_tokens_lock:
+        verified_tokens[token] = payload
+        if len(verified_tokens) > TOKEN_CACHE_SIZE:
+            verified_tokens.popitem(last=False)
+    return payload
+
+def forget_tokens(u_id, session_id=None):
+    '''
+        Stops remembering the tokens of a user's session, or of all their
+        sessions if no session_id is given
+    '''
+    def matches(payload):
+        return payload['u_id'] == u_id and session_id in [None, payload['session_id']]
+    with verified_tokens_lock:
+        for token, payload in list(verified_tokens.items()):
+            if matches(payload):
+                del verified_tokens[token]
+    principals = data_store.unit_scope('principals')
+    for token, principal in list(principals.items()):
+        if matches(principal):
+            del principals[token]
+
+def get_principal(token):
+    '''
+        Checks a token is valid and works out who it belongs to, the answer is
+        kept for the rest of the request so each token is only checked once
+
+    Arguments:
+        token (string) - a user's jwt session token
+
+    Exceptions:
+        AccessError - Occurs when the u_id or session_id doesn't match anything in data
+
+    Return Value:
+        Returns a dictionary of the user's u_id, session_id, user_index in
+        data['users'] and permission_id
+    '''
+    principals = data_store.unit_scope('principals')
+    if token in principals:
+        return principals[token]
+
     data = get_data()
-    #print(f"token = {token}")
-    token_structure = jwt.decode(token, SECRET, algorithms=['HS256'])
+    token_structure = decode_token(token)
     try:
         user_index = check_u_id(token_structure['u_id'])
-        if token_structure['session_id'] not in \
-            [session['session_id'] for session in data['users'][user_index]['sessions_list']]:
-            print(data['users'][user_index]['sessions_list'])
-
-            raise AccessError(description='invalid token')
     except InputError:
         raise AccessError(description='invalid token') from None
-    return user_index
+    user = data['users'][user_index]
+    if token_structure['session_id'] not in \
+        [session['session_id'] for session in user['sessions_list']]:
+        raise AccessError(description='invalid token')
+
+    principal = {
+        'u_id' : user['u_id'],
+        'session_id' : token_structure['session_id'],
+        'user_index' : user_index,
+        'permission_id' : user['permission_id'],
+    }
+    principals[token] = principal
+    return principal
 
 #checks if a handle is already in use
 def handle_taken(handle):
-    data = get_data()
-    for user in data['users']:
-        if user['handle_str'] == handle:
-            return True
-    return False
+    return data_store.handle_index(handle) is not None
 
 #checks if an id is already used
 def id_taken(id_num):
-    data = get_data()
-    for user in data['users']:
-        if user['u_id'] == id_num:
-            return True
-    return False
+    return data_store.user_index(id_num) is not None
 
 #checks if an email is already in use
 def email_taken(email):
-    data = get_data()
-    for user in data['users']:
-        if email == user['email']:
-            return True
-    return False
+    return data_store.email_index(email) is not None
     
 def valid_email(email):
     return re.search('^[a-zA-Z0-9]+[\\._]?[a-zA-Z0-9]+[@]\\w+[.]\\w{2,3}$', email)
@@ -161,10 +216,7 @@ def generate_handle(name_first, name_last):
     handle = handle.replace('@','')
     handle = handle.replace(' ','')
     if handle_taken(handle):
-        i = 0
-        while handle_taken(handle + str(i)):
-            i += 1
-        return handle + str(i)
+        return data_store.free_handle(handle)
     else:
         return handle
 
@@ -203,9 +255,7 @@ def auth_register(email, password, name_first, name_last):
         raise InputError(description="The last name is not valid")
     
     #Generate unique numbers for id
-    id_num = 1
-    while id_taken(id_num):
-        id_num += 1
+    id_num = data_store.next_id('u_id')
     session_id = new_session_id(id_num)
     data = get_data()
     
@@ -214,18 +264,19 @@ def auth_register(email, password, name_first, name_last):
     if not data['users']:
         permission_id = 1
     
-    data['users'].append({
-        'u_id':id_num, 
-        'name_first': name_first, 
-        'name_last': name_last, 
-        'email': email, 
-        'password': hash(password), 
-        'handle_str': generate_handle(name_first, name_last),
-        'sessions_list' : [{'session_id' : session_id}],
-        'notifications' : [],
-        'permission_id' : permission_id
-    })
-    write_data(data)
+    data['users'].append(User(
+        u_id=id_num,
+        name_first=name_first,
+        name_last=name_last,
+        email=email,
+        password=hash(password),
+        handle_str=generate_handle(name_first, name_last),
+        sessions_list=[Session(session_id=session_id)],
+        notifications=[],
+        notifications_archived=0,
+        permission_id=permission_id
+    ))
+    write_data(data, ('user', id_num))
     return {'token' : generate_token(id_num, session_id), 'auth_user_id' : id_num}
 
 def auth_login(email, password):
@@ -250,13 +301,13 @@ def auth_login(email, password):
     elif not email_taken(email):
         raise InputError(description="The email enetered does not belong to a user")
 
-    for user in data['users']:
-        if user['email'] == email and user['password'] == hash(password):
-            new_id = new_session_id(user['u_id'])
-            user['sessions_list'].append({'session_id' : new_id})
-            write_data(data)
-            return {'token' : generate_token(user['u_id'], new_id), \
-                'auth_user_id' : user['u_id']}
+    user = data['users'][data_store.email_index(email)]
+    if user['password'] == hash(password):
+        new_id = new_session_id(user['u_id'])
+        user['sessions_list'].append(Session(session_id=new_id))
+        write_data(data, ('user', user['u_id']))
+        return {'token' : generate_token(user['u_id'], new_id), \
+            'auth_user_id' : user['u_id']}
                 
     raise InputError(description="The password is not correct")
 
@@ -275,13 +326,15 @@ def auth_logout(token):
         Returns a dictionary containing if the logout was successful or not
     '''
     try:
-        user_index = check_token(token)
-        session_id = jwt.decode(token, SECRET, algorithms=['HS256'])['session_id']
+        principal = get_principal(token)
+        user_index = principal['user_index']
+        session_id = principal['session_id']
         data = get_data()
         for session in data['users'][user_index]['sessions_list']:
             if session['session_id'] == session_id:
                 data['users'][user_index]['sessions_list'].remove(session)
-                write_data(data)
+                write_data(data, ('user', data['users'][user_index]['u_id']))
+        forget_tokens(principal['u_id'], session_id)
         return {'is_success' : True}
     except (AccessError, InputError):
         return {'is_success' : False}    
@@ -0,0 +1,180 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    23 April 2021
+'''
+
+import base64
+import random
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from src import config
+
+# every write moves the workspace on to a new version and the log records
+# which records it changed, so a client can be sent just what changed since
+# the version it last saw. The version and the epoch it belongs to are saved
+# with the data in its sequences (see next_version), so versions keep counting
+# up across restarts and every process using the same files agrees on them.
+# The epoch only changes when the data is cleared, so a version from before a
+# clear is never mistaken for one since. The log itself is only kept in memory
+# and only reaches back to base, whenever the data is read from disk (at start
+# up, when another process changed it or a write was undone) what changed
+# before isn't known so it starts again from there
+log = {
+    'epoch' : None,
+    'version' : 0,
+    'base' : 0,
+    'versions' : array('q'),    # the version of each entry
+    'entries' : [],             # see record
+    'members' : None,           # channel_id -> (is_dm, frozenset of u_ids) as of version
+    'notifications' : None,     # u_id -> how many notifications they'd been sent as of version
+}
+
+# held while the log is read or moved on, restarts can come from any thread
+lock = threading.RLock()
+
+def notification_total(user):
+    return user.notifications_archived + len(user.notifications)
+
+def next_version(data):
+    '''
+        Moves the version saved with the data on for a write about to be made,
+        data that has never been written with a version starts a new epoch
+
+    Arguments:
+        data (dictionary) - the full workspace data
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    sequences = data.setdefault('sequences', {})
+    if 'change_epoch' not in sequences:
+        sequences['change_epoch'] = random.getrandbits(62)
+    sequences['change_version'] = sequences.get('change_version', 0) + 1
+
+def restart(data):
+    '''
+        Starts the log again from the data as it was just read or written in full
+
+    Arguments:
+        data (dictionary) - the full workspace data
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    sequences = data.get('sequences', {})
+    with lock:
+        log['epoch'] = sequences.get('change_epoch')
+        log['version'] = sequences.get('change_version', 0)
+        log['base'] = log['version']
+        log['versions'] = array('q')
+        log['entries'] = []
+        log['members'] = {channel.channel_id : (channel.is_dm, \
+            frozenset(channel.all_members.u_ids)) for channel in data['channels']}
+        log['notifications'] = {user.u_id : notification_total(user) \
+            for user in data['users']}
+
+def record(data, changes):
+    '''
+        Moves the log on to the version saved with the data by one write, with
+        what the write changed. Each entry is one of
+            ('channel', channel_id, is_dm, u_ids of its members before or after)
+            ('message', channel_id, message_id)
+            ('notifications', u_id, how many they had been sent before)
+
+    Arguments:
+        data (dictionary) - the full workspace data as it was written
+        changes (list) - tuples of (change, record) for each record the write
+                         changed (see data_store.locate), where record is the
+                         record as it is now or None if it was removed
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    with lock:
+        if log['members'] is None:
+            return
+        log['version'] = data['sequences']['change_version']
+        version = log['version']
+        for change, record in changes:
+            if change[0] == 'channel':
+                is_dm, before = log['members'].get(change[1], (False, frozenset()))
+                if record is None:
+                    log['members'].pop(change[1], None)
+                    after = frozenset()
+                else:
+                    is_dm, after = record.is_dm, frozenset(record.all_members.u_ids)
+                    log['members'][change[1]] = (is_dm, after)
+                add(version, ('channel', change[1], is_dm, before | after))
+            elif change[0] == 'message':
+                add(version, ('message', change[1], change[2]))
+            elif change[0] == 'user':
+                before = log['notifications'].get(change[1], 0)
+                total = 0 if record is None else notification_total(record)
+                log['notifications'][change[1]] = total
+                if total != before:
+                    add(version, ('notifications', change[1], before))
+
+        if len(log['entries']) > 2 * config.changelog_size:
+            #whole versions are dropped so the log never starts part way through one
+            cut = bisect_left(log['versions'], log['versions'][-config.changelog_size])
+            if cut:
+                log['base'] = log['versions'][cut - 1]
+                del log['versions'][:cut]
+                del log['entries'][:cut]
+
+def add(version, entry):
+    log['versions'].append(version)
+    log['entries'].append(entry)
+
+def current():
+    return log['version']
+
+def since(version, upto):
+    '''
+        Finds what changed after one version up to another
+
+    Arguments:
+        version (int) - the version the client last saw, see decode_version
+        upto (int) - the version of the data the client is being answered from
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the entries for the changes, oldest first, or None if the log
+        doesn't reach back to version. There are none if the data being read
+        is older than version
+    '''
+    with lock:
+        if version is None or version < log['base'] or version > log['version']:
+            return None
+        start = bisect_right(log['versions'], version)
+        end = bisect_right(log['versions'], upto)
+        return log['entries'][start:end]
+
+def encode_version(version):
+    return base64.urlsafe_b64encode(f'{log["epoch"]}:{version}'.encode()).decode()
+
+def decode_version(token):
+    '''
+        Reads a version given out by encode_version, a version from another
+        epoch reads as None
+
+    Exceptions:
+        ValueError - Occurs when the token isn't a version at all
+    '''
+    epoch, version = base64.urlsafe_b64decode(token).decode().split(':')
+    return int(version) if epoch == str(log['epoch']) else None
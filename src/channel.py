@@ -9,23 +9,11 @@ Date:
     01 March 2021
 """
 
+import base64
 from src.error import InputError, AccessError
-from src.auth import get_data, write_data, check_token, check_u_id
-from src.user import user_profile, get_user_dictionary
-import jwt
-
-SECRET = 'atotallysecuresecret'
-
-def notify_user(u_id, channel_id, notification_message):
-    data = get_data()
-    channel_index = get_channel_index(channel_id)
-    notification = {
-        'channel_id' : -1 if data['channels'][channel_index]['is_dm'] else channel_id,
-        'dm_id' : channel_id if data['channels'][channel_index]['is_dm'] else -1,
-        'notification_message' : notification_message
-    }
-    data['users'][check_u_id(u_id)]['notifications'].insert(0, notification)
-    write_data(data)
+from src.auth import get_data, write_data, check_token, check_u_id, get_principal
+from src import config, data_store
+from src.notifications import notify_user
 
 def generate_addedChannel_notification(u_id, token, channel_name):
     data = get_data()
@@ -53,9 +41,8 @@ c
         None
     """
     data = get_data()
-    # Decode token to get the u_id
-    token_structure = jwt.decode(token, SECRET, algorithms=['HS256'])
-    auth_user_id = token_structure['u_id']
+    # Get the u_id the token belongs to
+    auth_user_id = get_principal(token)['u_id']
 
     # Check if auth_user_id and/or u_id exists in the database.
     check_token(token)
@@ -83,7 +70,7 @@ c
             channel_name = valid_channel['channel_name']
             # Add user details to the all_members key.
             valid_channel['all_members'].append({'u_id': u_id})
-    write_data(data)
+    write_data(data, ('channel', channel_id))
     notify_user(u_id, channel_id, \
     generate_addedChannel_notification(u_id, token, channel_name))
     return {}
@@ -99,11 +86,10 @@ def check_channel_id(channel_id):
     Return value:
         i (int): index of channel 
     '''
-    data = get_data()
-    for i, channel in enumerate(data['channels']):
-        if channel['channel_id'] == channel_id:
-            return i
-    raise InputError(description='Channel ID not valid')
+    i = data_store.channel_index(channel_id)
+    if i is None:
+        raise InputError(description='Channel ID not valid')
+    return i
 
 
 def channel_details(token, channel_id):
@@ -158,21 +144,8 @@ def channel_messages(token, channel_id, start):
     Returns:
         Returns (dict) which contains the messages, the starting index and the end index
     '''
-    
-    user_index = check_token(token)
-
-    data = get_data()
-
-    # check user is not a removed user
-    try:
-        check_u_id(data['users'][user_index]['u_id'])
-    except InputError:
-        raise AccessError(description='User ID is not valid')
-
-    channel_index = check_channel_id(channel_id)
+    data, channel_index, _ = check_messages_request(token, channel_id, None)
 
-    check_is_member(data['users'][user_index]['u_id'], data['channels'][channel_index]['all_members'])
-    
     num_messages= len(data['channels'][channel_index]['messages'])
     if start > num_messages:
         raise InputError('Start is greater than the total number of messages in the channel')
@@ -192,8 +165,78 @@ def channel_messages(token, channel_id, start):
     
     return {'messages' : channel_messages, 'start' : start, 'end' : end}
 
+def channel_messages_page(token, channel_id, cursor, limit):
+    '''
+    Returns a page of messages from newest to oldest, starting just before the
+    message the cursor was anchored on rather than at an offset, so messages
+    arriving between pages don't shift them and finding the start of a page
+    costs the same however far back it is
+
+    Arguments:
+        token (str) - session specific user ID
+        channel_id (int) - ID of channel of which messages are requested
+        cursor (str) - the next_cursor from the previous page, or None for the newest page
+        limit (int) - how many messages to return, or None for config.messages_page_size
+
+    Exceptions:
+        InputError  - Occurs when channel ID is not a valid ID, when the cursor 
+            wasn't given out for this channel or when limit is out of range
+        AccessError - Occurs when token is not valid or when user is not a 
+            member of the specified channel
+
+    Returns:
+        Returns (dict) which contains the messages and the cursor of the next page,
+        which is None once the oldest message has been returned
+    '''
+    data, channel_index, limit = check_messages_request(token, channel_id, limit)
+
+    messages = data['channels'][channel_index]['messages']
+    end = len(messages) if cursor is None else cursor_position(cursor, channel_id, channel_index)
+    start = max(end - limit, 0)
+
+    next_cursor = None
+    if start > 0:
+        next_cursor = encode_cursor(channel_id, messages.message_ids[start], start)
+    return {'messages' : messages[start:end][::-1], 'next_cursor' : next_cursor}
 
-def channel_leave(auth_user_id, channel_id):
+def channel_messages_since(token, channel_id, since, until, limit):
+    '''
+    Returns the messages sent from one time up to another, oldest first, found
+    by bisecting the channel's message times. Clients keeping a channel in sync
+    ask for the messages since the newest time they have seen
+
+    Arguments:
+        token (str) - session specific user ID
+        channel_id (int) - ID of channel of which messages are requested
+        since (int) - seconds since the epoch, messages sent at or after it are returned
+        until (int) - seconds since the epoch messages must be sent before, or None
+        limit (int) - how many messages to return, or None for config.messages_page_size
+
+    Exceptions:
+        InputError  - Occurs when channel ID is not a valid ID or when limit is out of range
+        AccessError - Occurs when token is not valid or when user is not a 
+            member of the specified channel
+
+    Returns:
+        Returns (dict) which contains the messages and next_since, the time to ask
+        from for the rest if there were more than limit, otherwise None. Messages
+        sent in the same second as next_since can be returned again
+    '''
+    data, channel_index, limit = check_messages_request(token, channel_id, limit)
+
+    messages = data['channels'][channel_index]['messages']
+    positions = messages.sent_between(since, until)
+
+    next_since = None
+    if len(positions) > limit:
+        next_since = messages.times[positions[limit]]
+    return {
+        'messages' : [messages[position] for position in positions[:limit]],
+        'next_since' : next_since,
+    }
+
+
+def channel_leave(token, channel_id):
     ''' 
     Given a channel ID, the user removed as a member of this channel. Their  
     messages should remain in the channel.
@@ -212,17 +255,16 @@ def channel_leave(auth_user_id, channel_id):
     if channel_is_valid(channel_id) == False:
         raise InputError("Invalid channel_id")    
 
-    if user_is_member(token, channel_id) == False:
-        raise AccessError("Auth user is not a member")
-
     data = get_data()
     user_index = check_token(token)
-    
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            channel['all_members'].remove(user_profile(token, data['users'][user_index]['u_id']))  
+    channel = data['channels'][get_channel_index(channel_id)]
+
+    if user_is_member(data['users'][user_index]['u_id'], channel) == False:
+        raise AccessError("Auth user is not a member")
+
+    channel['all_members'].remove(data['users'][user_index]['u_id'])
 
-    write_data(data)
+    write_data(data, ('channel', channel_id))
     return {}
 
 
@@ -261,9 +303,9 @@ def channel_join(token, channel_id):
     except AccessError:
         if not data['channels'][channel_index]['is_public']:
             check_global_owner(data['users'][user_index]['permission_id'])
-        details = get_user_dictionary(data['users'][user_index])
-        data['channels'][channel_index]['all_members'].append(details)
-        write_data(data)
+        data['channels'][channel_index]['all_members'].append(\
+            {'u_id' : data['users'][user_index]['u_id']})
+        write_data(data, ('channel', channel_id))
         return {}
 
 def channel_addowner(token, channel_id, u_id):
@@ -295,12 +337,11 @@ def channel_addowner(token, channel_id, u_id):
     if user_is_owner_token(token, channel_id) == False:
         raise AccessError("Auth is not owner of Dreams or this channel")
     
-    # Append user id to the owner list
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            channel['owner_members'].append(user_profile(token, u_id))            
+    # Add user id to the owner list
+    check_u_id(u_id)
+    data['channels'][get_channel_index(channel_id)]['owner_members'].append(u_id)
     
-    write_data(data)
+    write_data(data, ('channel', channel_id))
 
     return {}
 
@@ -315,7 +356,7 @@ def channel_removeowner(token, channel_id, u_id):
 
     Exceptions:
         InputError - Invalid channel id
-        InputError - User is already an owner of the channel
+        InputError - User is not an owner of the channel
         InputError - User is the only owner of the channel
         AccessError - Auth user is not an owner of Dreams or this channel
 
@@ -323,12 +364,26 @@ def channel_removeowner(token, channel_id, u_id):
         None
     '''
     data = get_data()
-    
-    for i, channel in enumerate(data['channels']):
-        if channel['channel_id'] == channel_id:
-            channel['owner_members'].remove(user_profile(token, u_id))   
 
-    write_data(data)
+    user_index = check_token(token)
+
+    if channel_is_valid(channel_id) == False:
+        raise InputError("Invalid channel_id")
+
+    if user_is_owner_token(token, channel_id) == False and \
+        data['users'][user_index]['permission_id'] != 1:
+        raise AccessError("Auth is not owner of Dreams or this channel")
+
+    if user_is_owner_uid(u_id, channel_id) == False:
+        raise InputError("User is not an owner of the channel")
+
+    if num_owners(token, channel_id) == 1:
+        raise InputError("User is the only owner of the channel")
+
+    # Remove user id from the owner list
+    data['channels'][get_channel_index(channel_id)]['owner_members'].remove(u_id)
+
+    write_data(data, ('channel', channel_id))
 
     return {}
 
@@ -347,20 +402,14 @@ def channel_id_valid(channel_id, channels):
     Return value:
         (bool): Whether or not channel_id could be found.
     """
-    for valid_channel in channels:
-        if channel_id == valid_channel['channel_id']:
-            return True
-    return False
+    return data_store.channel_index(channel_id) is not None
 
 def user_is_member(user_id, channel):
     """
     Given a list of channel members, loop through and return true if user is a member 
     and false otherwise
     """
-    for member in channel['all_members']:
-        if user_id == member['u_id']:
-            return True
-    return False
+    return user_id in channel['all_members']
 
 def get_channel_details(channel):
     """
@@ -402,7 +451,6 @@ def get_member_details(member_list):
 
     for member in member_list:
         details.append(get_user_details(member['u_id'], data['users']))
-    write_data(data)
     return details
 
 
@@ -419,12 +467,7 @@ def get_channel_index(channel_id):
     Returns:
         Returns i (int) which is the index of the given channel
     """
-    data = get_data()
-    i = 0
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            return i
-        i += 1
+    return data_store.channel_index(channel_id)
         
 def member_check(user_id, channel_id, channels):
     """
@@ -438,13 +481,12 @@ def member_check(user_id, channel_id, channels):
     Returns:
         (bool): Whether or not user could be found in the given channel.
     """
-    for valid_channel in channels:
-        if valid_channel['channel_id'] == channel_id:
-            # Check if auth_user is a part of members
-            for members in valid_channel['all_members']:
-                if members['u_id'] == user_id:
-                    return True
-    return False
+    if not isinstance(channel_id, int):
+        return False
+    channel_index = data_store.channel_index(channel_id)
+    if channel_index is None:
+        return False
+    return user_id in channels[channel_index]['all_members']
 
 def user_is_global(auth_user_id):
     """
@@ -459,12 +501,7 @@ def channel_public(channel_id):
     """
     Given a valid channel ID, return True if it is public or False otherwise
     """
-    data = get_data()
-    i = 0
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            return i
-        i += 1
+    return data_store.channel_index(channel_id)
 
 def get_user_details(auth_user_id, users):
     """
@@ -486,10 +523,79 @@ def get_user_details(auth_user_id, users):
     return details
 
 def user_id_valid(user_id, users):
-    for valid_user in users:
-        if valid_user['u_id'] == user_id:
-            return True
-    return False
+    return data_store.user_index(user_id) is not None
+
+def check_messages_request(token, channel_id, limit):
+    '''
+    Checks a request for a channel's messages, shared by every way of reading them
+
+    Arguments:
+        token (str) - session specific user ID
+        channel_id (int) - ID of channel of which messages are requested
+        limit (int) - how many messages to return, or None for config.messages_page_size
+
+    Exceptions:
+        InputError  - Occurs when channel ID is not a valid ID or when limit is out of range
+        AccessError - Occurs when token is not valid or when user is not a 
+            member of the specified channel
+
+    Returns:
+        Returns a tuple of the data, the index of the channel in data['channels']
+        and the limit
+    '''
+    user_index = check_token(token)
+
+    data = get_data()
+
+    # check user is not a removed user
+    try:
+        check_u_id(data['users'][user_index]['u_id'])
+    except InputError:
+        raise AccessError(description='User ID is not valid')
+
+    channel_index = check_channel_id(channel_id)
+
+    check_is_member(data['users'][user_index]['u_id'], data['channels'][channel_index]['all_members'])
+
+    if limit is None:
+        limit = config.messages_page_size
+    if limit < 1 or limit > config.messages_max_page_size:
+        raise InputError(description='Page size is out of range')
+    return (data, channel_index, limit)
+
+def encode_cursor(channel_id, message_id, position):
+    '''
+    Packs the message a page ended on into an opaque string
+    '''
+    cursor = f'{channel_id}:{message_id}:{position}'
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+def cursor_position(cursor, channel_id, channel_index):
+    '''
+    Finds where the page after a cursor ends, the anchor message is found through
+    the message index and if it has since been removed its old position is used,
+    every message older than it is still before that position
+
+    Parameters:
+        cursor (str): a cursor from encode_cursor
+        channel_id (int): ID of the channel being paged through
+        channel_index (int): the channel's index in data['channels']
+
+    Returns:
+        (int): the index in the channel's messages the next page ends before
+    '''
+    try:
+        cursor_channel, message_id, position = \
+            [int(part) for part in base64.urlsafe_b64decode(cursor).decode().split(':')]
+    except ValueError:
+        raise InputError(description='Cursor is not valid')
+    if cursor_channel != channel_id or position < 0:
+        raise InputError(description='Cursor is not valid')
+
+    location = data_store.message_location(message_id)
+    if location is not None and location[0] == channel_index:
+        return location[1]
+    return min(position, len(get_data()['channels'][channel_index]['messages']))
 
 def check_is_member(user_id, members):
     '''
@@ -497,14 +603,13 @@ def check_is_member(user_id, members):
 
     Parameters:
         user_id (int): ID of user being validated.
-        members (list): list of dictionaries containing user details of members of channel
+        members (Members): the all_members of the channel
 
     Returns:
         (bool): True is user is member of channel
     '''
-    for member in members:
-        if member['u_id'] == user_id:
-            return True
+    if user_id in members:
+        return True
     raise AccessError(description='User is not member of channel')
 
 def check_channel_id(channel_id):
@@ -518,32 +623,10 @@ def check_channel_id(channel_id):
     Return value:
         i (int): index of channel 
     '''
-    data = get_data()
-    for i, channel in enumerate(data['channels']):
-        if channel['channel_id'] == channel_id:
-            return i
-    raise InputError(description='Channel ID not valid')
-
-def user_is_owner_token(token, channel_id):
-    ''' Checks if auth user is an owner of a channel given a 
-        channel id and token. 
-
-        Arguments:
-            token - Token for auth user
-            channel_id - Channel identification 
-
-        Returns:
-            True if auth is an owner, false otherwise.
-    '''
-
-    user_index = check_token(token)
-    data = get_data()
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for owner in channel['owner_members']:
-                if owner['u_id'] == data['users'][user_index]['u_id']:
-                    return True
-    return False
+    i = data_store.channel_index(channel_id)
+    if i is None:
+        raise InputError(description='Channel ID not valid')
+    return i
 
 def user_is_owner_token(token, channel_id):
     ''' Checks if auth user is an owner of a channel given a 
@@ -559,12 +642,7 @@ def user_is_owner_token(token, channel_id):
 
     user_index = check_token(token)
     data = get_data()
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for owner in channel['owner_members']:
-                if owner['u_id'] == data['users'][user_index]['u_id']:
-                    return True
-    return False
+    return user_is_owner_uid(data['users'][user_index]['u_id'], channel_id)
 
 def user_is_owner_uid(u_id, channel_id):
     ''' Checks if user is an owner of a channel given a 
@@ -579,12 +657,10 @@ def user_is_owner_uid(u_id, channel_id):
     '''
     
     data = get_data()
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for owner in channel['owner_members']:
-                if owner['u_id'] == u_id:
-                    return True
-    return False
+    channel_index = data_store.channel_index(channel_id)
+    if channel_index is None:
+        return False
+    return u_id in data['channels'][channel_index]['owner_members']
 
 def channel_is_valid(channel_id):
     ''' Checks weather a channel is valid given a channel id. 
@@ -596,11 +672,7 @@ def channel_is_valid(channel_id):
             Returns True if a channel is found in the data, False otherwise. 
     '''
 
-    data = get_data()
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            return True
-    return False
+    return data_store.channel_index(channel_id) is not None
 
 def num_owners(token, channel_id):
     ''' Given a token and channel id, counts the number of owners for 
@@ -616,12 +688,10 @@ def num_owners(token, channel_id):
 
     user_index = check_token(token)
     data = get_data()
-    num_owners = 0
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for owner in channel['owner_members']:
-                num_owners += 1
-    return num_owners
+    channel_index = data_store.channel_index(channel_id)
+    if channel_index is None:
+        return 0
+    return len(data['channels'][channel_index]['owner_members'])
 
 def check_global_owner(permission_id):
     '''
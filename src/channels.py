@@ -7,15 +7,14 @@ Date:
     01 March 2021
 '''
 
-from src.auth import get_data, write_data, check_token
+from src.auth import get_data, write_data, check_token, get_principal
+from src import data_store
+from src.members import Members
+from src.models import Channel
 from src.channel import user_id_valid
 from src.error import InputError, AccessError
 from src.user import user_profile
 
-import jwt
-
-SECRET = 'atotallysecuresecret'
-
 def channels_list(token, is_dm=False):
     '''
     Given a user ID, if the ID is valid, this function returns a list of channels 
@@ -35,10 +34,7 @@ def channels_list(token, is_dm=False):
     # Check if auth_user exists in the database
     data = get_data()
     
-    user = check_token(token)
-
-    token_structure = jwt.decode(token, SECRET, algorithms=['HS256'])
-    u_id = token_structure['u_id']
+    u_id = get_principal(token)['u_id']
     
     if is_dm:
         dm_dict = {
@@ -47,15 +43,14 @@ def channels_list(token, is_dm=False):
         
         dm_list = dm_dict['dms']
 
-        for channel in data['channels']:
+        for channel_index in data_store.user_channels(u_id):
+            channel = data['channels'][channel_index]
             if is_dm == channel['is_dm']:
                 dm = {
                     'dm_id': channel['channel_id'],
                     'dm_name': channel['channel_name']
                 }
-                for member in channel['all_members']:
-                    if member['u_id'] == u_id:
-                        dm_list.append(dm)
+                dm_list.append(dm)
         return dm_dict
 
     if not is_dm: 
@@ -65,17 +60,16 @@ def channels_list(token, is_dm=False):
 
         channel_list = channel_dict['channels']
 
-        # Loop through all channels stored in data file.
-        for channel in data['channels']:
+        # Loop through the channels the user is a member of.
+        for channel_index in data_store.user_channels(u_id):
+            channel = data['channels'][channel_index]
             if is_dm == channel['is_dm']:
                 # Get details of the current channel.
                 curr_channel = {
                     'channel_id': channel['channel_id'],
                     'channel_name': channel['channel_name']
                 }
-                for member in channel['all_members']:
-                    if member["u_id"] == u_id:
-                        channel_list.append(curr_channel)
+                channel_list.append(curr_channel)
         return channel_dict
     
 
@@ -137,8 +131,8 @@ def channels_create(token, name, is_public, is_dm=False):
     """
     data = get_data()
 
-    # Validate token
-    check_token(token)
+    # Validate token and get the u_id
+    u_id = get_principal(token)['u_id']
 
     # Name is longer than 20 chars long.
     if not is_dm and len(name) > 20:
@@ -148,43 +142,30 @@ def channels_create(token, name, is_public, is_dm=False):
     if len(name) == 0:
         raise InputError(description="Invalid channel name!")
 
-    # Decode token to get the u_id
-    token_structure = jwt.decode(token, SECRET, algorithms=['HS256'])
-    u_id = token_structure['u_id']
-
     # Look into the database to find a new channel_id.
-    channel_id = channel_id_generate(data['channels'])
-
-    # Decode token to get the u_id
-    token_structure = jwt.decode(token, SECRET, algorithms=['HS256'])
-    u_id = token_structure['u_id']
+    channel_id = channel_id_generate()
 
     # Add channel details to the database.
     channel_details = create_channel_details(channel_id, name, token, u_id, is_public, is_dm)
     data['channels'].append(channel_details)
-    write_data(data)
+    write_data(data, ('channel', channel_id))
 
     return {
         'channel_id': channel_id,
     }
 
 
-def channel_id_generate(all_channels):
+def channel_id_generate():
     """
     Generates a channel id for a given channel.
 
     Arguments:
-        all_channels (list): Contains a list of existing channels.
+        None
 
     Return Value:
-        Available channel_id (int).
+        Available channel_id (int), never one that was used by a removed channel or dm.
     """
-    channel_id = 1
-    for channel in all_channels:
-        if channel['channel_id'] == channel_id:
-            # Keep incrementing channel_id by 1 until we get a new channel_id
-            channel_id += 1
-    return channel_id
+    return data_store.next_id('channel_id')
 
 def create_channel_details(channel_id, name, token, u_id, is_public, is_dm):
     """
@@ -199,22 +180,20 @@ def create_channel_details(channel_id, name, token, u_id, is_public, is_dm):
     Returns:
         Available channel_id (int)
     """
-    owner_details = []
-    owner_details.append({'u_id': u_id})
+    owner_details = Members([u_id])
 
     # The only member that exists is the owner
-    all_member_details = []
-    all_member_details.append({'u_id': u_id})
-
-    channel_details = {
-        'channel_id' : channel_id,
-        'channel_name' : name,
-        'owner_members' : owner_details,
-        'all_members' : all_member_details,
-        'is_public' : is_public,
-        'is_dm' : is_dm,
-        'messages' : []
-    }
+    all_member_details = Members([u_id])
+
+    channel_details = Channel(
+        channel_id=channel_id,
+        channel_name=name,
+        owner_members=owner_details,
+        all_members=all_member_details,
+        is_public=is_public,
+        is_dm=is_dm,
+        messages=[]
+    )
     return channel_details
 
 
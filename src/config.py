@@ -1,3 +1,71 @@
+import os
+
 port = 8086
 
-url = f"http://localhost:{port}/"
\ No newline at end of file
+url = f"http://localhost:{port}/"
+
+# how the workspace is persisted: 'json' rewrites data.json on every change,
+# 'journal' appends each change to data.journal and only rewrites data.json
+# as a snapshot once journal_snapshot_every records have built up, 'sqlite'
+# keeps every record in indexed tables in data.sqlite and 'sharded' keeps
+# users and channels in data.json with each channel's messages in its own
+# file under data_messages/ and the id sequences in data_sequences.json
+storage = os.environ.get('DREAMS_STORAGE', 'json')
+journal_snapshot_every = 1000
+
+# 'fcntl' has every process using the data files take an advisory lock on
+# data.lock, shared while reading them and exclusive for a whole unit of work
+# that writes, so several worker processes can serve the same workspace.
+# 'none' leaves them unlocked for a single process
+locking = os.environ.get('DREAMS_LOCKING', 'none')
+
+# how hard each write tries to survive a crash. 'always' syncs every write
+# and the rename that replaces a file straight away, 'interval' syncs them
+# every sync_interval milliseconds so at most that much is lost and 'os'
+# leaves it to the operating system. Either way a file is replaced atomically
+# and only once its new contents are on disk, so a crash leaves the old or
+# the new version and never an empty file
+durability = os.environ.get('DREAMS_DURABILITY', 'always')
+sync_interval = 50
+
+# how many ids each process reserves from a sequence at once, raise it when
+# running several workers so they don't have to save the sequence for every id
+id_block_size = 1
+
+# how many messages a page from channel/messages or dm/messages holds when
+# paging by cursor, and the most a single request can ask for
+messages_page_size = 50
+messages_max_page_size = 1000
+
+# how many of their newest notifications each user record holds, older ones
+# are archived in segments of notifications_segment_size and only read when
+# a page of notifications reaches back past the ones kept
+notifications_kept = 50
+notifications_segment_size = 100
+notifications_max_page_size = 1000
+
+# 'sync' delivers notifications as part of the request that caused them,
+# 'queued' hands them to a background worker that delivers everything queued
+# every notification_flush_interval seconds, notification_batch_size jobs
+# to a commit, and once more when the server shuts down. A job that fails to
+# be delivered is tried again at the next flush, up to notification_attempts
+# times in all
+notification_delivery = os.environ.get('DREAMS_NOTIFICATIONS', 'sync')
+notification_flush_interval = 0.05
+notification_batch_size = 500
+notification_attempts = 3
+
+# changes are made one at a time by a single writer thread, which waits
+# group_commit_interval seconds for other requests to queue up behind the
+# first and then commits up to group_commit_size of them in one write
+group_commit_interval = 0.002
+group_commit_size = 100
+
+# how many changes the log behind changes/get keeps, a client asking for the
+# changes since a version older than the log reaches back has to reload everything
+changelog_size = 10000
+
+# a snapshot's index tables share one copy with the snapshots before them and
+# lay the entries changed since over it, until this many have changed and they
+# are copied again
+snapshot_overlay_size = 2048
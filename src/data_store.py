@@ -0,0 +1,1240 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    12 April 2021
+'''
+
+import copy
+import json
+import queue
+import threading
+import time
+from src import config, sqlite_store, shard_store, search_index, models, files, changelog
+
+DATA_FILE = 'data.json'
+JOURNAL_FILE = 'data.journal'
+
+# the parsed workspace data, the stamp of the files it was read from, how
+# many records have been appended to the journal since the last snapshot and
+# whether replaying it stopped at a bad record (nothing can be appended after
+# one, it would never be replayed)
+cache = {
+    'data' : None,
+    'stamp' : None,
+    'journal_length' : 0,
+    'journal_torn' : False,
+}
+
+# the unit of work of the request being handled on this thread, while it is
+# active every load returns the same data and saves are held back until commit
+unit = threading.local()
+
+def current_stamp():
+    if config.storage == 'sqlite':
+        return sqlite_store.stamp()
+    if config.storage == 'sharded':
+        return shard_store.stamp()
+    if config.storage == 'journal':
+        return (files.file_stamp(DATA_FILE), files.file_stamp(JOURNAL_FILE))
+    return files.file_stamp(DATA_FILE)
+
+def load():
+    '''
+        Returns the workspace data, only reading it from disk again when the
+        files have changed since they were last read or written by this process
+
+    Arguments:
+        None
+
+    Exceptions:
+        FileNotFoundError - Occurs when data.json doesn't exist
+
+    Return Value:
+        Returns the data dictionary shared by every caller in this process
+    '''
+    if in_unit() and unit.data is not None:
+        return unit.data
+    stamp = current_stamp()
+    if cache['data'] is None or cache['stamp'] != stamp:
+        with files.shared_lock():
+            stamp = current_stamp()
+            if config.storage == 'sqlite':
+                data = sqlite_store.load_data()
+            elif config.storage == 'sharded':
+                data = shard_store.load_data(cache['data'])
+            else:
+                with open(DATA_FILE, 'r') as f:
+                    data = json.load(f)
+            models.adopt(data)
+            cache['journal_length'] = 0
+            cache['journal_torn'] = False
+            if config.storage == 'journal':
+                cache['journal_length'], cache['journal_torn'] = replay_journal(data)
+            changelog.restart(data)
+        cache['data'] = data
+        cache['stamp'] = stamp
+    if in_unit():
+        unit.data = cache['data']
+    return cache['data']
+
+def save(data, changes=()):
+    '''
+        Persists the workspace data, or records the changes to be persisted
+        when the unit of work commits if one is active
+
+    Arguments:
+        data (dictionary) - the full workspace data
+        changes (list) - the records that changed, see locate
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    if in_unit() and unit.read_only:
+        raise RuntimeError('data was saved during a read only unit of work')
+    if changes and cache['data'] is data:
+        update_index(data, changes)
+    else:
+        index['data'] = None
+        search_index.reset()
+        for channel in data['channels']:
+            channel.messages.replaced.clear()
+    if not in_unit():
+        changes = persist(data, changes)
+        #sqlite's stamp doesn't change on our own writes, so the snapshot wouldn't be refreshed
+        if snapshots['current'] is not None:
+            publish(data, changes)
+        return
+    if not changes or cache['data'] is not data:
+        unit.full = True
+    unit.changes.extend(changes)
+    unit.written = True
+    unit.data = data
+    cache['data'] = data
+
+def persist(data, changes):
+    '''
+        Writes the workspace data out. In journal storage only the given changes
+        are appended to the journal, in sqlite storage only their rows are
+        written and in sharded storage only the files holding them are
+        rewritten, otherwise (or when no changes are given) data.json is
+        rewritten as a full snapshot. Every write saves the next version of the
+        change log in the sequences (see changelog.next_version)
+
+    Return Value:
+        Returns the changes that were written
+    '''
+    with files.exclusive_lock():
+        #changes made to some other copy of the data can't be written on their own
+        if cache['data'] is not data:
+            changes = ()
+        changelog.next_version(data)
+        if changes and ('sequences',) not in changes:
+            changes = [*changes, ('sequences',)]
+        if config.storage == 'sqlite':
+            sqlite_store.save(data, [(change[0], *locate(data, change), *change[1:]) \
+                for change in changes])
+        elif config.storage == 'sharded':
+            shard_store.save(data, changes)
+        elif config.storage == 'journal' and changes and not cache['journal_torn'] \
+            and cache['journal_length'] + len(changes) < config.journal_snapshot_every:
+            append_journal(data, changes)
+        else:
+            write_snapshot(data)
+        cache['data'] = data
+        cache['stamp'] = current_stamp()
+        log_changes(data, changes)
+    return changes
+
+#the change log is told what each change left behind
+def log_changes(data, changes):
+    if not changes:
+        changelog.restart(data)
+        return
+    changelog.record(data, [(change, locate(data, change)[1]) \
+        for change in changes if change[0] != 'sequences'])
+
+#drops the cached copy so the next load re-reads it from disk
+def invalidate():
+    cache['data'] = None
+    cache['stamp'] = None
+
+#------------------------------------------------------------------------------------#
+#---------------------------------- Unit of work ------------------------------------#
+#------------------------------------------------------------------------------------#
+
+def in_unit():
+    return getattr(unit, 'active', False)
+
+def begin(read_only=False):
+    '''
+        Starts a unit of work on the current thread, until it is committed or
+        rolled back every get_data shares one copy of the data and nothing is
+        written to disk. A read only unit sees the latest published version of
+        the data (see publish) and never waits for one that writes, only one
+        unit that writes can be active at a time across every process using
+        the data files when they are locked (see config.locking)
+
+    Arguments:
+        read_only (boolean) - whether the unit only reads the data
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    snapshot = current_snapshot() if read_only else None
+    if not in_unit() and not read_only:
+        lock.acquire()
+        try:
+            files.acquire_exclusive()
+        except BaseException:
+            lock.release()
+            raise
+    unit.active = True
+    unit.read_only = read_only
+    unit.snapshot = snapshot
+    unit.data = None if snapshot is None else snapshot['data']
+    unit.changes = []
+    unit.full = False
+    unit.written = False
+    unit.scopes = {}
+    unit.callbacks = []
+    unit.reserved = []
+
+def unit_scope(name):
+    '''
+        Returns a dictionary that lasts as long as the current unit of work, for
+        remembering things that are only true for the rest of one request
+
+    Arguments:
+        name (string) - what the dictionary is used for
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the dictionary, or an empty one that isn't kept if no unit of
+        work is active
+    '''
+    if not in_unit():
+        return {}
+    return unit.scopes.setdefault(name, {})
+
+def after_commit(callback):
+    '''
+        Runs callback once everything saved so far has been written, straight
+        away if no unit of work is active and never if the unit is rolled back
+
+    Arguments:
+        callback (function) - takes no arguments
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    if not in_unit():
+        callback()
+        return
+    unit.callbacks.append(callback)
+
+def commit():
+    '''
+        Writes everything saved during the unit of work out in one go
+    '''
+    if not in_unit():
+        return
+    try:
+        if unit.written:
+            #each record only needs writing once however often it changed
+            changes = () if unit.full else list(dict.fromkeys(unit.changes))
+            changes = persist(unit.data, changes)
+            if snapshots['current'] is not None:
+                publish(unit.data, changes)
+    except BaseException:
+        drop_reserved()
+        raise
+    finally:
+        end_unit()
+    for callback in unit.callbacks:
+        callback()
+
+def rollback():
+    '''
+        Throws away everything saved during the unit of work, the data is
+        re-read from disk on the next load
+    '''
+    if not in_unit():
+        return
+    if unit.written:
+        invalidate()
+    drop_reserved()
+    end_unit()
+
+def end_unit():
+    unit.active = False
+    if not unit.read_only:
+        files.release_exclusive()
+        lock.release()
+
+#------------------------------------------------------------------------------------#
+#------------------------------------ Snapshots -------------------------------------#
+#------------------------------------------------------------------------------------#
+
+# held by whichever thread has a unit of work that writes active
+lock = threading.Lock()
+
+# the latest committed version of the data that read only units see. Once a
+# version is published nothing in it is changed again, the next commit
+# publishes a new one which shares every record it didn't change with it
+snapshots = {
+    'current' : None,   # see publish
+    'version' : 0,
+}
+
+# the index tables snapshots are published with, see indexed. The rest are
+# only needed by the writer
+SNAPSHOT_TABLES = ['users', 'emails', 'handles', 'channels', 'messages', 'memberships']
+
+# the keys of each index table that have changed since the latest snapshot
+# was published, or None for a table that was built again from scratch. They
+# aren't kept while there is no snapshot, the first one copies every table
+dirty = {}
+
+# an entry a snapshot's index table no longer has, see Overlay
+REMOVED = object()
+
+def reading_snapshot():
+    return in_unit() and unit.read_only
+
+#the version of the change log the data being read is at
+def change_version():
+    if reading_snapshot():
+        return unit.snapshot['change_version']
+    return changelog.current()
+
+def current_snapshot():
+    '''
+        Finds the latest published version of the data, the first time it's
+        needed or when the files were changed by another process the writer
+        publishes it from disk. Snapshots are only published once something
+        asks for one
+
+    Arguments:
+        None
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the snapshot, see publish
+    '''
+    snapshot = snapshots['current']
+    #while a unit is writing the files on disk are ahead of the snapshot until it commits
+    if snapshot is None or not lock.locked() and snapshot['stamp'] != current_stamp():
+        submit(refresh_snapshot)
+        snapshot = snapshots['current']
+    return snapshot
+
+def refresh_snapshot():
+    snapshot = snapshots['current']
+    if snapshot is None or snapshot['stamp'] != current_stamp():
+        publish(load(), ())
+
+def publish(data, changes):
+    '''
+        Makes the data as it was just committed the latest version for read only
+        units. Only the records that changed are copied, every other record is
+        shared with the previous version. So are the index tables, with the
+        entries that changed laid over them (see share_table), and the message
+        columns of the channels whose messages changed (see models.Messages.share)
+
+    Arguments:
+        data (dictionary) - the full workspace data as it was committed
+        changes (list) - the records that changed since the previous version
+                         was published from the same data, see locate, or
+                         an empty list if everything has to be copied
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    previous = snapshots['current']
+    tables = indexed(data)
+    if not changes or previous is None or previous['source'] is not data:
+        snapshot_data = copy.deepcopy(data)
+        snapshot_index = {table : dict(tables[table]) for table in SNAPSHOT_TABLES}
+        search_index.reset()
+    else:
+        users = {}
+        channels = {}
+        messages = {}
+        for change in changes:
+            if change[0] == 'user':
+                users[change[1]] = user_position(data, change[1])
+            elif change[0] == 'channel':
+                channels[change[1]] = channel_position(data, change[1])
+            elif change[0] == 'message':
+                channels.setdefault(change[1], channel_position(data, change[1]))
+                location = message_position(data, change[2])
+                messages.setdefault(change[1], {})[change[2]] = \
+                    None if location is None else location[1]
+
+        snapshot_data = dict(previous['data'])
+        if ('sequences',) in changes:
+            snapshot_data['sequences'] = dict(data['sequences'])
+        if users:
+            snapshot_data['users'] = share_records(previous['data']['users'], \
+                data['users'], 'u_id', users, \
+                lambda user, previous_user: copy.deepcopy(user))
+        if channels:
+            #only the channel's own fields are copied if just its messages changed,
+            #its message columns are shared (see models.Messages.share)
+            def copy_channel(channel, previous_channel):
+                channel_id = channel.channel_id
+                if previous_channel is None or ('channel', channel_id) in changes:
+                    fields = {key : copy.deepcopy(value) \
+                        for key, value in channel.items() if key != 'messages'}
+                else:
+                    fields = {key : value \
+                        for key, value in previous_channel.items() if key != 'messages'}
+                if previous_channel is None or channel_id in messages:
+                    fields['messages'] = channel.messages.share()
+                else:
+                    fields['messages'] = previous_channel.messages
+                return models.Channel(**fields)
+            snapshot_data['channels'] = share_records(previous['data']['channels'], \
+                data['channels'], 'channel_id', channels, copy_channel)
+
+        snapshot_index = dict(previous['index'])
+        for table in SNAPSHOT_TABLES:
+            if table in dirty:
+                snapshot_index[table] = share_table(previous['index'][table], \
+                    tables[table], dirty[table])
+
+        search_index.advance(previous['data'], snapshot_data, \
+            [channel_id for channel_id, position in channels.items() if position is None], \
+            [(channel_id, message_id, snapshot_text(previous, channel_id, message_id), \
+                None if channels[channel_id] is None or position is None \
+                else snapshot_data['channels'][channels[channel_id]]['messages'][position]) \
+                for channel_id in messages for message_id, position in messages[channel_id].items()])
+
+    dirty.clear()
+    snapshots['version'] += 1
+    snapshots['current'] = {
+        'version' : snapshots['version'],
+        'change_version' : changelog.current(),
+        'data' : snapshot_data,
+        'index' : snapshot_index,
+        'stamp' : cache['stamp'],
+        'source' : data,
+    }
+
+class Overlay:
+    '''
+        A read only index table made of a copy of the table that earlier
+        snapshots share and the entries that have changed since it was copied,
+        only get is needed from a snapshot's tables
+    '''
+    __slots__ = ['base', 'changes']
+
+    def __init__(self, base, changes):
+        self.base = base
+        self.changes = changes
+
+    def get(self, key, default=None):
+        value = self.changes.get(key, self)
+        if value is self:
+            return self.base.get(key, default)
+        return default if value is REMOVED else value
+
+def share_table(previous, table, keys):
+    '''
+        Makes the next version of one of a snapshot's index tables, the keys
+        that changed are laid over the previous version's copy of the table
+        until there are config.snapshot_overlay_size of them, then the table
+        is copied again. The sets of channel_ids in memberships are replaced
+        rather than changed so entries can be shared as they are
+
+    Arguments:
+        previous (dictionary or Overlay) - the table in the previous version
+        table (dictionary) - the table as it was committed
+        keys (set) - the keys that changed, or None if they all might have
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the new table
+    '''
+    if keys is None:
+        return dict(table)
+    if isinstance(previous, Overlay):
+        base, changes = previous.base, dict(previous.changes)
+    else:
+        base, changes = previous, {}
+    for key in keys:
+        changes[key] = table.get(key, REMOVED)
+    if len(changes) > min(len(table), config.snapshot_overlay_size):
+        return dict(table)
+    return Overlay(base, changes)
+
+def share_records(previous, records, key, changed, copy_record):
+    '''
+        Makes the next version of a list of records, the changed records are
+        copied and the rest are shared with the previous version
+
+    Arguments:
+        previous (list) - the list in the previous version
+        records (list) - the list as it was committed
+        key (string) - the key each record is identified by
+        changed (dictionary) - the key of each changed record to its position
+                               in records, or None if it was removed
+        copy_record (function) - takes a changed record and its previous
+                                 version (or None) and returns a copy of it
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the new list
+    '''
+    if None in changed.values() or len(records) < len(previous):
+        #something was removed and the records after it moved, match them by key
+        previous_records = {record[key] : record for record in previous}
+        return [previous_records[record[key]] if record[key] in previous_records \
+            and record[key] not in changed else \
+            copy_record(record, previous_records.get(record[key])) for record in records]
+    shared = list(previous)
+    for record in records[len(previous):]:
+        shared.append(copy_record(record, None))
+    for position in changed.values():
+        if position < len(previous):
+            shared[position] = copy_record(records[position], previous[position])
+    return shared
+
+def find_position(records, key, value):
+    return next((i for i, record in enumerate(records) if getattr(record, key) == value), None)
+
+#the text a message had in a published version, or None if it wasn't in it
+def snapshot_text(snapshot, channel_id, message_id):
+    channels = snapshot['data']['channels']
+    channel = snapshot['index']['channels'].get(channel_id)
+    if channel is None or not holds(channels, channel, 'channel_id', channel_id):
+        channel = find_position(channels, 'channel_id', channel_id)
+    if channel is None:
+        return None
+    messages = channels[channel].messages
+    location = snapshot['index']['messages'].get(message_id)
+    if location is not None and holds_message(messages, location[1], message_id):
+        return messages.text(location[1])
+    position = messages.position(message_id)
+    return None if position is None else messages.text(position)
+
+#------------------------------------------------------------------------------------#
+#---------------------------------- Single writer -----------------------------------#
+#------------------------------------------------------------------------------------#
+
+# changes submitted from every thread are made one at a time by the writer
+# thread, which commits everything that queued up together in one write
+writer = {
+    'jobs' : queue.Queue(),
+    'thread' : None,
+}
+
+def start_writer():
+    '''
+        Starts the writer thread, until it is started submitted changes are
+        made on the thread that submits them
+    '''
+    if writer['thread'] is None:
+        writer['thread'] = threading.Thread(target=write_forever, \
+            name='data-writer', daemon=True)
+        writer['thread'].start()
+
+def on_writer():
+    return threading.current_thread() is writer['thread']
+
+def submit(change):
+    '''
+        Has the writer thread make a change to the data as part of the next
+        group commit and waits until it has been written
+
+    Arguments:
+        change (function) - takes no arguments and makes the change
+
+    Exceptions:
+        Raises whatever the change raised, in which case nothing it saved is kept
+
+    Return Value:
+        Returns what the change returned
+    '''
+    job = {
+        'change' : change,
+        'done' : threading.Event(),
+        'result' : None,
+        'error' : None,
+    }
+    #changes made while already writing, such as on the writer thread, are part of that unit
+    if in_unit() and not unit.read_only:
+        return change()
+    if writer['thread'] is None:
+        run_group([job])
+    else:
+        writer['jobs'].put(job)
+        job['done'].wait()
+    if job['error'] is not None:
+        raise job['error']
+    return job['result']
+
+def write_forever():
+    while True:
+        jobs = [writer['jobs'].get()]
+        #give other requests a moment to queue up and share the commit
+        time.sleep(config.group_commit_interval)
+        while len(jobs) < config.group_commit_size:
+            try:
+                jobs.append(writer['jobs'].get_nowait())
+            except queue.Empty:
+                break
+        run_group(jobs)
+
+def run_group(jobs):
+    '''
+        Makes each job's change in one unit of work and commits them together.
+        A job that fails after saving something leaves the data half changed, so
+        the unit is rolled back and the group made again without it
+    '''
+    try:
+        begin()
+        for job in jobs:
+            unit.scopes = {}
+            saved = (len(unit.changes), unit.full, unit.written)
+            try:
+                job['result'] = job['change']()
+            except Exception as error:
+                job['error'] = error
+                if (len(unit.changes), unit.full, unit.written) != saved:
+                    rollback()
+                    run_group([other_job for other_job in jobs if other_job['error'] is None])
+                    return
+        commit()
+    except Exception as error:
+        if in_unit():
+            rollback()
+        invalidate()
+        for job in jobs:
+            if job['error'] is None:
+                job['error'] = error
+    finally:
+        for job in jobs:
+            job['done'].set()
+
+def write_snapshot(data):
+    files.write_json(DATA_FILE, data, indent="", default=models.encode)
+    #everything in the journal is now part of the snapshot
+    if config.storage == 'journal':
+        open(JOURNAL_FILE, 'w').close()
+    cache['journal_length'] = 0
+    cache['journal_torn'] = False
+
+def append_journal(data, changes):
+    lines = []
+    for change in changes:
+        record = {'kind' : change[0], 'key' : list(change[1:]), \
+            'value' : find_record(data, change)}
+        lines.append(json.dumps(record, separators=(',', ':'), \
+            default=models.encode) + '\n')
+    files.append_text(JOURNAL_FILE, ''.join(lines))
+    cache['journal_length'] += len(lines)
+
+def replay_journal(data):
+    '''
+        Applies every record in the journal on top of a snapshot
+
+    Arguments:
+        data (dictionary) - the workspace data read from the snapshot
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns a tuple of the number of records replayed and whether the
+        journal went on past the last one that could be read
+    '''
+    replayed = 0
+    try:
+        with open(JOURNAL_FILE, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    #a record cut short by a crash is the end of the journal
+                    return (replayed, True)
+                apply_record(data, record['kind'], record['key'], record['value'])
+                replayed += 1
+    except FileNotFoundError:
+        pass
+    return (replayed, False)
+
+def find_channel(data, channel_id):
+    position = channel_position(data, channel_id)
+    return None if position is None else data['channels'][position]
+
+def locate(data, change):
+    '''
+        Finds a changed record, a change is one of
+            ('user', u_id)
+            ('channel', channel_id)
+            ('message', channel_id, message_id)
+            ('sequences',) - the highest id reserved for each kind of id and
+                the version of the change log
+
+    Arguments:
+        data (dictionary) - the full workspace data
+        change (tuple) - the record to look up
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns a tuple of the record's index in its list and the record,
+        or (None, None) if it has been removed
+    '''
+    kind = change[0]
+    if kind == 'sequences':
+        return (0, data.get('sequences'))
+    if kind == 'user':
+        position = user_position(data, change[1])
+        records = data['users']
+    elif kind == 'channel':
+        position = channel_position(data, change[1])
+        records = data['channels']
+    else:
+        location = message_position(data, change[2])
+        if location is None or data['channels'][location[0]]['channel_id'] != change[1]:
+            return (None, None)
+        position = location[1]
+        records = data['channels'][location[0]]['messages']
+    if position is None:
+        return (None, None)
+    return (position, records[position])
+
+#the current value of a changed record as it's written to the journal
+def find_record(data, change):
+    record = locate(data, change)[1]
+    if change[0] == 'channel' and record is not None:
+        return {key : value for key, value in record.items() if key != 'messages'}
+    return record
+
+def apply_record(data, kind, key, value):
+    '''
+        Writes a journaled record back into the workspace data, inserting,
+        replacing or removing it as needed
+    '''
+    if kind == 'sequences':
+        data['sequences'] = value
+        return
+    position, record = locate(data, (kind, *key))
+    if kind == 'user':
+        records = data['users']
+        value = models.record(kind, value)
+    elif kind == 'channel':
+        records = data['channels']
+        if value is not None:
+            value = models.channel(dict(value, \
+                messages=[] if record is None else record['messages']))
+    else:
+        channel = find_channel(data, key[0])
+        if channel is None:
+            return
+        records = channel['messages']
+        value = models.record(kind, value)
+
+    if record is None:
+        if value is not None:
+            records.append(value)
+    elif value is None:
+        del records[position]
+    else:
+        records[position] = value
+    update_index(data, [(kind, *key)])
+
+#------------------------------------------------------------------------------------#
+#------------------------------------ Indexes ---------------------------------------#
+#------------------------------------------------------------------------------------#
+
+# hash indexes over one data dictionary, rebuilt whenever a different one is
+# loaded and kept up to date by save from the changes it is given. Read only
+# units use the copy of the tables published with their snapshot instead
+index = {
+    'data' : None,
+    'users' : {},       # u_id -> index in data['users']
+    'channels' : {},    # channel_id -> index in data['channels']
+    'messages' : {},    # message_id -> (channel_id, index in the channel's messages)
+    'emails' : {},      # email -> u_id
+    'handles' : {},     # handle_str -> u_id
+    'user_keys' : {},   # u_id -> (email, handle_str) as they were last indexed
+    'suffixes' : {},    # base handle -> lowest numeric suffix that might be free
+    'members' : {},     # channel_id -> set of u_ids in all_members as they were last indexed
+    'memberships' : {}, # u_id -> frozenset of channel_ids whose all_members they are in
+}
+
+def indexed(data):
+    if reading_snapshot() and unit.snapshot['data'] is data:
+        return unit.snapshot['index']
+    if index['data'] is not data:
+        index['data'] = data
+        for table in SNAPSHOT_TABLES:
+            rebuilt(table)
+        index_users(data)
+        index_channels(data)
+        index['messages'] = {}
+        index['members'] = {}
+        index['memberships'] = {}
+        for channel in data['channels']:
+            index_messages(channel)
+            index_members(channel)
+        index['emails'] = {}
+        index['handles'] = {}
+        index['user_keys'] = {}
+        index['suffixes'] = {}
+        for user in data['users']:
+            index_user_keys(user)
+    return index
+
+#the next snapshot has to know which entries of the index tables changed
+def touch(table, keys):
+    if snapshots['current'] is not None and dirty.get(table, ()) is not None:
+        dirty.setdefault(table, set()).update(keys)
+
+def rebuilt(table):
+    dirty[table] = None
+
+def index_users(data):
+    index['users'] = {user.u_id : i for i, user in enumerate(data['users'])}
+    rebuilt('users')
+
+def index_channels(data):
+    index['channels'] = {channel.channel_id : i \
+        for i, channel in enumerate(data['channels'])}
+    rebuilt('channels')
+
+def index_messages(channel):
+    channel_id = channel.channel_id
+    index['messages'].update((message_id, (channel_id, i)) \
+        for i, message_id in enumerate(channel.messages.message_ids))
+    touch('messages', channel.messages.message_ids)
+
+def index_members(channel):
+    '''
+        Moves a channel's entries in the membership index to its current
+        members, taking it off the users who have left
+    '''
+    channel_id = channel['channel_id']
+    old_members = index['members'].get(channel_id, set())
+    current_members = {member['u_id'] for member in channel['all_members']}
+    memberships = index['memberships']
+    for u_id in old_members - current_members:
+        memberships[u_id] = memberships[u_id] - {channel_id}
+    for u_id in current_members - old_members:
+        memberships[u_id] = memberships.get(u_id, frozenset()) | {channel_id}
+    touch('memberships', old_members ^ current_members)
+    index['members'][channel_id] = current_members
+
+def unindex_members(channel_id):
+    memberships = index['memberships']
+    old_members = index['members'].pop(channel_id, set())
+    for u_id in old_members:
+        memberships[u_id] = memberships[u_id] - {channel_id}
+    touch('memberships', old_members)
+
+def index_user_keys(user):
+    '''
+        Moves a user's entries in the email and handle indexes to their current
+        email and handle, freeing up the ones they had before
+    '''
+    old_email, old_handle = index['user_keys'].get(user['u_id'], (None, None))
+    if old_email != user['email']:
+        if index['emails'].get(old_email) == user['u_id']:
+            del index['emails'][old_email]
+        index['emails'][user['email']] = user['u_id']
+    if old_handle != user['handle_str']:
+        if index['handles'].get(old_handle) == user['u_id']:
+            del index['handles'][old_handle]
+            free_suffix(old_handle)
+        index['handles'][user['handle_str']] = user['u_id']
+    touch('emails', [old_email, user['email']])
+    touch('handles', [old_handle, user['handle_str']])
+    index['user_keys'][user['u_id']] = (user['email'], user['handle_str'])
+
+#a handle that was given out as base + suffix can be handed out again
+def free_suffix(handle):
+    for i in range(1, len(handle)):
+        base, suffix = handle[:i], handle[i:]
+        if suffix.isdigit() and str(int(suffix)) == suffix \
+            and index['suffixes'].get(base, 0) > int(suffix):
+            index['suffixes'][base] = int(suffix)
+
+def update_index(data, changes):
+    '''
+        Brings the indexes up to date after the given records were added,
+        changed or removed. Additions at the end of a list are indexed
+        directly, anything that shifted positions re-indexes its list
+
+    Arguments:
+        data (dictionary) - the full workspace data
+        changes (list) - the records that changed, see locate
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    #the text a message had before it changed is only needed for this save,
+    #a message listed twice would find it already taken the second time
+    changes = list(dict.fromkeys(changes))
+    replaced = {}
+    for change in changes:
+        if change[0] == 'message':
+            position = channel_position(data, change[1]) if index['data'] is data \
+                else find_position(data['channels'], 'channel_id', change[1])
+            if position is not None:
+                messages = data['channels'][position].messages
+                if change[2] in messages.replaced:
+                    replaced[change[2]] = messages.replaced.pop(change[2])
+    if index['data'] is not data:
+        return
+    for change in changes:
+        if change[0] == 'user':
+            reindex(data['users'], 'users', 'u_id', change[1], \
+                lambda: index_users(data))
+            position = index['users'].get(change[1])
+            if position is not None:
+                index_user_keys(data['users'][position])
+        elif change[0] == 'channel':
+            reindex(data['channels'], 'channels', 'channel_id', change[1], \
+                lambda: index_channels(data))
+            position = index['channels'].get(change[1])
+            if position is not None:
+                index_members(data['channels'][position])
+            else:
+                unindex_members(change[1])
+                removed = [message_id for message_id, location \
+                    in index['messages'].items() if location[0] == change[1]]
+                for message_id in removed:
+                    del index['messages'][message_id]
+                touch('messages', removed)
+                search_index.channel_removed(data, change[1])
+        elif change[0] == 'message':
+            reindex_message(data, change[1], change[2])
+            search_index.message_changed(data, change[1], change[2], \
+                replaced.pop(change[2], None), locate(data, change)[1])
+
+def reindex_message(data, channel_id, message_id):
+    channel = find_channel(data, channel_id)
+    touch('messages', [message_id])
+    if channel is None:
+        index['messages'].pop(message_id, None)
+        return
+    location = index['messages'].get(message_id)
+    messages = channel.messages
+    if location is not None and location[0] == channel_id \
+        and holds_message(messages, location[1], message_id):
+        return
+    if messages and messages.message_ids[-1] == message_id:
+        index['messages'][message_id] = (channel_id, len(messages) - 1)
+        return
+    index['messages'].pop(message_id, None)
+    index_messages(channel)
+
+def reindex(records, table, key, value, rebuild):
+    positions = index[table]
+    touch(table, [value])
+    position = positions.get(value)
+    if position is not None and position < len(records) \
+        and records[position][key] == value:
+        return
+    if records and records[-1][key] == value:
+        positions[value] = len(records) - 1
+        return
+    rebuild()
+
+def holds(records, position, key, value):
+    return position < len(records) and getattr(records[position], key) == value
+
+def holds_message(messages, position, message_id):
+    return position < len(messages) and messages.message_ids[position] == message_id
+
+#a position from the indexes is checked against the data before it is trusted,
+#if it is out of date a change hasn't been saved yet and its list is re-indexed.
+#a snapshot's tables are shared so it searches the list instead
+def user_position(data, u_id):
+    position = indexed(data)['users'].get(u_id)
+    if position is None or holds(data['users'], position, 'u_id', u_id):
+        return position
+    if reading_snapshot():
+        return find_position(data['users'], 'u_id', u_id)
+    index_users(data)
+    return index['users'].get(u_id)
+
+def channel_position(data, channel_id):
+    position = indexed(data)['channels'].get(channel_id)
+    if position is None or holds(data['channels'], position, 'channel_id', channel_id):
+        return position
+    if reading_snapshot():
+        return find_position(data['channels'], 'channel_id', channel_id)
+    index_channels(data)
+    return index['channels'].get(channel_id)
+
+def message_position(data, message_id):
+    location = indexed(data)['messages'].get(message_id)
+    if location is None:
+        return None
+    channel = channel_position(data, location[0])
+    if channel is None:
+        return None
+    messages = data['channels'][channel].messages
+    if not holds_message(messages, location[1], message_id) and reading_snapshot():
+        position = messages.position(message_id)
+        return None if position is None else (channel, position)
+    if not holds_message(messages, location[1], message_id):
+        index_messages(data['channels'][channel])
+        location = index['messages'][message_id]
+        if not holds_message(messages, location[1], message_id):
+            return None
+    return (channel, location[1])
+
+#------------------------------------------------------------------------------------#
+#------------------------------------ Lookups ---------------------------------------#
+#------------------------------------------------------------------------------------#
+
+def user_index(u_id):
+    '''
+        Finds a user by their u_id
+
+    Arguments:
+        u_id (integer) - a user's unique identifier
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the index of the user in data['users'], or None if no user matches
+    '''
+    return user_position(load(), u_id)
+
+def channel_index(channel_id):
+    '''
+        Finds a channel or dm by its channel_id
+
+    Arguments:
+        channel_id (integer) - a channel's unique identifier
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the index of the channel in data['channels'], or None if no channel matches
+    '''
+    return channel_position(load(), channel_id)
+
+def user_channels(u_id):
+    '''
+        Finds every channel and dm a user is a member of
+
+    Arguments:
+        u_id (integer) - a user's unique identifier
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns a list of the channels' indexes in data['channels'] in order
+    '''
+    data = load()
+    positions = [channel_position(data, channel_id) \
+        for channel_id in indexed(data)['memberships'].get(u_id, ())]
+    return sorted(position for position in positions if position is not None)
+
+def message_location(message_id):
+    '''
+        Finds a message in any channel or dm by its message_id
+
+    Arguments:
+        message_id (integer) - a message's unique identifier
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns a tuple of the channel's index in data['channels'] and the message's
+        index in that channel's messages, or None if no message matches
+    '''
+    return message_position(load(), message_id)
+
+#a u_id from the email or handle index is checked against the user it points
+#to, if it is out of date every user's keys are indexed again
+def key_owner(data, key, value, table):
+    u_id = indexed(data)[table].get(value)
+    position = None if u_id is None else user_position(data, u_id)
+    if u_id is None or position is not None and data['users'][position][key] == value:
+        return position
+    if reading_snapshot():
+        return find_position(data['users'], key, value)
+    for user in data['users']:
+        index_user_keys(user)
+    u_id = index[table].get(value)
+    return None if u_id is None else user_position(data, u_id)
+
+def search_candidates(query_str):
+    '''
+        Narrows down which messages could contain a query string using the
+        trigram index, see search_index.candidates
+
+    Arguments:
+        query_str (string) - the search term
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns a set of message_ids, or None if every message has to be checked
+    '''
+    data = load()
+    indexed(data)
+    #the trigram index follows the latest snapshot, older ones aren't indexed
+    latest = not reading_snapshot() or unit.snapshot is snapshots['current']
+    return search_index.candidates(data, query_str, rebuild=latest)
+
+def email_index(email):
+    '''
+        Finds a user by their email address
+
+    Arguments:
+        email (string) - the email address to look for
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the index of the user in data['users'], or None if no user has the email
+    '''
+    return key_owner(load(), 'email', email, 'emails')
+
+def handle_index(handle_str):
+    '''
+        Finds a user by their handle
+
+    Arguments:
+        handle_str (string) - the handle to look for
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the index of the user in data['users'], or None if no user has the handle
+    '''
+    return key_owner(load(), 'handle_str', handle_str, 'handles')
+
+def free_handle(base):
+    '''
+        Finds the lowest numbered handle made from a base handle that nobody has,
+        the suffix counter remembers how far previous searches got
+
+    Arguments:
+        base (string) - the handle generated from a user's name
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns base followed by the lowest free number, starting from 0
+    '''
+    suffixes = indexed(load())['suffixes']
+    suffix = suffixes.get(base, 0)
+    while handle_index(base + str(suffix)) is not None:
+        suffix += 1
+    suffixes[base] = suffix
+    return base + str(suffix)
+
+#------------------------------------------------------------------------------------#
+#----------------------------------- Id sequences -----------------------------------#
+#------------------------------------------------------------------------------------#
+
+# the block of ids this process reserved for each sequence as [next, limit)
+blocks = {}
+
+#forgets the blocks reserved during the unit of work, the sequence they were
+#reserved from was never written so another process may reserve them too
+def drop_reserved():
+    for name in unit.reserved:
+        blocks.pop(name, None)
+    unit.reserved = []
+
+def highest_id(data, name):
+    '''
+        Finds the highest id of a kind already in use, only needed for data
+        saved before sequences were kept
+    '''
+    if name == 'u_id':
+        ids = [user.u_id for user in data['users']]
+    elif name == 'session_id':
+        ids = [session.session_id for user in data['users'] \
+            for session in user.sessions_list]
+    elif name == 'channel_id':
+        ids = [channel.channel_id for channel in data['channels']]
+    else:
+        ids = [message.message_id for channel in data['channels'] \
+            for message in channel.messages]
+    return max(ids, default=0)
+
+def next_id(name):
+    '''
+        Hands out the next id of a sequence, ids are never handed out twice even
+        after whatever they belonged to is removed. Each process reserves
+        config.id_block_size ids at a time and only saves the sequence when
+        it reserves a new block
+
+    Arguments:
+        name (string) - one of 'u_id', 'session_id', 'channel_id' (which dms
+                        share) or 'message_id'
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the new id
+    '''
+    data = load()
+    sequences = data.setdefault('sequences', {})
+    if name not in sequences:
+        sequences[name] = highest_id(data, name)
+    block = blocks.get(name)
+    #the block is dropped if the saved sequence no longer covers it, which
+    #happens after clear (blocks reserved by a request that failed are
+    #dropped when it is rolled back)
+    if block is None or block[0] >= block[1] or sequences[name] < block[1] - 1:
+        block = [sequences[name] + 1, sequences[name] + 1 + config.id_block_size]
+        blocks[name] = block
+        sequences[name] = block[1] - 1
+        if in_unit():
+            unit.reserved.append(name)
+        try:
+            save(data, [('sequences',)])
+        except BaseException:
+            blocks.pop(name, None)
+            raise
+    new_id = block[0]
+    block[0] += 1
+    return new_id
@@ -10,9 +10,12 @@ Date:
 from src.error import InputError, AccessError
 from src.auth import get_data, write_data, check_u_id, check_token, generate_handle, check_token
 from src.channels import channels_create, channels_list
-from src.channel import channel_invite, channel_details, channel_messages, get_channel_index
+from src.channel import channel_invite, channel_details, channel_messages, \
+    channel_messages_page, channel_messages_since, get_channel_index, \
+    generate_addedChannel_notification
 from src.user import user_profile
-from src.other import notify_user, generate_addedChannel_notification
+from src.notifications import notify_users
+from src import data_store
 
 
 
@@ -53,9 +56,16 @@ def dm_create(token, u_ids):
     # Need to add the rest of u_ids to all members.
     # First remove owner's u_id from u_ids
     u_ids.remove(data['users'][creator_index]['u_id'])
+    dm = data['channels'][get_channel_index(channel['channel_id'])]
     for user in u_ids:
-        # Re-use channel_invite to append all member details
-        channel_invite(token, channel['channel_id'], user)
+        if user in dm['all_members']:
+            raise InputError(description="User has already been added!")
+        dm['all_members'].append(user)
+    write_data(data, ('channel', channel['channel_id']))
+
+    # Every invitee is notified in one batch
+    notify_users(channel['channel_id'], [(user, \
+        generate_addedChannel_notification(user, token, dm_name)) for user in u_ids])
     
     return {
         'dm_id': channel['channel_id'],
@@ -113,18 +123,18 @@ def dm_invite(token, dm_id, u_id):
     Returns:
         None
     '''
-    data = get_data()
-
-    channel_invite(token, dm_id, u_id)
-
-    channel_index = get_channel_index(dm_id)
-    channel_name = data['channels'][channel_index]['channel_name']
-    notif_msg = generate_addedChannel_notification(u_id, token, channel_name)
-    notify_user(u_id, dm_id, notif_msg)
+    # channel_invite also sends the invitee their notification
+    return channel_invite(token, dm_id, u_id)
 
 def dm_messages(token, dm_id, start):
     return channel_messages(token, dm_id, start)
 
+def dm_messages_page(token, dm_id, cursor, limit):
+    return channel_messages_page(token, dm_id, cursor, limit)
+
+def dm_messages_since(token, dm_id, since, until, limit):
+    return channel_messages_since(token, dm_id, since, until, limit)
+
 
 def dm_leave(token, dm_id):
     data = get_data()
@@ -137,9 +147,9 @@ def dm_leave(token, dm_id):
     if member == None:
         raise AccessError
 
-    dm['all_members'].remove({'u_id': data['users'][user_index]['u_id']})
+    dm['all_members'].remove(member)
     
-    write_data(data)
+    write_data(data, ('channel', dm_id))
     return {}
 
 
@@ -157,26 +167,22 @@ def dm_remove(token, dm_id):
 
     data['channels'].remove(dm)
 
-    write_data(data)
+    write_data(data, ('channel', dm_id))
     return {}
 
 '''
 Helper functions
 '''
 def find_dm(dm_id, data):
-    for channel in data['channels']:
-        if channel['channel_id'] == dm_id:
-            return channel
-    return None
+    channel_index = data_store.channel_index(dm_id)
+    if channel_index is None:
+        return None
+    return data['channels'][channel_index]
 
 def find_member(dm, u_id):
-    for member in dm['all_members']:
-        if member['u_id'] == u_id:
-            return member
+    if u_id in dm['all_members']:
+        return {'u_id' : u_id}
     return None
 
 def is_dm_creator(dm, u_id):
-    for member in dm['owner_members']:
-        if member['u_id'] == u_id:
-            return True
-    return False
+    return u_id in dm['owner_members']
@@ -0,0 +1,227 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    22 April 2021
+'''
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+from src import config
+
+try:
+    import fcntl
+except ImportError:
+    #fcntl is only available on unix
+    fcntl = None
+
+# every process working on the same data files locks this file, see config.locking
+LOCK_FILE = 'data.lock'
+
+# the exclusive lock this process holds while a unit of work that writes is
+# active, and the thread holding it
+exclusive = {
+    'file' : None,
+    'owner' : None,
+}
+
+# files written since they were last synced when config.durability is
+# 'interval', and the thread that syncs them
+unsynced = {
+    'files' : set(),
+    'syncer' : None,
+}
+unsynced_lock = threading.Lock()
+
+def locking():
+    if config.locking == 'fcntl' and fcntl is None:
+        raise RuntimeError('fcntl locking is not available on this platform')
+    return config.locking == 'fcntl'
+
+def holds_exclusive():
+    return exclusive['owner'] is threading.current_thread()
+
+def lock_file(operation):
+    f = open(LOCK_FILE, 'a')
+    try:
+        fcntl.flock(f, operation)
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+def acquire_exclusive():
+    '''
+        Waits until no other process is reading or writing the data files and
+        keeps them to this thread until release_exclusive is called
+
+    Arguments:
+        None
+
+    Exceptions:
+        RuntimeError - Occurs when locking is asked for on a platform without fcntl
+
+    Return Value:
+        None
+    '''
+    if not locking() or holds_exclusive():
+        return
+    exclusive['file'] = lock_file(fcntl.LOCK_EX)
+    exclusive['owner'] = threading.current_thread()
+
+def release_exclusive():
+    if not holds_exclusive():
+        return
+    f = exclusive['file']
+    exclusive['file'] = None
+    exclusive['owner'] = None
+    f.close()
+
+@contextlib.contextmanager
+def shared_lock():
+    '''
+        Held while the data files are read so no other process replaces them
+        part way through, a thread holding the exclusive lock reads under that
+    '''
+    if not locking() or holds_exclusive():
+        yield
+        return
+    with lock_file(fcntl.LOCK_SH):
+        yield
+
+@contextlib.contextmanager
+def exclusive_lock():
+    '''
+        Held while the data files are written outside a unit of work
+    '''
+    if holds_exclusive():
+        yield
+        return
+    acquire_exclusive()
+    try:
+        yield
+    finally:
+        release_exclusive()
+
+def file_stamp(filename):
+    '''
+        Identifies the current version of a file on disk
+
+    Arguments:
+        filename (string) - the file to stamp
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns a tuple of the file's inode, modification time and size,
+        or None if the file doesn't exist
+    '''
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def write_json(filename, value, **options):
+    '''
+        Replaces a file with value written as json. It is written to a temporary
+        file first which is then renamed over the old one, so the file is never
+        seen half written even by a process that doesn't lock it. The temporary
+        file is always synced before the rename or a crash could leave the file
+        empty, config.durability only decides when the rename itself is synced
+
+    Arguments:
+        filename (string) - the file to replace
+        value - anything json.dump can write
+        options - passed on to json.dump
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    temp_file = f'{filename}.{os.getpid()}.tmp'
+    try:
+        with open(temp_file, 'w') as f:
+            json.dump(value, f, **options)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, filename)
+    except BaseException:
+        #the old file is left as it was, without a half written one next to it
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    written(filename)
+
+def append_text(filename, text):
+    '''
+        Appends text to the end of a file, synced as config.durability says
+    '''
+    with open(filename, 'a') as f:
+        f.write(text)
+        if config.durability == 'always':
+            f.flush()
+            os.fsync(f.fileno())
+    if config.durability == 'interval':
+        written(filename)
+
+def written(filename):
+    '''
+        Makes sure a file that was just replaced stays replaced after a crash, in
+        'always' durability straight away and in 'interval' on the next sync
+
+    Arguments:
+        filename (string) - the file that was written
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    if config.durability == 'always':
+        sync_file(os.path.dirname(os.path.abspath(filename)))
+    elif config.durability == 'interval':
+        with unsynced_lock:
+            unsynced['files'].add(filename)
+            if unsynced['syncer'] is None:
+                unsynced['syncer'] = threading.Thread(target=sync_forever, \
+                    name='file-syncer', daemon=True)
+                unsynced['syncer'].start()
+                atexit.register(sync)
+
+#a directory is synced the same way so the renames in it are kept
+def sync_file(filename):
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def sync_forever():
+    while True:
+        time.sleep(config.sync_interval / 1000)
+        sync()
+
+def sync():
+    '''
+        Syncs every file written since the last sync and the directories they
+        are in, files that have since been removed are skipped
+    '''
+    with unsynced_lock:
+        filenames = unsynced['files']
+        unsynced['files'] = set()
+    directories = {os.path.dirname(os.path.abspath(filename)) for filename in filenames}
+    for filename in [*filenames, *directories]:
+        try:
+            sync_file(filename)
+        except FileNotFoundError:
+            pass
@@ -2,6 +2,7 @@ from src.auth import get_data
 from src.error import InputError, AccessError
 from src.auth import get_data, write_data, check_token, check_u_id
 from src.channel import check_channel_id
+from src import data_store
 import jwt
 def get_channel_index(channel_id):
     """
@@ -16,12 +17,7 @@ def get_channel_index(channel_id):
     Returns:
         Returns i (int) which is the index of the given channel
     """
-    data = get_data()
-    i = 0
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            return i
-        i += 1
+    return data_store.channel_index(channel_id)
 
 def channel_messages_v2(token, channel_id, start):
     '''
@@ -118,7 +114,7 @@ def channels_create_v2(token, name, is_public, is_dm=False):
     # Add channel details to the database.
     channel_details = create_channel_details(channel_id, name, token, u_id, is_public, is_dm)
     data['channels'].append(channel_details)
-    write_data(data)
+    write_data(data, ('channel', channel_id))
 
     return {
         'channel_id': channel_id,
@@ -0,0 +1,53 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    21 April 2021
+'''
+
+def member_id(member):
+    if isinstance(member, dict):
+        return member['u_id']
+    return member
+
+class Members:
+    '''
+        The all_members or owner_members of a channel or dm, held as an
+        insertion ordered set of u_ids so checking for or removing a member
+        doesn't scan the list. It reads like the list of {'u_id' : u_id}
+        dictionaries it replaces and is written to the data files as one
+
+        members can be given as a u_id or as any dictionary with a 'u_id'
+    '''
+    __slots__ = ['u_ids']
+
+    def __init__(self, members=()):
+        self.u_ids = dict.fromkeys(member_id(member) for member in members)
+
+    def __iter__(self):
+        return ({'u_id' : u_id} for u_id in self.u_ids)
+
+    def __len__(self):
+        return len(self.u_ids)
+
+    def __contains__(self, member):
+        return member_id(member) in self.u_ids
+
+    def __getitem__(self, i):
+        return list(self)[i]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, member):
+        self.u_ids[member_id(member)] = None
+
+    def remove(self, member):
+        try:
+            del self.u_ids[member_id(member)]
+        except KeyError:
+            raise ValueError(f'{member} is not a member')
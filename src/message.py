@@ -7,15 +7,13 @@ Date:
 '''
 
 from src.error import InputError, AccessError
-from src.auth import auth_register, check_token, get_data, write_data, check_u_id
+from src.auth import auth_register, check_token, get_data, write_data, check_u_id, get_principal
 from src.channels import channels_create
 from src.channel import channel_id_valid, member_check, get_channel_index, user_is_owner_token
 from datetime import datetime, timezone
 from src.other import insert_tag_notification
-
-import jwt
-
-SECRET = 'atotallysecuresecret'
+from src import data_store
+from src.models import Message
 
 def message_send(token, channel_id, message):
     '''
@@ -35,7 +33,7 @@ def message_send(token, channel_id, message):
     Return Value:
         Dictionary containing 'message_id'.
     ''' 
-    check_token(token)
+    u_id = get_principal(token)['u_id']
 
     data = get_data()
     if not channel_id_valid(channel_id, data['channels']):
@@ -43,9 +41,6 @@ def message_send(token, channel_id, message):
     
     message_too_long(message)
     
-    # Decode token to get u_id
-    token_structure = jwt.decode(token, SECRET, algorithms=['HS256'])
-    u_id = token_structure['u_id']
     if not member_check(u_id, channel_id, data['channels']):
         raise AccessError(description="User is not a member of the channel!")
 
@@ -54,15 +49,14 @@ def message_send(token, channel_id, message):
 
     # Go to the channel and append the message and message_id
     channel_index = get_channel_index(channel_id)
-    utc_time = datetime.utcnow().timestamp()
-    time = datetime.fromtimestamp(utc_time).strftime('%Y-%m-%d')
-    data['channels'][channel_index]['messages'].append({
-        'message_id': message_id,
-        'u_id': u_id,
-        'message': message,
-        'time_created': time
-    })
-    write_data(data)
+    time = int(datetime.now(timezone.utc).timestamp())
+    data['channels'][channel_index]['messages'].append(Message(
+        message_id=message_id,
+        u_id=u_id,
+        message=message,
+        time_created=time
+    ))
+    write_data(data, ('message', channel_id, message_id))
     insert_tag_notification(token, channel_id, message)
     return {
         'message_id': message_id,
@@ -105,7 +99,7 @@ def message_remove(token, message_id):
         if ch['channel_id'] == channel['channel_id']:
             ch['messages'].remove(message)
 
-    write_data(data)
+    write_data(data, ('message', channel['channel_id'], message_id))
     return {}
 
 def message_edit(token, message_id, message):
@@ -132,9 +126,7 @@ def message_edit(token, message_id, message):
     # InputError - Length of new message is over 1000 characters.
     message_too_long(message)
 
-    check_token(token)
-    token_structure = jwt.decode(token, SECRET, algorithms=['HS256'])
-    auth_user_id = token_structure['u_id']
+    auth_user_id = get_principal(token)['u_id']
 
     # InputError - Message_id refers to a deleted message.
     channel_id, msg_index = search_message_id(message_id)
@@ -144,19 +136,19 @@ def message_edit(token, message_id, message):
     # AccessError - The user trying to edit their message is not an owner of the channel/dm.
     owner_check(data['channels'][channel_index]['owner_members'], auth_user_id)
 
-    # If given empty string
-    if len(message) == 0:
-        message_remove(token, message_id)
-    
-    # Otherwise edit the old message.
-    data['channels'][channel_index]['messages'][msg_index]['message'] = message
-
     # AccessError - Different user is trying to edit another user's message.
     u_id = data['channels'][channel_index]['messages'][msg_index]['u_id']
     if auth_user_id != u_id:
         raise AccessError(description="User trying to edit the message is not the auth user who made the message!")
+
+    # If given empty string
+    if len(message) == 0:
+        return message_remove(token, message_id)
+    
+    # Otherwise edit the old message.
+    data['channels'][channel_index]['messages'].edit(msg_index, message)
     
-    write_data(data)
+    write_data(data, ('message', channel_id, message_id))
     return {
     }
 
@@ -204,10 +196,7 @@ def message_share(token, og_message_id, message, channel_id, dm_id):
     '''
     data = get_data()
 
-    check_token(token)
-
-    token_structure = jwt.decode(token, SECRET, algorithms=['HS256'])
-    u_id = token_structure['u_id']
+    u_id = get_principal(token)['u_id']
 
     # First fetch the actual og message from og_msg_id.
     og_channel_id, og_msg_index = search_message_id(og_message_id)
@@ -238,16 +227,9 @@ def message_share(token, og_message_id, message, channel_id, dm_id):
 ############################################################
 #            Helper functions                              #      
 ############################################################
-# Creates a new unique id for message.
+# Creates a new unique id for message, ids of removed messages are never reused.
 def message_id_generate():
-    data = get_data()
-    message_id = 1
-    # Search across all channels and all messages.
-    for channels in data['channels']:
-        for message in channels['messages']:
-            if message['message_id'] == message_id:
-                message_id += 1
-    return message_id
+    return data_store.next_id('message_id')
 
 def message_too_long(message):
     if len(message) > 1000:
@@ -257,28 +239,25 @@ def search_message_id(message_id):
     '''
     Given a message_id, search the channel database to return channel_id & the index of the message.
     '''
-    data = get_data()
-    for channel in data['channels']:
-        for msg_index, message in enumerate(channel['messages']):
-            if message['message_id'] == message_id:
-                return (channel['channel_id'], msg_index)
-    
-    # Message not found.
-    raise InputError(description="Message_id is not valid!")
+    location = data_store.message_location(message_id)
+    if location is None:
+        # Message not found.
+        raise InputError(description="Message_id is not valid!")
+
+    channel_index, msg_index = location
+    return (get_data()['channels'][channel_index]['channel_id'], msg_index)
 
 def owner_check(owner_members, u_id):
-    for member in owner_members:
-        if member['u_id'] == u_id:
-            return True
+    if u_id in owner_members:
+        return True
     raise AccessError(description="Authorised user is NOT an owneer of this channel!")
     
 def message_id_exists(message_id):
-    data = get_data()
-    for channel in data['channels']:
-        for message in channel['messages']:
-            if message['message_id'] == message_id:
-                return (message, channel)
-    return (None, None)
+    location = data_store.message_location(message_id)
+    if location is None:
+        return (None, None)
+    channel = get_data()['channels'][location[0]]
+    return (channel['messages'][location[1]], channel)
 
 def message_is_sender(u_id, message):
     if u_id == message['u_id']:
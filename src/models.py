@@ -0,0 +1,536 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    22 April 2021
+'''
+
+import collections
+import copy
+import itertools
+import operator
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import MutableMapping
+from datetime import datetime, timezone
+from src.members import Members
+
+try:
+    import numpy
+except ImportError:
+    #numpy is optional, without it bulk passes over message columns loop in python
+    numpy = None
+
+class Record(MutableMapping):
+    '''
+        A record in the workspace data. Its fields are held in slots instead of
+        a dictionary of its own, which takes a fraction of the memory, but it
+        still reads and changes like the dictionary it replaces. Fields are
+        quickest to read as attributes, message.message_id
+
+        records are turned back into dictionaries by encode when they are
+        written to the data files or sent back from the server
+    '''
+    __slots__ = ()
+
+    # fields that can be left out when a record is made, with what makes their value
+    defaults = {}
+
+    def __init_subclass__(cls):
+        super().__init_subclass__()
+        cls.fields = frozenset(cls.__slots__)
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            if name in fields:
+                setattr(self, name, fields.pop(name))
+            elif name in self.defaults:
+                setattr(self, name, self.defaults[name]())
+            else:
+                raise TypeError(f'{type(self).__name__} is missing {name}')
+        if fields:
+            raise TypeError(f'{type(self).__name__} has no field {next(iter(fields))}')
+
+    def __getitem__(self, name):
+        if name in self.fields:
+            return getattr(self, name)
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        if name not in self.fields:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def __delitem__(self, name):
+        raise TypeError(f'{type(self).__name__} fields can\'t be removed')
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def get(self, name, default=None):
+        if name in self.fields:
+            return getattr(self, name)
+        return default
+
+    def __deepcopy__(self, memo):
+        copied = object.__new__(type(self))
+        memo[id(self)] = copied
+        for name in self.__slots__:
+            setattr(copied, name, copy.deepcopy(getattr(self, name), memo))
+        return copied
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+class Session(Record):
+    __slots__ = ('session_id',)
+
+class Notification(Record):
+    __slots__ = ('channel_id', 'dm_id', 'notification_message')
+
+class User(Record):
+    __slots__ = ('u_id', 'name_first', 'name_last', 'email', 'password', 'handle_str', \
+        'sessions_list', 'notifications', 'notifications_archived', 'permission_id')
+    defaults = {'notifications_archived' : int}
+
+class Message(Record):
+    '''
+        A message, time_created is in whole seconds since the epoch
+    '''
+    __slots__ = ('message_id', 'u_id', 'message', 'time_created')
+
+# seconds in a day
+DAY = 24 * 60 * 60
+
+def timestamp(time_created):
+    '''
+        Turns a message's time_created into seconds since the epoch. Messages
+        saved before times were kept as timestamps have a '%Y-%m-%d' date
+        instead, which is taken as the start of that day in utc
+    '''
+    if isinstance(time_created, str):
+        return int(datetime.strptime(time_created, '%Y-%m-%d') \
+            .replace(tzinfo=timezone.utc).timestamp())
+    return int(time_created)
+
+class Messages:
+    '''
+        The messages of a channel or dm, oldest first, held column by column
+        instead of as a list of records. message_ids, u_ids and the times they
+        were sent are packed 64 bit integer arrays and every message's text is
+        kept end to end in one utf-8 buffer, message i being
+        buffer[offsets[i]:offsets[i + 1]]. Going through a column only touches
+        that column rather than following a pointer to each message
+
+        messages are nearly always sent in time order so the times column is
+        searched directly for a time range. If a message arrives out of order
+        the column is marked unordered and the positions sorted by time are
+        kept in time_order instead, as (positions, times), built when needed
+
+        it reads like the list of messages it replaces, indexing or iterating
+        it gives Message records made from the columns. Those are copies, so
+        messages are changed through edit, rewrite_sender, the item assignment
+        and removal of a list or append, and never through a record read from it
+
+        a read only copy made by share has the same columns with a limit on how
+        much of them it sees, the messages appended after it was made are past
+        its limit. Any other change copies the columns first (see own)
+
+        the text a message had before it was edited or removed is kept in
+        replaced until the change is saved, the trigram index needs it to
+        take the message out of its postings (see search_index.message_changed)
+    '''
+    __slots__ = ['message_ids', 'u_ids', 'times', 'buffer', 'offsets', \
+        'unordered', 'time_order', 'limit', 'shared', 'replaced']
+
+    def __init__(self, messages=()):
+        self.message_ids = array('q')
+        self.u_ids = array('q')
+        self.times = array('q')
+        self.buffer = bytearray()
+        self.offsets = array('q', [0])
+        self.unordered = False
+        self.time_order = None
+        self.limit = None
+        self.shared = False
+        self.replaced = {}
+        for message in messages:
+            self.append(message)
+
+    def __len__(self):
+        return len(self.message_ids) if self.limit is None else self.limit
+
+    def __iter__(self):
+        return (self.row(i) for i in range(len(self)))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.row(position) for position in range(len(self))[i]]
+        return self.row(range(len(self))[i])
+
+    def __setitem__(self, i, message):
+        i = range(len(self))[i]
+        self.own()
+        self.keep_text(i)
+        self.message_ids[i] = message['message_id']
+        self.u_ids[i] = message['u_id']
+        self.times[i] = timestamp(message['time_created'])
+        self.replace_text(i, message['message'])
+        self.time_order = None
+        if (i > 0 and self.times[i - 1] > self.times[i]) \
+            or (i + 1 < len(self) and self.times[i] > self.times[i + 1]):
+            self.unordered = True
+
+    def __delitem__(self, i):
+        i = range(len(self))[i]
+        self.own()
+        self.keep_text(i)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        del self.message_ids[i]
+        del self.u_ids[i]
+        del self.times[i]
+        del self.buffer[start:end]
+        del self.offsets[i + 1]
+        self.shift(i + 1, start - end)
+        self.time_order = None
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def row(self, i):
+        return Message(
+            message_id=self.message_ids[i],
+            u_id=self.u_ids[i],
+            message=self.text(i),
+            time_created=self.times[i]
+        )
+
+    def text(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].decode()
+
+    def keep_text(self, i):
+        #only the text from before the first change since it was last saved is kept
+        self.replaced.setdefault(self.message_ids[i], self.text(i))
+
+    def column(self, name):
+        #a numpy view of an integer column, it has to be let go of before the column is
+        #resized. A shared column is copied up to the limit instead, so it can still be
+        #appended to while the view is in use
+        values = getattr(self, name)
+        if self.limit is not None:
+            values = values[:self.limit + (name == 'offsets')]
+        return numpy.frombuffer(values, dtype=numpy.int64)
+
+    def shift(self, start, difference):
+        #moves every offset from start on by difference after the buffer changed size
+        if not difference:
+            return
+        if numpy is not None:
+            self.column('offsets')[start:] += difference
+        else:
+            self.offsets[start:] = array('q', map(difference.__add__, self.offsets[start:]))
+
+    def lengths(self):
+        #the length of each message's text in the buffer
+        if numpy is not None:
+            return numpy.diff(self.column('offsets'))
+        offsets = self.offsets[:len(self) + 1]
+        return array('q', map(operator.sub, offsets[1:], offsets[:-1]))
+
+    def sent_by(self, u_id):
+        '''
+            Finds the positions of every message sent by a user, in order
+        '''
+        if numpy is not None:
+            return numpy.flatnonzero(self.column('u_ids') == u_id).tolist()
+        return [i for i, sender in enumerate(self.u_ids[:len(self)]) if sender == u_id]
+
+    def sender_counts(self):
+        '''
+            Counts how many of the messages each user sent, as a dictionary of
+            u_id to count
+        '''
+        if numpy is not None and len(self):
+            u_ids, counts = numpy.unique(self.column('u_ids'), return_counts=True)
+            return dict(zip(u_ids.tolist(), counts.tolist()))
+        return dict(collections.Counter(self.u_ids[:len(self)]))
+
+    def day_counts(self):
+        '''
+            Counts how many of the messages were sent each day, as a dictionary
+            of the time the day started (utc) to count
+        '''
+        if numpy is not None and len(self):
+            days, counts = numpy.unique(self.column('times') // DAY, return_counts=True)
+            return dict(zip((days * DAY).tolist(), counts.tolist()))
+        return dict(collections.Counter(time - time % DAY for time in self.times[:len(self)]))
+
+    def sent_between(self, start=None, end=None):
+        '''
+            Finds the messages sent from start up to but not including end by
+            bisecting the times column, or the time order if it is unordered
+
+        Arguments:
+            start (int) - seconds since the epoch, or None for the first message
+            end (int) - seconds since the epoch, or None for no end
+
+        Exceptions:
+            None
+
+        Return Value:
+            Returns the positions of the messages in the order they were sent
+        '''
+        if self.unordered:
+            if self.time_order is None:
+                positions = array('q', sorted(range(len(self)), key=self.times.__getitem__))
+                self.time_order = (positions, array('q', map(self.times.__getitem__, positions)))
+            positions, times = self.time_order
+        else:
+            positions, times = range(len(self)), self.times
+        first = 0 if start is None else bisect_left(times, start, 0, len(positions))
+        last = len(positions) if end is None else bisect_left(times, end, 0, len(positions))
+        return list(positions[first:max(first, last)])
+
+    def copy(self):
+        copied = Messages()
+        copied.message_ids = self.message_ids[:len(self)]
+        copied.u_ids = self.u_ids[:len(self)]
+        copied.times = self.times[:len(self)]
+        copied.buffer = self.buffer[:self.offsets[len(self)]]
+        copied.offsets = self.offsets[:len(self) + 1]
+        copied.unordered = self.unordered
+        return copied
+
+    def share(self):
+        '''
+            Makes a read only copy of the messages as they are now without
+            copying the columns, see own
+        '''
+        shared = Messages()
+        shared.message_ids = self.message_ids
+        shared.u_ids = self.u_ids
+        shared.times = self.times
+        shared.buffer = self.buffer
+        shared.offsets = self.offsets
+        shared.unordered = self.unordered
+        shared.limit = len(self)
+        self.shared = True
+        return shared
+
+    def own(self):
+        #the columns are copied before anything but append changes them if a read
+        #only copy shares them
+        if self.shared:
+            self.message_ids = array('q', self.message_ids)
+            self.u_ids = array('q', self.u_ids)
+            self.times = array('q', self.times)
+            self.buffer = bytearray(self.buffer)
+            self.offsets = array('q', self.offsets)
+            self.shared = False
+
+    def append(self, message):
+        time = timestamp(message['time_created'])
+        if self.times and time < self.times[-1]:
+            self.unordered = True
+        self.time_order = None
+        self.message_ids.append(message['message_id'])
+        self.u_ids.append(message['u_id'])
+        self.times.append(time)
+        self.buffer += message['message'].encode()
+        self.offsets.append(len(self.buffer))
+
+    def remove(self, message):
+        try:
+            del self[self.message_ids.index(message['message_id'])]
+        except ValueError:
+            raise ValueError(f'{message} is not in the messages') from None
+
+    def position(self, message_id):
+        '''
+            Finds where a message is, or returns None if it isn't here
+        '''
+        try:
+            position = self.message_ids.index(message_id)
+        except ValueError:
+            return None
+        return position if position < len(self) else None
+
+    def edit(self, i, text):
+        '''
+            Replaces the text of the message at position i
+        '''
+        self.own()
+        self.keep_text(i)
+        self.replace_text(i, text)
+
+    def replace_text(self, i, text):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        encoded = text.encode()
+        self.buffer[start:end] = encoded
+        self.shift(i + 1, len(encoded) - (end - start))
+
+    def rewrite_sender(self, u_id, text):
+        '''
+            Replaces the text of every message sent by a user, the buffer and
+            offsets are rebuilt once rather than once per message
+
+        Arguments:
+            u_id (int) - the user whose messages are rewritten
+            text (string) - what their messages now say
+
+        Exceptions:
+            None
+
+        Return Value:
+            Returns the message_ids of the messages that were rewritten
+        '''
+        positions = self.sent_by(u_id)
+        if not positions:
+            return []
+        for i in positions:
+            self.keep_text(i)
+        encoded = text.encode()
+        #the text between two rewritten messages is copied across as it is
+        starts = [0, *(self.offsets[i + 1] for i in positions)]
+        ends = [*(self.offsets[i] for i in positions), len(self.buffer)]
+        buffer = bytearray(encoded).join(self.buffer[start:end] \
+            for start, end in zip(starts, ends))
+
+        lengths = self.lengths()
+        offsets = array('q', [0])
+        if numpy is not None:
+            lengths[positions] = len(encoded)
+            offsets.frombytes(numpy.cumsum(lengths).tobytes())
+        else:
+            for i in positions:
+                lengths[i] = len(encoded)
+            offsets.extend(itertools.accumulate(lengths))
+        self.buffer = buffer
+        self.offsets = offsets
+        return [self.message_ids[i] for i in positions]
+
+    def find(self, query_str):
+        '''
+            Searches the text buffer for a query string, a match running over
+            the end of one message into the next doesn't count
+
+        Arguments:
+            query_str (string) - the search term
+
+        Exceptions:
+            None
+
+        Return Value:
+            Returns the positions of the messages containing the query, in order
+        '''
+        if not query_str:
+            return list(range(len(self)))
+        needle = query_str.encode()
+        limit = self.offsets[len(self)]
+        positions = []
+        start = self.buffer.find(needle, 0, limit)
+        while start != -1:
+            #empty messages share their start with the next, the last of them holds start
+            i = bisect_right(self.offsets, start, 0, len(self) + 1) - 1
+            end = self.offsets[i + 1]
+            if start + len(needle) <= end:
+                positions.append(i)
+                start = self.buffer.find(needle, end, limit)
+            else:
+                start = self.buffer.find(needle, start + 1, limit)
+        return positions
+
+    def encode(self):
+        return [{
+            'message_id' : message_id,
+            'u_id' : u_id,
+            'message' : self.text(i),
+            'time_created' : time_created,
+        } for i, (message_id, u_id, time_created) in enumerate(zip(self.message_ids[:len(self)], \
+            self.u_ids[:len(self)], self.times[:len(self)]))]
+
+class Channel(Record):
+    '''
+        A channel or dm, its members are held as Members and its messages as
+        Messages
+    '''
+    __slots__ = ('channel_id', 'channel_name', 'owner_members', 'all_members', \
+        'is_public', 'is_dm', 'messages')
+
+    def __init__(self, **fields):
+        super().__init__(**fields)
+        for name in ['owner_members', 'all_members']:
+            if not isinstance(getattr(self, name), Members):
+                setattr(self, name, Members(getattr(self, name)))
+        if not isinstance(self.messages, Messages):
+            self.messages = Messages(self.messages)
+
+def user(fields):
+    '''
+        Makes a User, with its sessions and notifications, from a dictionary
+        read from the data files
+    '''
+    if isinstance(fields, User):
+        return fields
+    return User(**dict(fields, \
+        sessions_list=[session if isinstance(session, Session) else Session(**session) \
+            for session in fields['sessions_list']],
+        notifications=[notification if isinstance(notification, Notification) \
+            else Notification(**notification) for notification in fields['notifications']]))
+
+def channel(fields):
+    '''
+        Makes a Channel, with its messages, from a dictionary read from the data files
+    '''
+    if isinstance(fields, Channel):
+        return fields
+    return Channel(**fields)
+
+def message(fields):
+    if isinstance(fields, Message):
+        return fields
+    return Message(**fields)
+
+def record(kind, fields):
+    '''
+        Makes the record a change of the given kind refers to (see
+        data_store.locate), or passes through None for a removed record
+    '''
+    if fields is None:
+        return None
+    return {'user' : user, 'channel' : channel, 'message' : message}[kind](fields)
+
+def adopt(data):
+    '''
+        Replaces every user and channel in the workspace data read from the data
+        files with records, anything already a record is kept as it is
+    '''
+    data['users'] = [user(fields) for fields in data['users']]
+    data['channels'] = [channel(fields) for fields in data['channels']]
+    return data
+
+def encode(value):
+    '''
+        Passed to json.dump as default so records are written as dictionaries
+        and Members and Messages as lists
+    '''
+    if isinstance(value, Record):
+        return {name : getattr(value, name) for name in value.__slots__}
+    if isinstance(value, Members):
+        return list(value)
+    if isinstance(value, Messages):
+        return value.encode()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
@@ -0,0 +1,298 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    21 April 2021
+'''
+
+import atexit
+import base64
+import collections
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from src.error import InputError
+from src.auth import get_data, write_data
+from src import config, data_store, files, models
+from src.models import Notification
+
+# each user record only keeps their newest config.notifications_kept notifications,
+# older ones are moved out to numbered segment files under ARCHIVE_DIR/<u_id>/
+# holding config.notifications_segment_size notifications each, oldest first.
+# every notification a user gets is numbered from 1 in the order they arrive,
+# the user record counts how many have been archived so number n is either at
+# n - notifications_archived - 1 from the end of the record's list or in the archive
+ARCHIVE_DIR = 'data_notifications'
+
+# notifications waiting to be delivered by the background worker when
+# config.notification_delivery is 'queued', each job is a tuple of
+# (time it was queued, channel_id, [(u_id, notification_message), ...],
+# how many times delivering it has failed)
+delivery = {
+    'jobs' : collections.deque(),
+    'worker' : None,
+    'delivered' : 0,        # jobs delivered since the server started
+    'failed' : 0,           # jobs given up on after config.notification_attempts
+    'last_lag' : 0.0,       # seconds the oldest job of the last batch waited
+}
+delivery_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+def archive_file(u_id, segment):
+    return os.path.join(ARCHIVE_DIR, str(u_id), f'{segment}.json')
+
+def read_segment(u_id, segment):
+    try:
+        with open(archive_file(u_id, segment), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def write_segment(u_id, segment, notifications):
+    os.makedirs(os.path.dirname(archive_file(u_id, segment)), exist_ok=True)
+    files.write_json(archive_file(u_id, segment), notifications, indent="", \
+        default=models.encode)
+
+def archive(user, notifications):
+    '''
+        Appends notifications, oldest first, to the end of a user's archive.
+        They are written at the position given by the user's archived count so
+        anything a rolled back request archived past it is overwritten
+
+    Arguments:
+        user (dictionary) - the user the notifications belong to
+        notifications (list) - the notifications to archive, oldest first
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    size = config.notifications_segment_size
+    archived = user.get('notifications_archived', 0)
+    while notifications:
+        segment, offset = divmod(archived, size)
+        stored = read_segment(user['u_id'], segment)[:offset]
+        added = notifications[:size - offset]
+        write_segment(user['u_id'], segment, stored + added)
+        notifications = notifications[len(added):]
+        archived += len(added)
+    user['notifications_archived'] = archived
+
+def clear_archive():
+    shutil.rmtree(ARCHIVE_DIR, ignore_errors=True)
+    delivery['jobs'].clear()
+
+def add_notification(user, notification):
+    '''
+        Puts a notification at the front of a user's newest notifications,
+        archiving whatever no longer fits
+    '''
+    user['notifications'].insert(0, notification)
+    overflow = user['notifications'][config.notifications_kept:]
+    if overflow:
+        del user['notifications'][config.notifications_kept:]
+        archive(user, overflow[::-1])
+
+def notify_users(channel_id, notified):
+    '''
+        Delivers a batch of notifications about one channel or dm, every user
+        they go to is saved together in one write. When notifications are
+        queued they are handed to the background worker instead, once the
+        request sending them has been committed
+
+    Arguments:
+        channel_id (int) - the channel or dm the notifications are about
+        notified (list) - tuples of (u_id, notification_message)
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    if not notified:
+        return
+    if config.notification_delivery == 'queued':
+        job = (channel_id, list(notified))
+        data_store.after_commit(lambda: enqueue(*job))
+        return
+    deliver(channel_id, notified)
+
+def deliver(channel_id, notified):
+    #notifications about a channel or to a user that has since been removed are dropped
+    data = get_data()
+    channel_index = data_store.channel_index(channel_id)
+    if channel_index is None:
+        return
+    channel = data['channels'][channel_index]
+    changes = []
+    for u_id, notification_message in notified:
+        user_index = data_store.user_index(u_id)
+        if user_index is None:
+            continue
+        notification = Notification(
+            channel_id=-1 if channel['is_dm'] else channel_id,
+            dm_id=channel_id if channel['is_dm'] else -1,
+            notification_message=notification_message
+        )
+        add_notification(data['users'][user_index], notification)
+        changes.append(('user', u_id))
+    if changes:
+        write_data(data, *changes)
+
+def enqueue(channel_id, notified):
+    delivery['jobs'].append((time.monotonic(), channel_id, notified, 0))
+    with delivery_lock:
+        if delivery['worker'] is None:
+            delivery['worker'] = threading.Thread(target=deliver_forever, \
+                name='notification-delivery', daemon=True)
+            delivery['worker'].start()
+            atexit.register(flush)
+
+def deliver_forever():
+    while True:
+        time.sleep(config.notification_flush_interval)
+        try:
+            flush()
+        except Exception:
+            logger.exception('delivering queued notifications failed')
+
+def flush():
+    '''
+        Delivers every queued notification job, up to config.notification_batch_size
+        jobs are delivered together and saved in one commit. If that commit fails
+        each job is delivered on its own, the ones that still fail go back on
+        the queue for the next flush until they have failed
+        config.notification_attempts times
+
+    Arguments:
+        None
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    retries = []
+    while delivery['jobs']:
+        jobs = []
+        while delivery['jobs'] and len(jobs) < config.notification_batch_size:
+            jobs.append(delivery['jobs'].popleft())
+        try:
+            data_store.submit(lambda: [deliver(channel_id, notified) \
+                for _, channel_id, notified, _ in jobs])
+            delivered = jobs
+        except Exception:
+            delivered = [job for job in jobs if deliver_job(job, retries)]
+        with delivery_lock:
+            delivery['delivered'] += len(delivered)
+            if delivered:
+                delivery['last_lag'] = time.monotonic() - delivered[0][0]
+    delivery['jobs'].extendleft(reversed(retries))
+
+def deliver_job(job, retries):
+    #delivers one job from a batch that failed, returning whether it was delivered
+    queued, channel_id, notified, failures = job
+    try:
+        data_store.submit(lambda: deliver(channel_id, notified))
+        return True
+    except Exception:
+        logger.exception(f'delivering notifications about channel {channel_id} failed')
+    if failures + 1 < config.notification_attempts:
+        retries.append((queued, channel_id, notified, failures + 1))
+    else:
+        with delivery_lock:
+            delivery['failed'] += 1
+    return False
+
+def queue_metrics():
+    '''
+        Reports on the background notification queue
+
+    Arguments:
+        None
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns a dictionary of how many jobs are waiting (depth), how many
+        seconds the oldest has waited (lag), how long the oldest job of the
+        last delivered batch waited (last_lag), how many have been delivered
+        and how many were given up on (failed)
+    '''
+    try:
+        lag = time.monotonic() - delivery['jobs'][0][0]
+    except IndexError:
+        lag = 0.0
+    with delivery_lock:
+        return {
+            'depth' : len(delivery['jobs']),
+            'lag' : lag,
+            'last_lag' : delivery['last_lag'],
+            'delivered' : delivery['delivered'],
+            'failed' : delivery['failed'],
+        }
+
+def notify_user(u_id, channel_id, notification_message):
+    notify_users(channel_id, [(u_id, notification_message)])
+
+def encode_cursor(number):
+    return base64.urlsafe_b64encode(str(number).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor).decode())
+    except ValueError:
+        raise InputError(description='Cursor is not valid')
+
+def notifications_page(user, cursor, limit):
+    '''
+        Returns a user's notifications from newest to oldest, starting just
+        before the one the cursor was anchored on
+
+    Arguments:
+        user (dictionary) - the user whose notifications are requested
+        cursor (string) - the next_cursor from the previous page, or None for the newest
+        limit (int) - how many notifications to return
+
+    Exceptions:
+        InputError - Occurs when the cursor is not valid or limit is out of range
+
+    Return Value:
+        Returns a dictionary of the notifications and the cursor of the next page,
+        which is None once the oldest notification has been returned
+    '''
+    if limit < 1 or limit > config.notifications_max_page_size:
+        raise InputError(description='Page size is out of range')
+    archived = user.get('notifications_archived', 0)
+    total = archived + len(user['notifications'])
+    end = total + 1 if cursor is None else decode_cursor(cursor)
+    if end < 1 or end > total + 1:
+        raise InputError(description='Cursor is not valid')
+    start = max(end - limit, 1)
+
+    #numbers from start up to but not including end, newest first
+    notifications = [user['notifications'][total - number] \
+        for number in range(end - 1, max(start, archived + 1) - 1, -1)]
+    size = config.notifications_segment_size
+    number = min(end - 1, archived)
+    while number >= start:
+        segment, offset = divmod(number - 1, size)
+        stored = read_segment(user['u_id'], segment)
+        first = max(start, segment * size + 1)
+        notifications += stored[first - segment * size - 1:offset + 1][::-1]
+        number = first - 1
+
+    return {
+        'notifications' : notifications,
+        'next_cursor' : encode_cursor(start) if start > 1 else None,
+    }
@@ -7,12 +7,14 @@ Date:
 '''
 
 from src.error import InputError, AccessError
-from src.auth import check_token, get_data, check_u_id, write_data
-from src.channel import check_is_member
+from src.auth import check_token, get_data, check_u_id, write_data, forget_tokens
 from flask import Flask
-from json import dumps, dump
-from src import config
+from json import dumps
+from src import config, data_store, changelog
+from src.notifications import notify_users, notifications_page, clear_archive, \
+    queue_metrics
 from src.auth import get_data, write_data, check_u_id, check_token
+import collections
 import re
 OWNER = 1
 MEMBER = 2
@@ -30,12 +32,7 @@ def get_channel_index(channel_id):
     Returns:
         Returns i (int) which is the index of the given channel
     """
-    data = get_data()
-    i = 0
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            return i
-        i += 1
+    return data_store.channel_index(channel_id)
 
 
 def clear():
@@ -51,13 +48,13 @@ def clear():
     Return Values:
         None
     '''
-    with open("data.json", "w+") as f:
-        data = {
-            "users" : [],
-            "channels" : []
-        }
-        dump(data, f)
-        return dumps({})
+    data = {
+        "users" : [],
+        "channels" : []
+    }
+    write_data(data)
+    clear_archive()
+    return dumps({})
 
 
 def notifications_get(token):
@@ -70,20 +67,135 @@ def notifications_get(token):
     Returns:
         notifications(list of dictioanry) - user's top 20 notifications
     '''
+    return {'notifications' : notifications_get_page(token, None, 20)['notifications']}
+
+def notifications_get_page(token, cursor, limit):
+    '''
+    This function gets a page of a user's notifications, older pages are read
+    from their archive
 
+    Arguments:
+        token(string) - The user's token
+        cursor(string) - next_cursor from the previous page, or None for the newest
+        limit(integer) - how many notifications to return, or None for 20
+
+    Returns:
+        notifications(list of dictioanry) - the page of notifications, newest first
+        next_cursor(string) - the cursor of the next page, None if there are no more
+    '''
     data = get_data()
-    #return the top 20 notifications
-    notifications = []
-    i = 0
-    # print(f"data['users'][check_token(token)]['notifications'] = {data['users'][check_token(token)]['notifications']}, check_token(token) = {check_token(token)}")
+    if limit is None:
+        limit = 20
+    return notifications_page(data['users'][check_token(token)], cursor, limit)
 
-    for notification in data['users'][check_token(token)]['notifications']:
-        if i >= 20 or not notification:
-            break
-        notifications.append(notification)
-        i += 1
-    # print(notifications)
-    return {'notifications' : notifications}
+
+def notifications_metrics(token):
+    '''
+    This function reports how far behind background notification delivery is
+
+    Arguments:
+        token(string) - The user's token
+
+    Returns:
+        depth(integer) - how many notification jobs are waiting to be delivered
+        lag(float) - how many seconds the oldest waiting job has waited
+        last_lag(float) - how many seconds the oldest job of the last delivered batch waited
+        delivered(integer) - how many jobs have been delivered since the server started
+        failed(integer) - how many jobs were given up on after failing to be delivered
+    '''
+    check_token(token)
+    return queue_metrics()
+
+def changes_get(token, version):
+    '''
+    This function returns what changed in the user's channels, dms and
+    notifications since a version it gave out before, so a client polling for
+    changes only gets what is new. A client calls it without a version first,
+    loads everything and then polls with the version it was given. Versions
+    are saved with the data so they still hold after a restart and on every
+    worker, but what changed is only remembered since the worker last read the
+    data from disk, a version from before that comes back with reset
+
+    Arguments:
+        token(string) - The user's token
+        version(string) - the version returned by the previous call, or None
+
+    Exceptions:
+        InputError - when version isn't a version given out by this function
+
+    Returns:
+        version(string) - the version to pass to the next call
+        reset(boolean) - True when the changes since version aren't known any
+            more, the client has to load everything again
+        events(list of dictionary) - one for each channel, dm or message that
+            changed, as it is now and oldest change first, then the new
+            notifications. Each has a type of
+                'channel' - the user is a member of it, with its name and u_ids
+                'left' - the user left it or it was removed
+                'message' - a message was sent or edited, with the message
+                'message_removed' - with the message_id of a removed message
+                'notifications' - with the notifications, newest first
+            channel, left and message events have a channel_id and dm_id like
+            notifications, one of them -1
+    '''
+    data = get_data()
+    user = data['users'][check_token(token)]
+    upto = data_store.change_version()
+    entries = None
+    if version is not None:
+        try:
+            entries = changelog.since(changelog.decode_version(version), upto)
+        except ValueError:
+            raise InputError(description='Version is not valid') from None
+
+    #each channel or message only needs its latest state once
+    events = {}
+    notified_from = None
+    for entry in entries or []:
+        if entry[0] == 'notifications':
+            if entry[1] == user.u_id and notified_from is None:
+                notified_from = entry[2]
+            continue
+        channel_index = data_store.channel_index(entry[1])
+        channel = None if channel_index is None else data['channels'][channel_index]
+        is_member = channel is not None and user.u_id in channel.all_members
+        if entry[0] == 'channel':
+            if is_member:
+                event = {'type' : 'channel', **channel_ids(entry[1], channel.is_dm), \
+                    'name' : channel.channel_name, 'u_ids' : list(channel.all_members.u_ids)}
+            elif user.u_id in entry[3]:
+                event = {'type' : 'left', **channel_ids(entry[1], entry[2])}
+            else:
+                continue
+        elif is_member:
+            location = data_store.message_location(entry[2])
+            if location is None or location[0] != channel_index:
+                event = {'type' : 'message_removed', **channel_ids(entry[1], channel.is_dm), \
+                    'message_id' : entry[2]}
+            else:
+                event = {'type' : 'message', **channel_ids(entry[1], channel.is_dm), \
+                    'message' : channel.messages[location[1]]}
+        else:
+            continue
+        key = entry[:3] if entry[0] == 'message' else entry[:2]
+        events.pop(key, None)
+        events[key] = event
+
+    events = list(events.values())
+    if notified_from is not None:
+        total = changelog.notification_total(user)
+        limit = min(total - notified_from, config.notifications_max_page_size)
+        if limit > 0:
+            events.append({'type' : 'notifications', \
+                'notifications' : notifications_page(user, None, limit)['notifications']})
+    return {
+        'version' : changelog.encode_version(upto),
+        'reset' : entries is None,
+        'events' : events,
+    }
+
+def channel_ids(channel_id, is_dm):
+    return {'channel_id' : -1 if is_dm else channel_id, 'dm_id' : channel_id if is_dm else -1}
 
 
 def search(token, query_str):
@@ -106,137 +218,60 @@ def search(token, query_str):
     
     user_index = check_token(token)
     data = get_data()
-    messages = []
-    for channel in [c for c in data['channels'] if check_is_member(data['users'][user_index]['u_id'], c['all_members'])]:
-        for message in channel['messages']:
-            if query_str in message['message']:
-                messages.append(
-                    {
-                        'message_id' : message['message_id'],
-                        'u_id' : message['u_id'],
-                        'message' : message['message'],
-                        'time_created' : message['time_created'],
-                    }
-                )
+    u_id = data['users'][user_index]['u_id']
+    member_channels = data_store.user_channels(u_id)
+
+    candidates = data_store.search_candidates(query_str)
+    if candidates is None:
+        #each channel's text buffer is searched as a whole
+        locations = [(channel, position) for channel in member_channels \
+            for position in data['channels'][channel].messages.find(query_str)]
+    else:
+        #check each candidate is in one of the user's channels and really has the query,
+        #sorted so messages come back in the same order as a full scan
+        member_channels = set(member_channels)
+        locations = sorted(location for location in \
+            map(data_store.message_location, candidates) \
+            if location is not None and location[0] in member_channels \
+            and query_str in data['channels'][location[0]].messages.text(location[1]))
+
+    #messages are records made from the data, they are only turned into json by the server
+    messages = [data['channels'][channel].messages[position] \
+        for channel, position in locations]
     return {
         'messages': messages,
     }
 
 
-def notify_user(u_id, channel_id, notification_message):
-    data = get_data()
-    channel_index = get_channel_index(channel_id)
-    notification = {
-        'channel_id' : -1 if data['channels'][channel_index]['is_dm'] else channel_id,
-        'dm_id' : channel_id if data['channels'][channel_index]['is_dm'] else -1,
-        'notification_message' : notification_message
-    }
-    data['users'][check_u_id(u_id)]['notifications'].insert(0, notification)
-    write_data(data)
-
-def tagged_info(message):
-    data = get_data()
-    tagged_names = []
-    user_info = []
-    if '@' in message:
-        names = re.findall(r"@\w+", message)
-        for name in names:
-            name = name[1:]
-            tagged_names.append(name)
-        #Find the tagged_name's u_id:
-        for tagged_name in tagged_names:
-            for user in data['users']:
-                if user['handle_str'] == tagged_name:
-                    user_info.append({
-                        'u_id': user['u_id'],
-                        'handle_str': user['handle_str']
-                    })
-                    break
-    return user_info
-
-def valid_tag_target(handle, u_id, channel_id):
-    data = get_data()
-    #Check the user's handle 
-    if data['users'][check_u_id(u_id)]['handle_str'] == handle and \
-    check_valid_dm_member(u_id, channel_id):
-        return True
-    return False
-
-def check_valid_dm_member(u_id, channel_id):
-    data = get_data()
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for eachMember in channel['all_members']:
-                if u_id == eachMember['u_id']:
-                    return True
-    return False  
-
-def generate_tag_notification_message(u_id, channel_id, token, message):
-    '''
-    This function only returns the tag notificatoin
-
-    Arguments:
-        u_id(integer)
-        token(integer)
-        channel_name(string)
-        message(string)
-    
-    Returns:
-        Tag notificatoin
-    '''
-    data = get_data()
-    channel_name = ''
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            channel_name = channel['channel_name']
-    handle_string = data['users'][check_token(token)]['handle_str']
-    return f"{handle_string} tagged you in {channel_name}: {message[:20]}"
-
-
 def insert_tag_notification(token, channel_id, message):
     '''
-        searches through all channels and dms a user is part of and returns 
-        all the messages that include the query string
+        notifies every member of a channel or dm who is tagged in a message,
+        each handle is looked up once and all the notifications are saved together
 
     Arguments:
-        token (string) - a user's session jwt token
-        query_str (string) - the given search term
+        token (string) - the sender's session jwt token
+        channel_id (integer) - the channel or dm the message was sent to
+        message (string) - the message that was sent
         
     Exceptions:
-        InputError - when the query_str is longer than a thousand characters
+        None
         
     Return Value:
-        Returns a list of all the related messages
+        None
     '''
     if '@' not in message:
         return
-    targets_info = tagged_info(message)
-    for target_info in targets_info:
-        if valid_tag_target(target_info['handle_str'], target_info['u_id'], channel_id):
-            notify_user(target_info['u_id'], channel_id, \
-            generate_tag_notification_message(target_info['u_id'], channel_id, token, message))
-
-
-def generate_addedChannel_notification(u_id, token, channel_name):
     data = get_data()
-    user_index = check_token(token)
-    messages = []
-    for channel in [c for c in data['channels'] if check_is_member(data['users'][user_index]['u_id'], c['all_members'])]:
-        for message in channel['messages']:
-            if query_str in message['message']:
-                messages.append(
-                    {
-                        'message_id' : message['message_id'],
-                        'u_id' : message['u_id'],
-                        'message' : message['message'],
-                        'time_created' : message['time_created'],
-                    }
-                )
-    return {
-        'messages': messages,
-    }
+    channel = data['channels'][get_channel_index(channel_id)]
     handle_string = data['users'][check_token(token)]['handle_str']
-    return f"{handle_string} added you to {channel_name}"
+    notification_message = f"{handle_string} tagged you in {channel['channel_name']}: {message[:20]}"
+
+    notified = []
+    for handle in dict.fromkeys(re.findall(r"@(\w+)", message)):
+        user_index = data_store.handle_index(handle)
+        if user_index is not None and data['users'][user_index]['u_id'] in channel['all_members']:
+            notified.append((data['users'][user_index]['u_id'], notification_message))
+    notify_users(channel_id, notified)
 
 
 #returns true if there is only one owner
@@ -276,12 +311,13 @@ def admin_user_remove(token, u_id):
     
     data['users'][user_index]['name_first'] = 'Removed user'
     data['users'][user_index]['name_last'] = 'Removed user'
+    forget_tokens(u_id)
     
+    changes = [('user', u_id)]
     for channel in data['channels']:
-        for message in channel['messages']:
-            if message['u_id'] == u_id:
-                message['message'] = 'Removed user'
-    write_data(data)
+        changes += [('message', channel.channel_id, message_id) \
+            for message_id in channel.messages.rewrite_sender(u_id, 'Removed user')]
+    write_data(data, *changes)
     return {}
 
 
@@ -313,6 +349,41 @@ def admin_userpermission_change(token, u_id, permission_id):
         raise InputError(description='permission_id does not refer to a value permission')
         
     data['users'][user_index]['permission_id'] = permission_id
-    write_data(data)
+    write_data(data, ('user', u_id))
     return {}
     
+
+def admin_message_stats(token):
+    '''
+        counts the messages in every channel and dm by the day they were sent,
+        and the messages every user has sent across the whole workspace
+
+    Arguments:
+        token (string) - a user's session jwt token
+        
+    Exceptions:
+        AccessError - when the token doesn't have owner permissions
+        
+    Return Value:
+        Returns a dictionary of channels, a list of each channel or dm's
+        channel_id with its message count for each day, given by the time the
+        day started in utc, and users, a list
+        of the u_id and message count of everyone who has sent a message
+    '''
+    data = get_data()
+    if data['users'][check_token(token)]['permission_id'] != OWNER:
+        raise AccessError(description='The authorised user is not an owner')
+
+    channels = []
+    senders = collections.Counter()
+    for channel in data['channels']:
+        days = channel.messages.day_counts()
+        channels.append({
+            'channel_id' : channel.channel_id,
+            'days' : [{'day' : day, 'messages' : days[day]} for day in sorted(days)],
+        })
+        senders.update(channel.messages.sender_counts())
+    return {
+        'channels' : channels,
+        'users' : [{'u_id' : u_id, 'messages' : senders[u_id]} for u_id in sorted(senders)],
+    }
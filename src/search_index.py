@@ -0,0 +1,162 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    20 April 2021
+'''
+
+import threading
+
+# trigram postings over the message text of one data dictionary, only built
+# the first time something long enough is searched for and then kept up to
+# date by data_store as messages change, or as snapshots are published
+trigrams = {
+    'data' : None,
+    'postings' : {},    # trigram -> set of message_ids whose text contains it
+    'channels' : {},    # message_id -> channel_id of every message indexed
+}
+
+# held while the postings are read or changed, searches run on request threads
+# while the writer thread moves the index on to each new snapshot
+lock = threading.RLock()
+
+def trigrams_of(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def reset():
+    with lock:
+        trigrams['data'] = None
+        trigrams['postings'] = {}
+        trigrams['channels'] = {}
+
+def build(data):
+    reset()
+    trigrams['data'] = data
+    for channel in data['channels']:
+        messages = channel.messages
+        for i in range(len(messages)):
+            add_message(channel.channel_id, messages.message_ids[i], messages.text(i))
+
+def add_message(channel_id, message_id, text):
+    trigrams['channels'][message_id] = channel_id
+    for trigram in trigrams_of(text):
+        trigrams['postings'].setdefault(trigram, set()).add(message_id)
+
+def remove_message(message_id, text):
+    del trigrams['channels'][message_id]
+    for trigram in trigrams_of(text):
+        posting = trigrams['postings'][trigram]
+        posting.discard(message_id)
+        if not posting:
+            del trigrams['postings'][trigram]
+
+def message_changed(data, channel_id, message_id, old_text, message):
+    '''
+        Re-indexes a message after it was sent, edited or removed. Only the
+        channel of each message is kept, so the text it was indexed with has
+        to be passed back in to take it out of the postings
+
+    Arguments:
+        data (dictionary) - the workspace data the message belongs to
+        channel_id (int) - the channel or dm the message is in
+        message_id (int) - the message's unique identifier
+        old_text (string) - the text the message had before it changed, or
+                            None if it wasn't there before
+        message (dictionary) - the message, or None if it was removed
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    with lock:
+        if trigrams['data'] is not data:
+            return
+        if message_id in trigrams['channels']:
+            if old_text is None:
+                #there is no way to tell which postings hold it, so the index is
+                #built again the next time it's needed
+                reset()
+                return
+            if message is not None and old_text == message['message'] \
+                and trigrams['channels'][message_id] == channel_id:
+                return
+            remove_message(message_id, old_text)
+        if message is not None:
+            add_message(channel_id, message_id, message['message'])
+
+def channel_removed(data, channel_id):
+    with lock:
+        if trigrams['data'] is not data:
+            return
+        removed = {message_id for message_id, indexed_channel \
+            in trigrams['channels'].items() if indexed_channel == channel_id}
+        if not removed:
+            return
+        #the channel's messages are gone with it, so every posting is gone through
+        for message_id in removed:
+            del trigrams['channels'][message_id]
+        for trigram, posting in list(trigrams['postings'].items()):
+            posting -= removed
+            if not posting:
+                del trigrams['postings'][trigram]
+
+def advance(previous, data, removed_channels, changed_messages):
+    '''
+        Moves the index from one published version of the data on to the next,
+        nothing happens if it wasn't following the previous version
+
+    Arguments:
+        previous (dictionary) - the version the index was built from
+        data (dictionary) - the version replacing it
+        removed_channels (list) - the channel_ids of channels and dms removed since
+        changed_messages (list) - tuples of (channel_id, message_id, old_text, message)
+                                  for each message sent, edited or removed since, where
+                                  old_text is its text in previous, see message_changed
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    with lock:
+        if trigrams['data'] is not previous:
+            return
+        trigrams['data'] = data
+        for channel_id in removed_channels:
+            channel_removed(data, channel_id)
+        for channel_id, message_id, old_text, message in changed_messages:
+            message_changed(data, channel_id, message_id, old_text, message)
+
+def candidates(data, query_str, rebuild=True):
+    '''
+        Narrows down which messages could contain a query string
+
+    Arguments:
+        data (dictionary) - the full workspace data
+        query_str (string) - the search term
+        rebuild (boolean) - whether to build the index for data if it is
+                            currently built for some other data
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns a set of message_ids containing every trigram of the query, each
+        still needs checking for the whole query, or None if the query is too
+        short to have any trigrams or the index isn't built for data
+    '''
+    query_trigrams = trigrams_of(query_str)
+    if not query_trigrams:
+        return None
+    with lock:
+        if trigrams['data'] is not data:
+            if not rebuild:
+                return None
+            build(data)
+        postings = sorted((trigrams['postings'].get(trigram, set()) \
+            for trigram in query_trigrams), key=len)
+        return postings[0].intersection(*postings[1:])
@@ -1,9 +1,15 @@
+import functools
+import signal
 import sys
-from json import dumps
-from flask import Flask, request
+import json
+from flask import Flask, request, copy_current_request_context
 from flask_cors import CORS
 from src.error import InputError
-from src import other, config, channel, channels, auth, user, dm, message
+from src import other, config, channel, channels, auth, user, dm, message, data_store, models
+
+# records from the data are only turned into json here, on their way out
+def dumps(value):
+    return json.dumps(value, default=models.encode)
 
 def defaultHandler(err):
     response = err.get_response()
@@ -22,6 +28,47 @@ CORS(APP)
 APP.config['TRAP_HTTP_EXCEPTIONS'] = True
 APP.register_error_handler(Exception, defaultHandler)
 
+# requests that only read see the latest published snapshot of the data for the
+# whole request without waiting for writes, requests that change something are
+# handed to data_store's writer thread (see run_on_writer) which commits them
+# in groups, or not at all if they fail
+READ_METHODS = ['GET', 'HEAD', 'OPTIONS']
+
+@APP.before_request
+def begin_request():
+    if request.method in READ_METHODS:
+        data_store.begin(read_only=True)
+
+@APP.after_request
+def end_request(response):
+    data_store.commit()
+    return response
+
+@APP.teardown_request
+def abandon_request(err):
+    #the request's context is also torn down on the writer thread after each view
+    #it runs, the group it is part of is committed or rolled back by the writer
+    if not data_store.on_writer():
+        data_store.rollback()
+
+def run_on_writer(view):
+    @functools.wraps(view)
+    def submit_view(**kwargs):
+        if request.method in READ_METHODS:
+            return view(**kwargs)
+        return data_store.submit(copy_current_request_context(lambda: view(**kwargs)))
+    return submit_view
+
+# messages routes page by cursor when no start is given, limit is optional
+def page_limit():
+    limit = request.args.get('limit')
+    return None if limit is None else int(limit)
+
+# or return the messages sent in a time range when since is given, until is optional
+def time_arg(name):
+    time = request.args.get(name)
+    return None if time is None else int(time)
+
 # Example
 @APP.route("/echo", methods=['GET'])
 def echo():
@@ -50,6 +97,10 @@ def channel_join():
 
 @APP.route('/channel/messages/v2', methods=['GET'])
 def channel_messages():
+    if request.args.get('since') is not None:
+        return dumps(channel.channel_messages_since(request.args.get('token'), int(request.args.get('channel_id')), time_arg('since'), time_arg('until'), page_limit()))
+    if request.args.get('start') is None:
+        return dumps(channel.channel_messages_page(request.args.get('token'), int(request.args.get('channel_id')), request.args.get('cursor'), page_limit()))
     return dumps(channel.channel_messages(request.args.get('token'), int(request.args.get('channel_id')), int(request.args.get('start'))))
 
 @APP.route('/channels/list/v2', methods=['GET']) 
@@ -102,6 +153,10 @@ def dm_details():
 
 @APP.route('/dm/messages/v1', methods=['GET'])
 def dm_messages():
+    if request.args.get('since') is not None:
+        return dumps(dm.dm_messages_since(request.args.get('token'), int(request.args.get('dm_id')), time_arg('since'), time_arg('until'), page_limit()))
+    if request.args.get('start') is None:
+        return dumps(dm.dm_messages_page(request.args.get('token'), int(request.args.get('dm_id')), request.args.get('cursor'), page_limit()))
     return dumps(dm.dm_messages(request.args.get('token'), int(request.args.get('dm_id')), int(request.args.get('start'))))
 
 @APP.route('/message/share/v1', methods=['POST'])
@@ -110,7 +165,7 @@ def message_share():
     
 @APP.route('/message/edit/v2', methods=['PUT'])
 def message_edit():
-    message.message_edit(**request.get_json())
+    return dumps(message.message_edit(**request.get_json()))
 
 @APP.route('/message/senddm/v1', methods=['POST'])
 def message_senddm():
@@ -164,13 +219,34 @@ def admin_user_remove():
 def admin_userpermission_change():
     return dumps(other.admin_userpermission_change(**request.get_json()))
 
+@APP.route('/admin/messages/stats/v1', methods=['GET'])
+def admin_message_stats():
+    return dumps(other.admin_message_stats(request.args.get('token')))
+
 @APP.route('/clear/v1', methods=['DELETE'])
 def clear():
     return(other.clear())
 
 @APP.route('/notifications/get/v1', methods=['GET'])
 def notifications_get_v1():
-    return dumps(other.notifications_get_v1(request.args.get('token')))
+    if request.args.get('cursor') is None and request.args.get('limit') is None:
+        return dumps(other.notifications_get(request.args.get('token')))
+    return dumps(other.notifications_get_page(request.args.get('token'), request.args.get('cursor'), page_limit()))
+
+@APP.route('/notifications/metrics/v1', methods=['GET'])
+def notifications_metrics():
+    return dumps(other.notifications_metrics(request.args.get('token')))
+
+@APP.route('/changes/get/v1', methods=['GET'])
+def changes_get():
+    return dumps(other.changes_get(request.args.get('token'), request.args.get('version')))
     
+for endpoint, view in list(APP.view_functions.items()):
+    if endpoint != 'static':
+        APP.view_functions[endpoint] = run_on_writer(view)
+data_store.start_writer()
+
 if __name__ == "__main__":
+    # a kill exits normally so queued notifications are flushed on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     APP.run(port=config.port) # Do not edit this port
@@ -0,0 +1,136 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    16 April 2021
+'''
+
+import json
+import os
+from src import models, files
+
+INDEX_FILE = 'data.json'
+SHARD_DIR = 'data_messages'
+# the id sequences are saved whenever a block of ids is reserved, far more
+# often than users or channels change, so they are kept out of the index
+SEQUENCES_FILE = 'data_sequences.json'
+
+# the stamp of each shard the cached messages were read from, by channel_id
+shards = {}
+
+def shard_file(channel_id):
+    return os.path.join(SHARD_DIR, f'{channel_id}.json')
+
+def stamp():
+    '''
+        Identifies the current version of the index, the sequences and the
+        shards, shards are only ever replaced by renaming into SHARD_DIR so its
+        stamp changes whenever any of them do
+    '''
+    return (files.file_stamp(INDEX_FILE), files.file_stamp(SEQUENCES_FILE), \
+        files.file_stamp(SHARD_DIR))
+
+def load_data(cached):
+    '''
+        Reads the index and every channel's shard back into the workspace data,
+        shards that haven't changed since they were cached aren't read again
+
+    Arguments:
+        cached (dictionary) - the data from the previous load, or None
+
+    Exceptions:
+        FileNotFoundError - Occurs when the index doesn't exist
+
+    Return Value:
+        Returns the data dictionary
+    '''
+    with open(INDEX_FILE, 'r') as f:
+        data = json.load(f)
+    try:
+        with open(SEQUENCES_FILE, 'r') as f:
+            data['sequences'] = json.load(f)
+    except FileNotFoundError:
+        pass
+    cached_messages = {}
+    if cached is not None:
+        cached_messages = {channel['channel_id'] : channel['messages'] \
+            for channel in cached['channels']}
+
+    loaded = {}
+    for channel in data['channels']:
+        channel_id = channel['channel_id']
+        shard_stamp = files.file_stamp(shard_file(channel_id))
+        if channel_id in cached_messages and shards.get(channel_id) == shard_stamp:
+            channel['messages'] = cached_messages[channel_id]
+        elif shard_stamp is None:
+            channel['messages'] = []
+        else:
+            with open(shard_file(channel_id), 'r') as f:
+                channel['messages'] = json.load(f)
+        loaded[channel_id] = shard_stamp
+    shards.clear()
+    shards.update(loaded)
+    return data
+
+def save(data, changes):
+    '''
+        Writes the index if any user or channel changed, the sequences if they
+        changed and the shard of every channel whose messages changed, or
+        everything when no changes are given
+
+    Arguments:
+        data (dictionary) - the full workspace data
+        changes (list) - the records that changed, see data_store.locate
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    channels = {channel['channel_id'] : channel for channel in data['channels']}
+    if not changes:
+        write_index(data)
+        write_sequences(data)
+        for channel_id, channel in channels.items():
+            write_shard(channel_id, channel['messages'])
+        for filename in os.listdir(SHARD_DIR):
+            if filename.endswith('.json') and int(filename[:-5]) not in channels:
+                remove_shard(int(filename[:-5]))
+        return
+
+    if any(change[0] in ['user', 'channel'] for change in changes):
+        write_index(data)
+    if ('sequences',) in changes:
+        write_sequences(data)
+    message_channels = {change[1] for change in changes if change[0] == 'message'}
+    for channel_id in dict.fromkeys(change[1] for change in changes \
+        if change[0] in ['channel', 'message']):
+        if channel_id not in channels:
+            remove_shard(channel_id)
+        elif channel_id in message_channels:
+            write_shard(channel_id, channels[channel_id]['messages'])
+
+def write_index(data):
+    index = {
+        'users' : data['users'],
+        'channels' : [{key : value for key, value in channel.items() if key != 'messages'} \
+            for channel in data['channels']],
+    }
+    files.write_json(INDEX_FILE, index, indent="", default=models.encode)
+
+def write_sequences(data):
+    files.write_json(SEQUENCES_FILE, data.get('sequences', {}))
+
+def write_shard(channel_id, messages):
+    files.write_json(shard_file(channel_id), messages, indent="", default=models.encode)
+    shards[channel_id] = files.file_stamp(shard_file(channel_id))
+
+def remove_shard(channel_id):
+    try:
+        os.remove(shard_file(channel_id))
+    except FileNotFoundError:
+        pass
+    shards.pop(channel_id, None)
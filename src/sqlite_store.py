@@ -0,0 +1,302 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    14 April 2021
+'''
+
+import sqlite3
+from src import config
+from src.models import User, Session, Notification, Channel, Message
+
+SQLITE_FILE = 'data.sqlite'
+
+# sqlite is only where the data is kept, nothing is looked up in it. Every
+# table is read back into the same workspace data dictionary the other storage
+# modes use, only when another connection has committed (see stamp), and
+# lookups go through data_store's hash indexes over that dictionary. What it
+# saves over data.json is writing only the rows of the records that changed,
+# all in one transaction
+
+# sqlite syncs its own writes, it can't wait a set time so 'interval' only
+# syncs at the moments sqlite considers critical, see config.durability
+SYNCHRONOUS = {
+    'always' : 'FULL',
+    'interval' : 'NORMAL',
+    'os' : 'OFF',
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    u_id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    email TEXT NOT NULL,
+    handle_str TEXT NOT NULL,
+    name_first TEXT NOT NULL,
+    name_last TEXT NOT NULL,
+    password TEXT NOT NULL,
+    permission_id INTEGER NOT NULL,
+    notifications_archived INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS users_email ON users (email);
+CREATE INDEX IF NOT EXISTS users_handle ON users (handle_str);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    u_id INTEGER NOT NULL,
+    session_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_user ON sessions (u_id);
+
+CREATE TABLE IF NOT EXISTS notifications (
+    u_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    dm_id INTEGER NOT NULL,
+    notification_message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notifications_user ON notifications (u_id);
+
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    channel_name TEXT NOT NULL,
+    is_public INTEGER NOT NULL,
+    is_dm INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS members (
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    is_owner INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS members_channel ON members (channel_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    message_id INTEGER NOT NULL UNIQUE,
+    channel_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    time_created
+);
+CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel_id, position);
+
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+# the open connection to SQLITE_FILE, made on first use
+database = {
+    'connection' : None,
+}
+
+def connect():
+    if database['connection'] is None:
+        connection = sqlite3.connect(SQLITE_FILE, check_same_thread=False)
+        connection.executescript(SCHEMA)
+        connection.execute(f'PRAGMA synchronous = {SYNCHRONOUS[config.durability]}')
+        #databases made before notifications were archived don't have the column
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(users)')]
+        if 'notifications_archived' not in columns:
+            connection.execute('ALTER TABLE users ADD COLUMN ' \
+                'notifications_archived INTEGER NOT NULL DEFAULT 0')
+        database['connection'] = connection
+    return database['connection']
+
+def stamp():
+    '''
+        Identifies the current version of the database, the value only
+        changes when another connection commits to it
+    '''
+    return connect().execute('PRAGMA data_version').fetchone()[0]
+
+def load_data():
+    '''
+        Reads every table back into the workspace data dictionary, there are
+        no point lookups so the whole of it is read each time
+
+    Arguments:
+        None
+
+    Exceptions:
+        None
+
+    Return Value:
+        Returns the data dictionary
+    '''
+    connection = connect()
+    sessions = {}
+    for u_id, session_id in connection.execute( \
+        'SELECT u_id, session_id FROM sessions ORDER BY rowid'):
+        sessions.setdefault(u_id, []).append(Session(session_id=session_id))
+    notifications = {}
+    for u_id, channel_id, dm_id, notification_message in connection.execute( \
+        'SELECT u_id, channel_id, dm_id, notification_message FROM notifications ' \
+        'ORDER BY rowid DESC'):
+        notifications.setdefault(u_id, []).append(Notification(
+            channel_id=channel_id,
+            dm_id=dm_id,
+            notification_message=notification_message,
+        ))
+
+    users = []
+    for u_id, email, handle_str, name_first, name_last, password, permission_id, \
+        notifications_archived in connection.execute('SELECT u_id, email, handle_str, ' \
+        'name_first, name_last, password, permission_id, notifications_archived ' \
+        'FROM users ORDER BY position'):
+        users.append(User(
+            u_id=u_id,
+            name_first=name_first,
+            name_last=name_last,
+            email=email,
+            password=password,
+            handle_str=handle_str,
+            sessions_list=sessions.get(u_id, []),
+            notifications=notifications.get(u_id, []),
+            notifications_archived=notifications_archived,
+            permission_id=permission_id,
+        ))
+
+    channels = []
+    channel_lookup = {}
+    for channel_id, channel_name, is_public, is_dm in connection.execute( \
+        'SELECT channel_id, channel_name, is_public, is_dm FROM channels ORDER BY position'):
+        channel = Channel(
+            channel_id=channel_id,
+            channel_name=channel_name,
+            owner_members=[],
+            all_members=[],
+            is_public=bool(is_public),
+            is_dm=bool(is_dm),
+            messages=[],
+        )
+        channels.append(channel)
+        channel_lookup[channel_id] = channel
+    for channel_id, u_id, is_owner in connection.execute( \
+        'SELECT channel_id, u_id, is_owner FROM members ORDER BY rowid'):
+        key = 'owner_members' if is_owner else 'all_members'
+        channel_lookup[channel_id][key].append(u_id)
+    for message_id, channel_id, u_id, message, time_created in connection.execute( \
+        'SELECT message_id, channel_id, u_id, message, time_created FROM messages ' \
+        'ORDER BY channel_id, position'):
+        channel_lookup[channel_id].messages.append(Message(
+            message_id=message_id,
+            u_id=u_id,
+            message=message,
+            time_created=time_created,
+        ))
+    data = {'users' : users, 'channels' : channels}
+    sequences = dict(connection.execute('SELECT name, value FROM sequences'))
+    if sequences:
+        data['sequences'] = sequences
+    return data
+
+def save(data, changes):
+    '''
+        Writes the given changes to the database in a single transaction,
+        or replaces every table with data when no changes are given
+
+    Arguments:
+        data (dictionary) - the full workspace data
+        changes (list) - tuples of (kind, position, record, key...) where
+                         record is None for removed records
+
+    Exceptions:
+        None
+
+    Return Value:
+        None
+    '''
+    connection = connect()
+    with connection:
+        if not changes:
+            for table in ['users', 'sessions', 'notifications', 'channels', \
+                'members', 'messages', 'sequences']:
+                connection.execute(f'DELETE FROM {table}')
+            write_sequences(connection, data.get('sequences', {}))
+            for position, user in enumerate(data['users']):
+                write_user(connection, position, user)
+            for position, channel in enumerate(data['channels']):
+                write_channel(connection, position, channel)
+                for message_position, message in enumerate(channel['messages']):
+                    write_message(connection, channel['channel_id'], \
+                        message_position, message)
+            return
+
+        #removals shift the position of everything after them so they are
+        #applied first, the remaining records then store their final position
+        for kind, _, record, *key in changes:
+            if record is None and kind == 'channel':
+                delete_channel(connection, key[0])
+            elif record is None and kind == 'message':
+                delete_message(connection, key[1])
+        for kind, position, record, *key in changes:
+            if record is None:
+                continue
+            if kind == 'sequences':
+                write_sequences(connection, record)
+            elif kind == 'user':
+                write_user(connection, position, record)
+            elif kind == 'channel':
+                write_channel(connection, position, record)
+            else:
+                write_message(connection, key[0], position, record)
+
+def write_sequences(connection, sequences):
+    connection.executemany('INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)', \
+        sequences.items())
+
+def write_user(connection, position, user):
+    connection.execute('INSERT OR REPLACE INTO users (u_id, position, email, handle_str, ' \
+        'name_first, name_last, password, permission_id, notifications_archived) ' \
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (user['u_id'], position, user['email'], \
+        user['handle_str'], user['name_first'], user['name_last'], user['password'], \
+        user['permission_id'], user.get('notifications_archived', 0)))
+    connection.execute('DELETE FROM sessions WHERE u_id = ?', (user['u_id'],))
+    connection.executemany('INSERT INTO sessions (u_id, session_id) VALUES (?, ?)', \
+        [(user['u_id'], session['session_id']) for session in user['sessions_list']])
+    #notifications are kept newest first, so they are inserted oldest first
+    connection.execute('DELETE FROM notifications WHERE u_id = ?', (user['u_id'],))
+    connection.executemany('INSERT INTO notifications (u_id, channel_id, dm_id, ' \
+        'notification_message) VALUES (?, ?, ?, ?)', [(user['u_id'], \
+        notification['channel_id'], notification['dm_id'], \
+        notification['notification_message']) \
+        for notification in reversed(user['notifications'])])
+
+def write_channel(connection, position, channel):
+    connection.execute('INSERT OR REPLACE INTO channels (channel_id, position, ' \
+        'channel_name, is_public, is_dm) VALUES (?, ?, ?, ?, ?)', (channel['channel_id'], \
+        position, channel['channel_name'], channel['is_public'], channel['is_dm']))
+    connection.execute('DELETE FROM members WHERE channel_id = ?', (channel['channel_id'],))
+    connection.executemany('INSERT INTO members (channel_id, u_id, is_owner) ' \
+        'VALUES (?, ?, ?)', [(channel['channel_id'], member['u_id'], 1) \
+        for member in channel['owner_members']] + [(channel['channel_id'], \
+        member['u_id'], 0) for member in channel['all_members']])
+
+def write_message(connection, channel_id, position, message):
+    connection.execute('INSERT INTO messages (message_id, channel_id, position, u_id, ' \
+        'message, time_created) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (message_id) ' \
+        'DO UPDATE SET channel_id = excluded.channel_id, position = excluded.position, ' \
+        'message = excluded.message', (message['message_id'], channel_id, position, \
+        message['u_id'], message['message'], message['time_created']))
+
+def delete_channel(connection, channel_id):
+    row = connection.execute('SELECT position FROM channels WHERE channel_id = ?', \
+        (channel_id,)).fetchone()
+    if row is None:
+        return
+    connection.execute('DELETE FROM channels WHERE channel_id = ?', (channel_id,))
+    connection.execute('UPDATE channels SET position = position - 1 WHERE position > ?', row)
+    connection.execute('DELETE FROM members WHERE channel_id = ?', (channel_id,))
+    connection.execute('DELETE FROM messages WHERE channel_id = ?', (channel_id,))
+
+def delete_message(connection, message_id):
+    row = connection.execute('SELECT channel_id, position FROM messages ' \
+        'WHERE message_id = ?', (message_id,)).fetchone()
+    if row is None:
+        return
+    connection.execute('DELETE FROM messages WHERE message_id = ?', (message_id,))
+    connection.execute('UPDATE messages SET position = position - 1 ' \
+        'WHERE channel_id = ? AND position > ?', row)
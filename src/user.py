@@ -94,7 +94,7 @@ def user_profile_setname(token, name_first, name_last):
         data = get_data()
         data['users'][user_index]['name_first'] = name_first
         data['users'][user_index]['name_last'] = name_last
-        write_data(data)
+        write_data(data, ('user', data['users'][user_index]['u_id']))
         
     return {}
 
@@ -124,7 +124,7 @@ def user_profile_setemail(token, email):
     else:
         data = get_data()
         data['users'][user_index]['email'] = email
-        write_data(data)
+        write_data(data, ('user', data['users'][user_index]['u_id']))
         
     return {}
 
@@ -155,6 +155,6 @@ def user_profile_sethandle(token, handle_str):
     else:
         data = get_data()
         data['users'][user_index]['handle_str'] = handle_str
-        write_data(data)
+        write_data(data, ('user', data['users'][user_index]['u_id']))
         
     return {}
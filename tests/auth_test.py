@@ -0,0 +1,68 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    25 April 2021
+'''
+import jwt
+import pytest
+from src import auth, data_store
+from src.error import AccessError
+from tests.data_store_test import workspace
+
+#counts how many times a token's signature is verified
+@pytest.fixture
+def decoded(monkeypatch):
+    decode = jwt.decode
+    tokens = []
+    def counted(token, *args, **kwargs):
+        tokens.append(token)
+        return decode(token, *args, **kwargs)
+    monkeypatch.setattr(jwt, 'decode', counted)
+    return tokens
+
+#test that a token is only verified once
+def test_token_cached(workspace, decoded):
+    token = auth.auth_register('aa@bb.com', 'password', 'first', 'last')['token']
+    assert auth.check_token(token) == 0
+    assert auth.check_token(token) == 0
+    assert decoded == [token]
+
+#test that only the most recently verified tokens are remembered
+def test_token_cache_size(workspace, decoded, monkeypatch):
+    monkeypatch.setattr(auth, 'TOKEN_CACHE_SIZE', 2)
+    tokens = [auth.auth_register(f'user{i}@bb.com', 'password', 'first', 'last')['token'] \
+        for i in ['a', 'b', 'c']]
+    for token in tokens:
+        auth.check_token(token)
+    assert list(auth.verified_tokens) == tokens[1:]
+    auth.check_token(tokens[0])
+    assert decoded == [*tokens, tokens[0]]
+
+#test that a token stops working as soon as its session is logged out
+def test_token_logout(workspace):
+    auth.auth_register('aa@bb.com', 'password', 'first', 'last')
+    token = auth.auth_login('aa@bb.com', 'password')['token']
+    auth.check_token(token)
+    assert auth.auth_logout(token)['is_success']
+    assert token not in auth.verified_tokens
+    with pytest.raises(AccessError):
+        auth.check_token(token)
+
+#test that a token is checked once for a whole unit of work, until it is logged out
+def test_principal(workspace, decoded):
+    token = auth.auth_register('aa@bb.com', 'password', 'first', 'last')['token']
+    auth.verified_tokens.clear()
+    decoded.clear()
+    data_store.begin()
+    try:
+        principal = auth.get_principal(token)
+        assert auth.get_principal(token) is principal
+        assert principal['user_index'] == 0 and principal['permission_id'] == 1
+        assert decoded == [token]
+        auth.auth_logout(token)
+        with pytest.raises(AccessError):
+            auth.get_principal(token)
+    finally:
+        data_store.rollback()
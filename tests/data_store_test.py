@@ -0,0 +1,310 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    25 April 2021
+'''
+import os
+import subprocess
+import sys
+import threading
+import pytest
+from src import config, data_store, search_index, sqlite_store, shard_store, auth, other, \
+    channels, channel, message, dm, user
+from src.error import InputError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#forgets everything held in memory about the data files, as if the server restarted
+def restart():
+    #a test that failed part way through a unit of work left it active
+    if data_store.in_unit():
+        data_store.rollback()
+    data_store.invalidate()
+    data_store.index['data'] = None
+    data_store.snapshots['current'] = None
+    data_store.dirty.clear()
+    data_store.blocks.clear()
+    search_index.reset()
+    shard_store.shards.clear()
+    if sqlite_store.database['connection'] is not None:
+        sqlite_store.database['connection'].close()
+        sqlite_store.database['connection'] = None
+    with auth.verified_tokens_lock:
+        auth.verified_tokens.clear()
+
+#runs python code in another process working on the same data files
+def in_other_process(code):
+    subprocess.run([sys.executable, '-c', code], check=True, env=dict(os.environ, \
+        PYTHONPATH=ROOT, DREAMS_STORAGE=config.storage, DREAMS_LOCKING=config.locking))
+
+#each test gets empty data files of its own in a temporary directory
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    restart()
+    other.clear()
+    yield tmp_path
+    restart()
+
+#test that the data is only read once while the files don't change
+def test_load_cached(workspace):
+    auth.auth_register('aa@bb.com', 'password', 'first', 'last')
+    data = data_store.load()
+    assert data_store.load() is data
+    assert auth.get_data() is data
+
+#test that the data is read again once another process changes the files
+def test_load_other_process(workspace):
+    data = data_store.load()
+    in_other_process("from src import auth; auth.auth_register('cc@bb.com', 'password', 'other', 'last')")
+    reloaded = data_store.load()
+    assert reloaded is not data
+    assert [record['email'] for record in reloaded['users']] == ['cc@bb.com']
+
+#counts the writes made by persist
+@pytest.fixture
+def persisted(monkeypatch):
+    persist = data_store.persist
+    writes = []
+    monkeypatch.setattr(data_store, 'persist', \
+        lambda data, changes: writes.append(changes) or persist(data, changes))
+    return writes
+
+#test that nothing is written until the unit of work commits, and then all at once
+def test_unit_commit(workspace, persisted):
+    called = []
+    data_store.begin()
+    data = data_store.load()
+    auth.auth_register('aa@bb.com', 'password', 'first', 'last')
+    auth.auth_register('cc@bb.com', 'password', 'second', 'last')
+    data_store.after_commit(lambda: called.append(len(persisted)))
+    assert data_store.load() is data
+    assert persisted == [] and called == []
+    data_store.commit()
+
+    assert len(persisted) == 1 and called == [1]
+    restart()
+    assert len(data_store.load()['users']) == 2
+
+#test that a rolled back unit of work leaves the files as they were
+def test_unit_rollback(workspace):
+    called = []
+    data_store.begin()
+    auth.auth_register('aa@bb.com', 'password', 'first', 'last')
+    data_store.after_commit(lambda: called.append(True))
+    data_store.rollback()
+    assert called == []
+    assert data_store.load()['users'] == []
+
+#test that a unit scope lasts until the end of the unit of work
+def test_unit_scope(workspace):
+    assert data_store.unit_scope('test') == {}
+    data_store.unit_scope('test')['key'] = 'value'
+    assert data_store.unit_scope('test') == {}
+
+    data_store.begin()
+    data_store.unit_scope('test')['key'] = 'value'
+    assert data_store.unit_scope('test') == {'key' : 'value'}
+    data_store.commit()
+    data_store.begin()
+    assert data_store.unit_scope('test') == {}
+    data_store.rollback()
+
+#calls read in a read only unit of work, which reads the latest snapshot
+def read_snapshot(read):
+    data_store.begin(read_only=True)
+    try:
+        return read()
+    finally:
+        data_store.rollback()
+
+#checks every lookup against the data itself
+def check_lookups(removed_messages, removed_channels):
+    data = data_store.load()
+    for position, record in enumerate(data['users']):
+        assert data_store.user_index(record['u_id']) == position
+        assert data_store.email_index(record['email']) == position
+    for position, record in enumerate(data['channels']):
+        assert data_store.channel_index(record['channel_id']) == position
+        for message_position, sent in enumerate(record['messages']):
+            assert data_store.message_location(sent['message_id']) == (position, message_position)
+    for message_id in removed_messages:
+        assert data_store.message_location(message_id) is None
+    for channel_id in removed_channels:
+        assert data_store.channel_index(channel_id) is None
+
+#test that lookups find the right record after others are removed from before it
+def test_index_after_remove(workspace):
+    owner = auth.auth_register('owner@bb.com', 'password', 'owner', 'last')
+    channel_ids = [channels.channels_create(owner['token'], f'channel{i}', True)['channel_id'] \
+        for i in range(3)]
+    sent = [message.message_send(owner['token'], channel_ids[i % 3], f'message {i}')['message_id'] \
+        for i in range(9)]
+    dm_id = dm.dm_create(owner['token'], [])['dm_id']
+    message.message_senddm(owner['token'], dm_id, 'in a dm')
+    channels.channels_create(owner['token'], 'after the dm', True)
+    check_lookups([], [])
+    read_snapshot(lambda: check_lookups([], []))
+
+    #committed changes carry the snapshot's copy of the indexes on from there
+    def change():
+        message.message_remove(owner['token'], sent[0])
+        message.message_remove(owner['token'], sent[4])
+        message.message_edit(owner['token'], sent[3], 'edited')
+        dm.dm_remove(owner['token'], dm_id)
+    data_store.submit(change)
+    check_lookups([sent[0], sent[4]], [dm_id])
+    read_snapshot(lambda: check_lookups([sent[0], sent[4]], [dm_id]))
+
+#test that users are found by their email and handle, and not by ones they changed from
+def test_email_handle_index(workspace):
+    first = auth.auth_register('first@bb.com', 'password', 'same', 'name')
+    second = auth.auth_register('second@bb.com', 'password', 'same', 'name')
+    data = data_store.load()
+    assert [record['handle_str'] for record in data['users']] == ['samename', 'samename0']
+    assert data_store.email_index('second@bb.com') == 1
+    assert data_store.handle_index('samename0') == 1
+    assert data_store.email_index('nobody@bb.com') is None
+
+    user.user_profile_setemail(first['token'], 'changed@bb.com')
+    user.user_profile_sethandle(second['token'], 'changedhandle')
+    assert data_store.email_index('first@bb.com') is None
+    assert data_store.email_index('changed@bb.com') == 0
+    assert data_store.handle_index('samename0') is None
+    assert data_store.handle_index('changedhandle') == 1
+    assert auth.email_taken('changed@bb.com') and not auth.email_taken('first@bb.com')
+
+#test that a numbered handle someone changed away from is handed out again
+def test_handle_suffix_freed(workspace):
+    auth.auth_register('first@bb.com', 'password', 'same', 'name')
+    second = auth.auth_register('second@bb.com', 'password', 'same', 'name')
+    auth.auth_register('third@bb.com', 'password', 'same', 'name')
+    user.user_profile_sethandle(second['token'], 'changedhandle')
+    auth.auth_register('fourth@bb.com', 'password', 'same', 'name')
+    assert [record['handle_str'] for record in data_store.load()['users']] \
+        == ['samename', 'changedhandle', 'samename1', 'samename0']
+
+#test that ids of removed records aren't handed out again
+def test_ids_not_reused(workspace):
+    owner = auth.auth_register('owner@bb.com', 'password', 'owner', 'last')
+    channel_id = channels.channels_create(owner['token'], 'channel', True)['channel_id']
+    removed = message.message_send(owner['token'], channel_id, 'removed')['message_id']
+    message.message_remove(owner['token'], removed)
+    assert message.message_send(owner['token'], channel_id, 'sent')['message_id'] > removed
+
+    dm_id = dm.dm_create(owner['token'], [])['dm_id']
+    dm.dm_remove(owner['token'], dm_id)
+    assert channels.channels_create(owner['token'], 'another', True)['channel_id'] > dm_id
+
+#test that a block of ids is reserved at a time and a restart skips what was left of it
+def test_id_blocks(workspace, monkeypatch):
+    monkeypatch.setattr(config, 'id_block_size', 10)
+    assert [data_store.next_id('message_id') for _ in range(3)] == [1, 2, 3]
+    assert data_store.load()['sequences']['message_id'] == 10
+    restart()
+    assert data_store.next_id('message_id') == 11
+    assert data_store.load()['sequences']['message_id'] == 20
+
+#test that a block reserved by a unit of work that is rolled back isn't used
+def test_id_blocks_rollback(workspace, monkeypatch):
+    monkeypatch.setattr(config, 'id_block_size', 10)
+    data_store.begin()
+    assert data_store.next_id('message_id') == 1
+    data_store.rollback()
+    assert 'message_id' not in data_store.blocks
+
+    #the sequence was never written, so the ids are reserved again from it
+    assert data_store.next_id('message_id') == 1
+    assert data_store.load()['sequences']['message_id'] == 10
+
+#test that blocks reserved before the data was cleared aren't used after
+def test_id_blocks_clear(workspace, monkeypatch):
+    monkeypatch.setattr(config, 'id_block_size', 10)
+    assert data_store.next_id('u_id') == 1
+    other.clear()
+    assert data_store.next_id('u_id') == 1
+
+#checks the channels found for each user are the ones they are a member of
+def check_memberships():
+    data = data_store.load()
+    for record in data['users']:
+        assert data_store.user_channels(record['u_id']) == [position for position, joined \
+            in enumerate(data['channels']) if record['u_id'] in joined['all_members']]
+
+#test that a user's channels and dms are found as they join, leave and are removed
+def test_memberships(workspace):
+    owner = auth.auth_register('owner@bb.com', 'password', 'owner', 'last')
+    member = auth.auth_register('member@bb.com', 'password', 'member', 'last')
+    first = channels.channels_create(owner['token'], 'first', True)['channel_id']
+    second = channels.channels_create(member['token'], 'second', True)['channel_id']
+    dm_id = dm.dm_create(owner['token'], [member['auth_user_id']])['dm_id']
+    channel.channel_join(member['token'], first)
+    channel.channel_invite(member['token'], second, owner['auth_user_id'])
+    check_memberships()
+    read_snapshot(check_memberships)
+    assert channels.channels_list(member['token'])['channels'] == [
+        {'channel_id' : first, 'channel_name' : 'first'},
+        {'channel_id' : second, 'channel_name' : 'second'},
+    ]
+    assert dm.dm_list(member['token'])['dms'][0]['dm_id'] == dm_id
+
+    def change():
+        channel.channel_leave(member['token'], first)
+        dm.dm_leave(member['token'], dm_id)
+        channels.channels_create(member['token'], 'third', False)
+    data_store.submit(change)
+    check_memberships()
+    read_snapshot(check_memberships)
+    assert [listed['channel_name'] for listed in channels.channels_list(member['token'])['channels']] \
+        == ['second', 'third']
+    assert dm.dm_list(member['token'])['dms'] == []
+
+    data_store.submit(lambda: dm.dm_remove(owner['token'], dm_id))
+    check_memberships()
+    read_snapshot(check_memberships)
+
+#a job for run_group as submit would make it
+def make_job(change):
+    return {'change' : change, 'done' : threading.Event(), 'result' : None, 'error' : None}
+
+#test that the jobs of a group are committed together in one write
+def test_group_commit(workspace, persisted):
+    jobs = [make_job(lambda i=i: auth.auth_register(f'user{i}@bb.com', 'password', 'first', 'last')) \
+        for i in ['a', 'b', 'c']]
+    data_store.run_group(jobs)
+    assert len(persisted) == 1
+    assert all(job['done'].is_set() and job['error'] is None for job in jobs)
+    assert [job['result']['auth_user_id'] for job in jobs] == [1, 2, 3]
+    restart()
+    assert len(data_store.load()['users']) == 3
+
+#test that a job failing after it saved something is left out and the rest kept
+def test_group_rollback(workspace, persisted):
+    error = ValueError('failed part way')
+    def fail():
+        auth.auth_register('failed@bb.com', 'password', 'failed', 'last')
+        raise error
+    jobs = [make_job(lambda: auth.auth_register('kept@bb.com', 'password', 'kept', 'last')), \
+        make_job(fail), \
+        make_job(lambda: auth.auth_register('also@bb.com', 'password', 'also', 'last'))]
+    data_store.run_group(jobs)
+    assert len(persisted) == 1
+    assert jobs[1]['error'] is error
+    assert jobs[0]['error'] is None and jobs[2]['error'] is None
+    assert all(job['done'].is_set() for job in jobs)
+    restart()
+    assert [record['email'] for record in data_store.load()['users']] == ['kept@bb.com', 'also@bb.com']
+
+#test that a job failing before it saved anything doesn't stop the others
+def test_group_error(workspace, persisted):
+    jobs = [make_job(lambda: auth.auth_register('kept@bb.com', 'password', 'kept', 'last')), \
+        make_job(lambda: auth.auth_login('nobody@bb.com', 'password'))]
+    data_store.run_group(jobs)
+    assert len(persisted) == 1
+    assert jobs[0]['error'] is None
+    assert isinstance(jobs[1]['error'], InputError)
+    with pytest.raises(InputError):
+        data_store.submit(lambda: auth.auth_login('nobody@bb.com', 'password'))
+    assert [record['email'] for record in data_store.load()['users']] == ['kept@bb.com']
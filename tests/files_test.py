@@ -0,0 +1,148 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    25 April 2021
+'''
+import os
+import subprocess
+import sys
+import pytest
+from src import config, data_store, files, auth
+from tests.data_store_test import workspace, restart, in_other_process, ROOT
+
+#data files locked across processes
+@pytest.fixture
+def locked(workspace, monkeypatch):
+    monkeypatch.setattr(config, 'locking', 'fcntl')
+    return workspace
+
+#whether another process can take the exclusive lock without waiting
+def free_in_other_process():
+    try:
+        in_other_process('import fcntl; ' \
+            f"fcntl.flock(open('{files.LOCK_FILE}', 'a'), fcntl.LOCK_EX | fcntl.LOCK_NB)")
+    except subprocess.CalledProcessError:
+        return False
+    return True
+
+#test that a unit that writes keeps other processes out until it ends
+def test_exclusive_unit(locked):
+    assert free_in_other_process()
+    data_store.begin()
+    try:
+        assert files.holds_exclusive()
+        assert not free_in_other_process()
+        auth.auth_register('aa@bb.com', 'password', 'first', 'last')
+        data_store.commit()
+    finally:
+        data_store.rollback()
+    assert not files.holds_exclusive()
+    assert free_in_other_process()
+
+#test that taking the lock again while holding it doesn't let it go early
+def test_exclusive_nested(locked):
+    with files.exclusive_lock():
+        with files.exclusive_lock():
+            assert files.holds_exclusive()
+        with files.shared_lock():
+            assert files.holds_exclusive()
+        assert not free_in_other_process()
+    assert free_in_other_process()
+
+#test that nothing is locked unless locking is turned on
+def test_no_locking(workspace, monkeypatch):
+    monkeypatch.setattr(config, 'locking', 'none')
+    data_store.begin()
+    try:
+        assert not files.holds_exclusive()
+        assert free_in_other_process()
+    finally:
+        data_store.rollback()
+
+    monkeypatch.setattr(config, 'locking', 'fcntl')
+    monkeypatch.setattr(files, 'fcntl', None)
+    with pytest.raises(RuntimeError):
+        files.acquire_exclusive()
+
+#test that processes registering at the same time never lose or share a user,
+#each registers in a unit of work like the server's requests
+def test_processes_share_ids(locked):
+    code = "from src import auth, data_store; [data_store.submit(lambda: " \
+        "auth.auth_register(f'{}{}@bb.com', 'password', 'first', 'last')) for i in 'abcdefghij']"
+    processes = [subprocess.Popen([sys.executable, '-c', code.format(name, '{i}')], \
+        env=dict(os.environ, PYTHONPATH=ROOT, DREAMS_STORAGE=config.storage, \
+        DREAMS_LOCKING='fcntl')) for name in ['first', 'second', 'third']]
+    assert [process.wait() for process in processes] == [0, 0, 0]
+
+    restart()
+    users = data_store.load()['users']
+    assert len(users) == 30
+    assert len({record['u_id'] for record in users}) == 30
+    assert len({record['handle_str'] for record in users}) == 30
+
+#records every file and directory synced on its own, and how many times anything was
+@pytest.fixture
+def synced(monkeypatch):
+    fsync = os.fsync
+    sync_file = files.sync_file
+    calls = {'files' : [], 'fsyncs' : 0}
+    def counted_fsync(fd):
+        calls['fsyncs'] += 1
+        fsync(fd)
+    def counted_sync_file(filename):
+        calls['files'].append(filename)
+        sync_file(filename)
+    monkeypatch.setattr(os, 'fsync', counted_fsync)
+    monkeypatch.setattr(files, 'sync_file', counted_sync_file)
+    return calls
+
+#test that a file is replaced whole and nothing is left beside it
+def test_write_json(workspace):
+    files.write_json('test.json', {'value' : 1})
+    files.write_json('test.json', {'value' : 2})
+    with open('test.json') as f:
+        assert f.read() == '{"value": 2}'
+
+    #a write that fails part way leaves the old file
+    with pytest.raises(TypeError):
+        files.write_json('test.json', {'value' : object()})
+    with open('test.json') as f:
+        assert f.read() == '{"value": 2}'
+    assert not [filename for filename in os.listdir() if filename.endswith('.tmp')]
+
+#test that in 'always' durability every write is synced before it returns
+def test_durability_always(workspace, monkeypatch, synced):
+    monkeypatch.setattr(config, 'durability', 'always')
+    files.write_json('test.json', [])
+    assert synced == {'files' : [str(workspace)], 'fsyncs' : 2}
+    files.append_text('test.txt', 'line\n')
+    assert synced['fsyncs'] == 3
+    assert files.unsynced['files'] == set()
+
+#test that in 'interval' durability writes are synced together later
+def test_durability_interval(workspace, monkeypatch, synced):
+    monkeypatch.setattr(config, 'durability', 'interval')
+    #the syncer thread would sync them before they could be checked
+    monkeypatch.setitem(files.unsynced, 'syncer', 'not started')
+    monkeypatch.setitem(files.unsynced, 'files', set())
+    files.write_json('test.json', [])
+    files.append_text('test.txt', 'line\n')
+    files.append_text('removed.txt', 'line\n')
+    os.remove('removed.txt')
+    assert synced == {'files' : [], 'fsyncs' : 1}
+    assert files.unsynced['files'] == {'test.json', 'test.txt', 'removed.txt'}
+
+    files.sync()
+    assert sorted(synced['files']) == sorted(['removed.txt', 'test.json', 'test.txt', str(workspace)])
+    assert synced['fsyncs'] == 4
+    assert files.unsynced['files'] == set()
+
+#test that in 'os' durability only the temporary file of a replacement is synced
+def test_durability_os(workspace, monkeypatch, synced):
+    monkeypatch.setattr(config, 'durability', 'os')
+    files.write_json('test.json', [])
+    files.append_text('test.txt', 'line\n')
+    assert synced == {'files' : [], 'fsyncs' : 1}
+    assert files.unsynced['files'] == set()
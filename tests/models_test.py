@@ -0,0 +1,208 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    25 April 2021
+'''
+import copy
+import json
+import pytest
+from src import models
+from src.members import Members
+from src.models import Messages
+
+USER = {
+    'u_id' : 1,
+    'name_first' : 'first',
+    'name_last' : 'last',
+    'email' : 'aa@bb.com',
+    'password' : 'hashed',
+    'handle_str' : 'firstlast',
+    'sessions_list' : [{'session_id' : 1}],
+    'notifications' : [{'channel_id' : 1, 'dm_id' : -1, 'notification_message' : 'hi'}],
+    'notifications_archived' : 0,
+    'permission_id' : 1,
+}
+
+CHANNEL = {
+    'channel_id' : 1,
+    'channel_name' : 'channel',
+    'owner_members' : [{'u_id' : 1}],
+    'all_members' : [{'u_id' : 1}, {'u_id' : 2}],
+    'is_public' : True,
+    'is_dm' : False,
+    'messages' : [
+        {'message_id' : 1, 'u_id' : 1, 'message' : 'hello', 'time_created' : 1618000000},
+        {'message_id' : 2, 'u_id' : 2, 'message' : 'hi', 'time_created' : 1618000060},
+    ],
+}
+
+#the record written out as json and read back as a dictionary
+def written(record):
+    return json.loads(json.dumps(record, default=models.encode))
+
+#test that a record reads and changes like the dictionary it was made from
+def test_record_fields():
+    user = models.user(USER)
+    assert user.email == user['email'] == 'aa@bb.com'
+    assert user.get('email') == 'aa@bb.com' and user.get('missing') is None
+    assert 'email' in user and 'missing' not in user
+    assert list(user) == list(USER) and len(user) == len(USER)
+    assert isinstance(user.sessions_list[0], models.Session)
+    assert isinstance(user.notifications[0], models.Notification)
+
+    user['name_first'] = 'changed'
+    assert user.name_first == 'changed'
+    with pytest.raises(KeyError):
+        user['missing'] = 'value'
+    with pytest.raises(KeyError):
+        user['missing']
+    with pytest.raises(TypeError):
+        del user['email']
+
+#test that records only have the fields they were made with
+def test_record_slots():
+    user = models.user(USER)
+    assert not hasattr(user, '__dict__')
+    with pytest.raises(AttributeError):
+        user.missing = 'value'
+    with pytest.raises(TypeError):
+        models.User(u_id=1)
+    with pytest.raises(TypeError):
+        models.user(dict(USER, missing='value'))
+
+    #a field with a default can be left out, as it is in older data files
+    fields = dict(USER)
+    del fields['notifications_archived']
+    assert models.user(fields).notifications_archived == 0
+
+#test that records are written as the dictionaries they were made from
+def test_record_encode():
+    user = models.user(USER)
+    assert written(user) == USER
+    assert models.record('user', written(user)) == user
+    assert models.record('user', None) is None
+
+    channel = models.channel(CHANNEL)
+    assert isinstance(channel.all_members, Members)
+    assert isinstance(channel.messages, Messages)
+    assert written(channel) == CHANNEL
+    assert models.channel(channel) is channel
+    message = models.record('message', CHANNEL['messages'][0])
+    assert written(message) == CHANNEL['messages'][0]
+
+#test that copying a record copies everything in it
+def test_record_copy():
+    channel = models.channel(CHANNEL)
+    copied = copy.deepcopy(channel)
+    copied.all_members.remove(2)
+    copied.messages.edit(0, 'changed')
+    assert written(channel) == CHANNEL
+    assert copied.messages[0]['message'] == 'changed'
+    assert 2 not in copied.all_members
+
+#test that the data read from the files is turned into records
+def test_adopt():
+    data = models.adopt({'users' : [USER], 'channels' : [CHANNEL]})
+    assert isinstance(data['users'][0], models.User)
+    assert isinstance(data['channels'][0], models.Channel)
+    assert models.adopt(data)['users'][0] is data['users'][0]
+
+#a channel's messages with every third one sent by user 2
+def make_messages():
+    return Messages({'message_id' : i, 'u_id' : 2 if i % 3 == 0 else 1, \
+        'message' : f'message {i}', 'time_created' : 1618000000 + i} for i in range(1, 10))
+
+#test that the columns read like the list of messages they replace
+def test_messages_list():
+    messages = make_messages()
+    assert len(messages) == 9
+    assert messages[0] == {'message_id' : 1, 'u_id' : 1, 'message' : 'message 1', \
+        'time_created' : 1618000001}
+    assert [sent['message_id'] for sent in messages[-2:]] == [8, 9]
+    assert messages.position(5) == 4 and messages.position(10) is None
+
+    messages[1] = {'message_id' : 2, 'u_id' : 2, 'message' : 'replaced', 'time_created' : 1618000002}
+    messages.edit(0, '')
+    del messages[2]
+    messages.remove({'message_id' : 9})
+    messages.append({'message_id' : 10, 'u_id' : 1, 'message' : 'last', 'time_created' : 1618000010})
+    assert [sent['message'] for sent in messages] == \
+        ['', 'replaced', *(f'message {i}' for i in range(4, 9)), 'last']
+    assert messages == Messages(list(messages))
+    with pytest.raises(ValueError):
+        messages.remove({'message_id' : 9})
+
+#test that searching the buffer only finds a query within one message
+def test_messages_find():
+    messages = Messages({'message_id' : i, 'u_id' : 1, 'message' : text, \
+        'time_created' : 1618000000} for i, text in enumerate(['ab', '', 'cd', 'abcd']))
+    assert messages.find('cd') == [2, 3]
+    assert messages.find('bc') == [3]
+    assert messages.find('') == [0, 1, 2, 3]
+    assert messages.find('x') == []
+
+#test that a user's messages are rewritten in one pass
+def test_messages_rewrite_sender():
+    messages = make_messages()
+    assert messages.rewrite_sender(2, 'Removed user') == [3, 6, 9]
+    assert [sent['message'] for sent in messages] == \
+        ['Removed user' if i % 3 == 0 else f'message {i}' for i in range(1, 10)]
+    assert messages.rewrite_sender(3, 'Removed user') == []
+    assert messages.sender_counts() == {1 : 6, 2 : 3}
+
+#test that a shared copy never sees what changes after it was made
+def test_messages_share():
+    messages = make_messages()
+    shared = messages.share()
+    before = list(shared)
+    assert shared.message_ids is messages.message_ids
+
+    #appending doesn't copy the columns, the shared copy stops at its limit
+    messages.append({'message_id' : 10, 'u_id' : 1, 'message' : 'new', 'time_created' : 1618000010})
+    assert shared.message_ids is messages.message_ids
+    assert list(shared) == before and len(shared) == 9
+    assert shared.find('new') == [] and shared.position(10) is None
+    assert shared.sender_counts() == {1 : 6, 2 : 3}
+
+    #anything else copies them first
+    messages.edit(0, 'edited')
+    assert shared.message_ids is not messages.message_ids
+    del messages[1]
+    messages[2] = {'message_id' : 4, 'u_id' : 1, 'message' : 'replaced', 'time_created' : 1618000004}
+    assert list(shared) == before
+    assert messages[0]['message'] == 'edited' and len(messages) == 9
+
+#test that rewriting a sender's messages leaves a shared copy as it was
+def test_messages_share_rewrite():
+    messages = make_messages()
+    shared = messages.share()
+    before = list(shared)
+    messages.rewrite_sender(2, 'Removed user')
+    assert list(shared) == before
+    assert messages[2]['message'] == 'Removed user'
+
+#test that the text a message had before it changed is kept until it is saved
+def test_messages_replaced():
+    messages = make_messages()
+    messages.edit(0, 'first edit')
+    messages.edit(0, 'second edit')
+    del messages[1]
+    messages.rewrite_sender(2, 'Removed user')
+    assert messages.replaced == {1 : 'message 1', 2 : 'message 2', 3 : 'message 3', \
+        6 : 'message 6', 9 : 'message 9'}
+
+#test that members read like the list of {'u_id' : u_id} they replace
+def test_members():
+    members = Members([{'u_id' : 3}, 1, {'u_id' : 2, 'name' : 'ignored'}])
+    assert list(members) == [{'u_id' : 3}, {'u_id' : 1}, {'u_id' : 2}]
+    assert members[1] == {'u_id' : 1} and len(members) == 3
+    assert 1 in members and {'u_id' : 2} in members and 4 not in members
+
+    members.append(1)
+    members.append({'u_id' : 4})
+    members.remove({'u_id' : 3})
+    assert members == [{'u_id' : 1}, {'u_id' : 2}, {'u_id' : 4}]
+    with pytest.raises(ValueError):
+        members.remove(3)
@@ -0,0 +1,74 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    25 April 2021
+'''
+import pytest
+from src import notifications, auth, channels, channel, message, dm, other
+from tests.data_store_test import workspace
+
+#records the changes of each write notifications are saved in
+@pytest.fixture
+def written(monkeypatch):
+    write_data = notifications.write_data
+    writes = []
+    def counted(data, *changes):
+        writes.append(sorted(changes))
+        return write_data(data, *changes)
+    monkeypatch.setattr(notifications, 'write_data', counted)
+    return writes
+
+#the notification messages a user has, newest first
+def notified(token):
+    return [sent['notification_message'] for sent in other.notifications_get(token)['notifications']]
+
+#registers an owner and a few users to notify
+def register_users():
+    return [auth.auth_register(f'{name}@bb.com', 'password', name, 'last') \
+        for name in ['owner', 'first', 'second', 'third']]
+
+#test that everyone tagged in a message is notified in one write
+def test_tag_batch(workspace, written):
+    owner, first, second, third = register_users()
+    channel_id = channels.channels_create(owner['token'], 'channel', True)['channel_id']
+    for joining in [first, second]:
+        channel.channel_join(joining['token'], channel_id)
+    sent = '@firstlast @secondlast @firstlast @thirdlast @nobody'
+    message.message_send(owner['token'], channel_id, sent)
+
+    #each handle is only notified once and third isn't a member of the channel
+    assert written == [[('user', first['auth_user_id']), ('user', second['auth_user_id'])]]
+    tagged = f'ownerlast tagged you in channel: {sent[:20]}'
+    assert notified(first['token']) == notified(second['token']) == [tagged]
+    assert notified(third['token']) == []
+
+#test that a message tagging nobody doesn't write any notifications
+def test_tag_none(workspace, written):
+    owner, first, _, _ = register_users()
+    channel_id = channels.channels_create(owner['token'], 'channel', True)['channel_id']
+    channel.channel_join(first['token'], channel_id)
+    message.message_send(owner['token'], channel_id, 'no tags here')
+    message.message_send(owner['token'], channel_id, 'an email first@bb.com')
+    assert written == []
+
+#test that everyone added to a dm is notified in one write
+def test_invite_batch(workspace, written):
+    owner, first, second, third = register_users()
+    u_ids = [first['auth_user_id'], second['auth_user_id'], third['auth_user_id']]
+    dm_name = dm.dm_create(owner['token'], u_ids)['dm_name']
+    assert written == [[('user', u_id) for u_id in u_ids]]
+    for invited in [first, second, third]:
+        assert notified(invited['token']) == [f'ownerlast added you to {dm_name}']
+    assert notified(owner['token']) == []
+
+#test that notifications about a removed channel or to a removed user are dropped
+def test_deliver_dropped(workspace, written):
+    owner, first, _, _ = register_users()
+    channel_id = channels.channels_create(owner['token'], 'channel', True)['channel_id']
+    notifications.deliver(channel_id + 1, [(first['auth_user_id'], 'dropped')])
+    notifications.deliver(channel_id, [(first['auth_user_id'] + 10, 'dropped'), \
+        (first['auth_user_id'], 'delivered')])
+    assert written == [[('user', first['auth_user_id'])]]
+    assert notified(first['token']) == ['delivered']
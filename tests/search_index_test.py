@@ -0,0 +1,122 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    25 April 2021
+'''
+from src import data_store, search_index, auth, channels, channel, message, dm, other
+from tests.data_store_test import workspace, read_snapshot
+
+#sends a few messages in a channel and a dm, returning the owner's token and their ids
+def send_messages():
+    owner = auth.auth_register('owner@bb.com', 'password', 'owner', 'last')
+    member = auth.auth_register('member@bb.com', 'password', 'member', 'last')
+    channel_id = channels.channels_create(owner['token'], 'channel', True)['channel_id']
+    channel.channel_join(member['token'], channel_id)
+    dm_id = dm.dm_create(owner['token'], [member['auth_user_id']])['dm_id']
+    sent = [message.message_send(owner['token'], channel_id, text)['message_id'] \
+        for text in ['apple pie', 'banana split', 'cherry tart']]
+    sent.append(message.message_senddm(owner['token'], dm_id, 'apple crumble')['message_id'])
+    sent.append(message.message_send(member['token'], channel_id, 'apple juice')['message_id'])
+    return owner, member, dm_id, sent
+
+#the message_ids a search finds
+def found(token, query_str):
+    return sorted(sent['message_id'] for sent in other.search(token, query_str)['messages'])
+
+#checks the index kept up to date as messages changed is the one that would be built now
+def check_index():
+    data = search_index.trigrams['data']
+    assert data is not None
+    postings = {trigram : set(posting) \
+        for trigram, posting in search_index.trigrams['postings'].items()}
+    indexed = dict(search_index.trigrams['channels'])
+    search_index.build(data)
+    assert postings == search_index.trigrams['postings']
+    assert indexed == search_index.trigrams['channels']
+    return search_index.trigrams['postings']
+
+#test that a string's trigrams are every three characters in a row of it
+def test_trigrams_of():
+    assert search_index.trigrams_of('apple') == {'app', 'ppl', 'ple'}
+    assert search_index.trigrams_of('ap') == set()
+
+#test that the candidates are the messages with every trigram of the query
+def test_candidates(workspace):
+    owner, _, _, sent = send_messages()
+    data = data_store.load()
+    assert search_index.candidates(data, 'apple') == {sent[0], sent[3], sent[4]}
+    assert search_index.candidates(data, 'tart') == {sent[2]}
+    assert search_index.candidates(data, 'grape') == set()
+    #every trigram being there doesn't mean the query is, so the text is still checked
+    assert search_index.candidates(data, 'pie split') <= {sent[0], sent[1]}
+    assert found(owner['token'], 'apple') == [sent[0], sent[3], sent[4]]
+    assert found(owner['token'], 'pie split') == []
+
+#test that a query too short to have a trigram looks through every message instead
+def test_candidates_short(workspace):
+    owner, _, _, sent = send_messages()
+    data = data_store.load()
+    assert search_index.candidates(data, 'ap') is None
+    assert search_index.candidates(data, '') is None
+    assert found(owner['token'], 'ap') == [sent[0], sent[3], sent[4]]
+    assert found(owner['token'], 'a') == sent
+
+#test that only the channel of each message is kept, not its text
+def test_index_channels(workspace):
+    owner, _, dm_id, sent = send_messages()
+    found(owner['token'], 'apple')
+    channel_id = data_store.load()['channels'][0]['channel_id']
+    assert search_index.trigrams['channels'] == \
+        {**{message_id : channel_id for message_id in sent}, sent[3] : dm_id}
+
+#test that the index follows messages as they are edited and removed
+def test_index_changes(workspace):
+    owner, member, dm_id, sent = send_messages()
+    assert found(owner['token'], 'apple') == [sent[0], sent[3], sent[4]]
+    postings = search_index.trigrams['postings']
+
+    #the index is changed as it is rather than built again
+    message.message_edit(owner['token'], sent[0], 'grape soda')
+    message.message_remove(owner['token'], sent[1])
+    assert found(owner['token'], 'apple') == [sent[3], sent[4]]
+    assert found(owner['token'], 'grape') == [sent[0]]
+    assert found(owner['token'], 'banana') == []
+    assert search_index.trigrams['postings'] is postings
+    postings = check_index()
+
+    other.admin_user_remove(owner['token'], member['auth_user_id'])
+    assert found(owner['token'], 'apple') == [sent[3]]
+    assert found(owner['token'], 'Removed user') == [sent[4]]
+    assert search_index.trigrams['postings'] is postings
+    postings = check_index()
+
+    dm.dm_remove(owner['token'], dm_id)
+    assert found(owner['token'], 'apple') == []
+    assert search_index.trigrams['postings'] is postings
+    check_index()
+
+    #the text a message had before it changed is let go of once it is saved
+    assert all(not record.messages.replaced for record in data_store.load()['channels'])
+
+#test that the index follows each snapshot as changes are committed
+def test_index_snapshots(workspace):
+    owner, member, dm_id, sent = send_messages()
+    search = lambda query_str: read_snapshot(lambda: found(owner['token'], query_str))
+    assert search('apple') == [sent[0], sent[3], sent[4]]
+    postings = search_index.trigrams['postings']
+
+    def change():
+        message.message_edit(owner['token'], sent[0], 'grape soda')
+        message.message_edit(owner['token'], sent[0], 'grape jelly')
+        message.message_remove(owner['token'], sent[1])
+        other.admin_user_remove(owner['token'], member['auth_user_id'])
+        dm.dm_remove(owner['token'], dm_id)
+    data_store.submit(change)
+    assert search('apple') == []
+    assert search('grape') == [sent[0]]
+    assert search('soda') == []
+    assert search_index.trigrams['data'] is data_store.snapshots['current']['data']
+    assert search_index.trigrams['postings'] is postings
+    check_index()
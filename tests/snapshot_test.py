@@ -0,0 +1,99 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    25 April 2021
+'''
+import threading
+from src import config, data_store, auth, channels, channel, message, user
+from src.data_store import Overlay, REMOVED
+from tests.data_store_test import workspace, read_snapshot
+from tests.storage_test import plain
+
+#test that changed keys are laid over the table until there are too many of them
+def test_share_table(monkeypatch):
+    monkeypatch.setattr(config, 'snapshot_overlay_size', 2)
+    previous = {1 : 'a', 2 : 'b', 3 : 'c'}
+    table = {1 : 'a', 2 : 'changed', 4 : 'added'}
+    shared = data_store.share_table(previous, table, {2, 3})
+    assert isinstance(shared, Overlay) and shared.base is previous
+    assert [shared.get(key) for key in [1, 2, 3, 4]] == ['a', 'changed', None, None]
+    assert shared.changes[3] is REMOVED
+
+    #the next version lays its changes over the same base without changing this one
+    later = data_store.share_table(shared, table, {4})
+    assert isinstance(later, dict) and later == table
+    assert shared.get(4) is None
+    assert data_store.share_table(previous, table, None) == table
+
+#the snapshot read only units would see now
+def latest():
+    return read_snapshot(lambda: data_store.snapshots['current'])
+
+#test that publishing a new version leaves the older ones as they were
+def test_snapshot_unchanged(workspace):
+    owner = auth.auth_register('owner@bb.com', 'password', 'owner', 'last')
+    member = auth.auth_register('member@bb.com', 'password', 'member', 'last')
+    first = channels.channels_create(owner['token'], 'first', True)['channel_id']
+    second = channels.channels_create(owner['token'], 'second', True)['channel_id']
+    sent = [message.message_send(owner['token'], channel_id, 'hello')['message_id'] \
+        for channel_id in [first, second]]
+    older = latest()
+    before = plain(older['data'])
+
+    def change():
+        user.user_profile_setname(member['token'], 'renamed', 'last')
+        channel.channel_join(member['token'], second)
+        message.message_edit(owner['token'], sent[1], 'edited')
+        message.message_send(owner['token'], second, 'another')
+        channels.channels_create(owner['token'], 'third', True)
+    data_store.submit(change)
+    newer = latest()
+    assert newer['version'] > older['version']
+    assert plain(older['data']) == before
+    assert plain(newer['data']) == plain(data_store.load())
+
+    #only what changed was copied, the rest is shared with the older version
+    assert newer['data']['users'][0] is older['data']['users'][0]
+    assert newer['data']['users'][1] is not older['data']['users'][1]
+    assert newer['data']['channels'][0] is older['data']['channels'][0]
+    assert newer['data']['channels'][1] is not older['data']['channels'][1]
+    assert older['index']['channels'].get(3) is None
+    assert newer['index']['channels'].get(3) == 2
+
+#test that a snapshot's index tables are laid over the older ones until too much changed
+def test_snapshot_overlay(workspace, monkeypatch):
+    monkeypatch.setattr(config, 'snapshot_overlay_size', 2)
+    for name in ['a', 'b', 'c', 'd']:
+        auth.auth_register(f'user{name}@bb.com', 'password', 'first', 'last')
+    older = latest()['index']['users']
+    auth.auth_register('usere@bb.com', 'password', 'first', 'last')
+    newer = latest()['index']['users']
+    assert isinstance(newer, Overlay) and newer.base is older
+    assert newer.get(5) == 4 and older.get(5) is None
+
+    for name in ['f', 'g']:
+        auth.auth_register(f'user{name}@bb.com', 'password', 'first', 'last')
+    copied = latest()['index']['users']
+    assert isinstance(copied, dict)
+    assert [copied.get(u_id) for u_id in range(1, 8)] == list(range(7))
+
+#test that a read only unit never sees changes a unit that writes hasn't committed
+def test_snapshot_uncommitted(workspace):
+    auth.auth_register('aa@bb.com', 'password', 'first', 'last')
+    latest()
+    users = []
+    data_store.begin()
+    try:
+        auth.auth_register('cc@bb.com', 'password', 'second', 'last')
+        #the read doesn't wait for the unit that writes to finish
+        reader = threading.Thread(target=lambda: \
+            users.append(read_snapshot(lambda: len(auth.get_data()['users']))))
+        reader.start()
+        reader.join(5)
+        assert users == [1]
+        data_store.commit()
+    finally:
+        data_store.rollback()
+    assert read_snapshot(lambda: len(auth.get_data()['users'])) == 2
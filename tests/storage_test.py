@@ -0,0 +1,172 @@
+'''
+Authors:
+    Alec Dudley-Bestow, z5260201
+
+Date:
+    25 April 2021
+'''
+import json
+import os
+import sqlite3
+import pytest
+from src import config, data_store, sqlite_store, shard_store, files, models, auth, channels, channel, message, dm, user, other
+from tests.data_store_test import workspace, restart, in_other_process
+
+STORAGE = ['json', 'journal', 'sqlite', 'sharded']
+
+#switches to a storage mode, starting from empty files
+def use_storage(monkeypatch, storage):
+    monkeypatch.setattr(config, 'storage', storage)
+    restart()
+    other.clear()
+
+#runs the test once in each storage mode
+@pytest.fixture(params=STORAGE)
+def storage(request, workspace, monkeypatch):
+    use_storage(monkeypatch, request.param)
+    return request.param
+
+#the data as it would be written to data.json, for comparing
+def plain(data):
+    return json.loads(json.dumps(data, default=models.encode))
+
+#makes a little of everything, including records changed after they were made
+def populate():
+    owner = auth.auth_register('owner@bb.com', 'password', 'owner', 'last')
+    member = auth.auth_register('member@bb.com', 'password', 'member', 'last')
+    channel_id = channels.channels_create(owner['token'], 'channel', True)['channel_id']
+    channel.channel_join(member['token'], channel_id)
+    first = message.message_send(owner['token'], channel_id, 'hello @memberlast')['message_id']
+    second = message.message_send(owner['token'], channel_id, 'hi')['message_id']
+    message.message_send(member['token'], channel_id, 'hi back')
+    message.message_edit(owner['token'], first, 'hello again @memberlast')
+    message.message_remove(owner['token'], second)
+    dm_id = dm.dm_create(owner['token'], [member['auth_user_id']])['dm_id']
+    message.message_senddm(member['token'], dm_id, 'in a dm')
+    return owner, member
+
+#test that everything written can be read back after a restart
+def test_round_trip(storage):
+    populate()
+    written = plain(data_store.load())
+    restart()
+    assert plain(data_store.load()) == written
+
+#test that the ids handed out carry on from where they were after a restart
+def test_round_trip_ids(storage):
+    owner, member = populate()
+    restart()
+    login = auth.auth_login('owner@bb.com', 'password')
+    assert login['auth_user_id'] == owner['auth_user_id']
+    new = auth.auth_register('new@bb.com', 'password', 'new', 'last')
+    assert new['auth_user_id'] not in [owner['auth_user_id'], member['auth_user_id']]
+
+#test that a journal cut off part way through its last record is read up to it
+def test_journal_torn(workspace, monkeypatch):
+    use_storage(monkeypatch, 'journal')
+    populate()
+    written = plain(data_store.load())
+    with open(data_store.JOURNAL_FILE, 'a') as f:
+        f.write('{"kind":"user","key":[1],"val')
+
+    restart()
+    assert plain(data_store.load()) == written
+    assert data_store.cache['journal_torn']
+
+    #nothing can follow the torn record, so the next write is a full snapshot
+    auth.auth_register('after@bb.com', 'password', 'after', 'last')
+    assert not data_store.cache['journal_torn']
+    written = plain(data_store.load())
+    restart()
+    assert plain(data_store.load()) == written
+
+#test that only the changed records are appended until a snapshot is due
+def test_journal_snapshot(workspace, monkeypatch):
+    monkeypatch.setattr(config, 'journal_snapshot_every', 10)
+    use_storage(monkeypatch, 'journal')
+    owner = auth.auth_register('owner@bb.com', 'password', 'owner', 'last')
+    with open(data_store.DATA_FILE) as f:
+        snapshot = f.read()
+    channel_id = channels.channels_create(owner['token'], 'channel', True)['channel_id']
+    with open(data_store.DATA_FILE) as f:
+        assert f.read() == snapshot
+    assert data_store.cache['journal_length'] > 0
+
+    for i in range(10):
+        message.message_send(owner['token'], channel_id, f'message {i}')
+    assert data_store.cache['journal_length'] < 10
+    written = plain(data_store.load())
+    restart()
+    assert plain(data_store.load()) == written
+
+#test that the database is only read again after another connection commits to it
+def test_sqlite_other_connection(workspace, monkeypatch):
+    use_storage(monkeypatch, 'sqlite')
+    owner = auth.auth_register('owner@bb.com', 'password', 'owner', 'last')
+    data = data_store.load()
+    assert data_store.load() is data
+
+    connection = sqlite3.connect(sqlite_store.SQLITE_FILE)
+    with connection:
+        connection.execute('UPDATE users SET name_first = ? WHERE u_id = ?', \
+            ('changed', owner['auth_user_id']))
+    connection.close()
+    assert data_store.load()['users'][0]['name_first'] == 'changed'
+
+#test that a write only replaces the rows of the records that changed
+def test_sqlite_rows(workspace, monkeypatch):
+    use_storage(monkeypatch, 'sqlite')
+    _, member = populate()
+    connection = sqlite_store.connect()
+    written = connection.total_changes
+    user.user_profile_setname(member['token'], 'renamed', 'last')
+    changed = connection.total_changes - written
+    assert connection.execute('SELECT name_first FROM users WHERE u_id = ?', \
+        (member['auth_user_id'],)).fetchone() == ('renamed',)
+
+    #the same data written out in full
+    written = connection.total_changes
+    auth.write_data(data_store.load())
+    assert changed < (connection.total_changes - written) / 2
+
+#test that sending a message only rewrites the shard of its channel
+def test_sharded_files(workspace, monkeypatch):
+    use_storage(monkeypatch, 'sharded')
+    owner = auth.auth_register('owner@bb.com', 'password', 'owner', 'last')
+    first = channels.channels_create(owner['token'], 'first', True)['channel_id']
+    second = channels.channels_create(owner['token'], 'second', True)['channel_id']
+    for channel_id in [first, second]:
+        message.message_send(owner['token'], channel_id, 'hello')
+    stamps = [files.file_stamp(filename) for filename in \
+        [shard_store.INDEX_FILE, shard_store.shard_file(first), shard_store.shard_file(second)]]
+
+    message.message_send(owner['token'], first, 'only in the first')
+    assert files.file_stamp(shard_store.INDEX_FILE) == stamps[0]
+    assert files.file_stamp(shard_store.shard_file(first)) != stamps[1]
+    assert files.file_stamp(shard_store.shard_file(second)) == stamps[2]
+
+    dm_id = dm.dm_create(owner['token'], [])['dm_id']
+    message.message_senddm(owner['token'], dm_id, 'hello')
+    assert os.path.exists(shard_store.shard_file(dm_id))
+    dm.dm_remove(owner['token'], dm_id)
+    assert not os.path.exists(shard_store.shard_file(dm_id))
+
+#test that only the shards another process changed are read again
+def test_sharded_reload(workspace, monkeypatch):
+    use_storage(monkeypatch, 'sharded')
+    owner = auth.auth_register('owner@bb.com', 'password', 'owner', 'last')
+    first = channels.channels_create(owner['token'], 'first', True)['channel_id']
+    second = channels.channels_create(owner['token'], 'second', True)['channel_id']
+    for channel_id in [first, second]:
+        message.message_send(owner['token'], channel_id, 'hello')
+    data = data_store.load()
+    messages = [record.messages for record in data['channels']]
+
+    in_other_process("from src import message; " \
+        f"message.message_send('{owner['token']}', {first}, 'from elsewhere')")
+    reloaded = data_store.load()
+    assert reloaded is not data
+    assert [sent['message'] for sent in reloaded['channels'][0]['messages']] \
+        == ['hello', 'from elsewhere']
+    assert reloaded['channels'][0].messages is not messages[0]
+    assert reloaded['channels'][1].messages is messages[1]